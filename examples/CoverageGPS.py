@@ -2,12 +2,16 @@
 
 """
  Example tool to correlate modem connection modes with GPS positions for a node in a time interval.
-  Output is in KML format for Google Earth.
+  Output is in KML/KMZ format for Google Earth or GeoJSON (--format), see MapWriter.
+  Several nodes (--nodeID 54 55 ..., or all nodes of --country/--site) are fetched concurrently
+  and written to one file per node or, with --merged, to a single file.
+  Tracks can be thinned with --tolerance, --minDistance and --gridSize, see TrackSimplify.
+  With --cacheDir, query results are cached on disk for later runs, see QueryCache.
   https://www.monroe-project.eu
   Creator: Miguel Peon Quiros, IMDEA Networks Institute
   mikepeon@imdea.org
 
- Dependencies: sudo pip install cassandra-driver python-dateutil
+ Dependencies: sudo pip install cassandra-driver python-dateutil numpy pandas
 
  Cassandra driver (Python) documentation: https://datastax.github.io/python-driver/index.html
 """
@@ -19,97 +23,49 @@ from datetime import datetime
 from calendar import timegm
 from dateutil.relativedelta import relativedelta
 from decimal import *
+import numpy
+import pandas
+from PagedReader import PagedRows, PartitionedRows, FetchSize, BucketedRows, BucketStarts, BUCKET_SECONDS
+from MapWriter import MapWriter, FORMATS
+from TrackSimplify import Simplify
+from QueryCache import QueryCache, MUTABLE_TTL
+from multiprocessing.pool import ThreadPool
+from collections import deque
 import argparse
-
-def DumpKML(nodeID, startTime, endTime, entries):
-	fileName = "{}_{}_{}.kml".format(nodeID, startTime, endTime)
-	with open(fileName, "wt") as output:
-                # Write KML file headers.
-                output.write("<?xml version=\"1.0\" encoding=\"UTF-8\"?><kml xmlns=\"http://www.opengis.net/kml/2.2\">\n"
-                                "<Document>\n"
-                                "<Style id=\"IconUnknown\">\n"
-				"  <IconStyle>\n"
-				"    <scale>0.5</scale>\n"
-				"    <Icon>\n"
-				"      <href>Mark_Unknown.png</href>\n"
-				"    </Icon>\n"
-				"  </IconStyle>\n"
-				"</Style>\n"
-                                "<Style id=\"IconDisconnected\">\n"
-				"  <IconStyle>\n"
-				"    <scale>0.5</scale>\n"
-				"    <Icon>\n"
-				"      <href>Mark_Disconnected.png</href>\n"
-				"    </Icon>\n"
-				"  </IconStyle>\n"
-				"</Style>\n"
-                                "<Style id=\"IconNoService\">\n"
-				"  <IconStyle>\n"
-				"    <scale>0.5</scale>\n"
-				"    <Icon>\n"
-				"      <href>Mark_NoService.png</href>\n"
-				"    </Icon>\n"
-				"  </IconStyle>\n"
-				"</Style>\n"
-                                "<Style id=\"Icon2G\">\n"
-				"  <IconStyle>\n"
-				"    <scale>0.5</scale>\n"
-				"    <Icon>\n"
-				"      <href>Mark_2G.png</href>\n"
-				"    </Icon>\n"
-				"  </IconStyle>\n"
-				"</Style>\n"
-                                "<Style id=\"Icon3G\">\n"
-				"  <IconStyle>\n"
-				"    <scale>0.5</scale>\n"
-				"    <Icon>\n"
-				"      <href>Mark_3G.png</href>\n"
-				"    </Icon>\n"
-				"  </IconStyle>\n"
-				"</Style>\n"
-                                "<Style id=\"IconLTE\">\n"
-				"  <IconStyle>\n"
-				"    <scale>0.5</scale>\n"
-				"    <Icon>\n"
-				"      <href>Mark_LTE.png</href>\n"
-				"    </Icon>\n"
-				"  </IconStyle>\n"
-				"</Style>\n"
-				"<Folder>\n")
-
-		count = 0
-		for entry in entries:
-			output.write("\n<Placemark>\n"
-				"<description>{}</description>\n"
-				"<styleUrl>{}</styleUrl>\n"
-				"<Point> <coordinates>{},{},{} </coordinates> </Point>\n"
-				"</Placemark>\n".format(
-					entry['description'], entry['iconStyle'], entry['longitude'],
-					entry['latitude'], entry['altitude']))
-			count += 1
-
-                # Write KML file footers.
-		output.write("</Folder>\n</Document>\n</kml>\n")
-
-	print "Dumped {} positions to {}\n".format(count, fileName)
-
+import os
 
 ###############################################################################
-# Returns a list of GPS positions as read from the query rows.
-def FetchPositions(session, startTime, endTime, nodeID):
+#  Returns a list of GPS positions (tuples of GPS_COLUMNS) as read from the query rows. With rmc,
+# they are read from the GPRMC-only table filled by the importer, so no NMEA text is transferred.
+# With cache (a QueryCache), whole days are read through it.
+def FetchPositions(session, startTime, endTime, nodeID, bucketed = False, rmc = False, cache = None):
 	print "Extracting GPS positions for node {} during interval [{}, {})".format(nodeID, startTime, endTime)
 	
-	session.default_fetch_size = 1000
 	gps = []
-	query = "select nmea, nodeid, timestamp, latitude, longitude, altitude, speed, satellitecount from monroe_meta_device_gps where nodeid='{}' and timestamp >= {} and timestamp < {} order by timestamp asc".format(nodeID, startTime, endTime)
-	print query
-	rows = session.execute(query, timeout = None)
+	table = "monroe_meta_device_gps_rmc" if rmc else "monroe_meta_device_gps"
+	columns = ", ".join(GPS_COLUMNS) if rmc else "nmea, " + ", ".join(GPS_COLUMNS)
+	if bucketed:
+		table += "_by_day"
+	if cache is not None:
+		rows = cache.Rows(session, table, columns.split(", "), "nodeid='{}'".format(nodeID), startTime, endTime, FetchSize(table))
+	elif bucketed:
+		# One query per day partition; "{{}}" is replaced by each bucket.
+		query = "select {} from {} where nodeid='{}' and bucket = {{}} and timestamp >= {} and timestamp < {} order by timestamp asc".format(columns, table, nodeID, startTime, endTime)
+		print query
+		rows = BucketedRows(session, table, query, startTime, endTime, FetchSize(table))
+	else:
+		query = "select {} from {} where nodeid='{}' and timestamp >= {} and timestamp < {} order by timestamp asc".format(columns, table, nodeID, startTime, endTime)
+		print query
+		rows = PagedRows(session, query, FetchSize(table))
 	count = 0
 	for row in rows:
 		try:
-			if row.nmea.find("GPRMC") != -1:
+			if rmc:
 				gps.append(row)
 				count += 1
+			elif row.nmea.find("GPRMC") != -1:
+				gps.append(row[1:])
+				count += 1
 		except Exception as error:
 			print "Error in row:", row, error
 	print "Read {} GPS positions\n".format(count)
@@ -117,15 +73,31 @@ def FetchPositions(session, startTime, endTime, nodeID):
 
 
 ###############################################################################
-# Returns a list of modem statuses as read from the query rows.
-def FetchModemStatus(session, startTime, endTime, nodeID, iccids, operator):
+#  Returns a list of modem statuses as read from the query rows. With cache (a QueryCache), each
+# ICCID is read through it and the statuses of all ICCIDs sorted by timestamp.
+def FetchModemStatus(session, startTime, endTime, nodeID, iccids, operator, bucketed = False, cache = None):
 	print "Extracting modem status for node {} during interval [{}, {})".format(nodeID, startTime, endTime)
 	
-	session.default_fetch_size = None
 	modem = []
-	query = "select nodeid,iccid,timestamp,band,devicemode,devicestate,devicesubmode,frequency,interfacename,internalinterface,lac,operator,pci,rscp,rsrp,rsrq,rssi from monroe_meta_device_modem where nodeid='{}' and iccid in ('{}') and timestamp >= {} and timestamp < {} order by timestamp asc".format(nodeID, "','".join(iccids), startTime, endTime)
-	print query
-	rows = session.execute(query, timeout = None)
+	if cache is not None:
+		table = "monroe_meta_device_modem_by_day" if bucketed else "monroe_meta_device_modem"
+		rows = []
+		for iccid in iccids:
+			rows.extend(cache.Rows(session, table, MODEM_COLUMNS, "nodeid='{}' and iccid='{}'".format(nodeID, iccid), startTime, endTime, FetchSize(table)))
+		rows.sort(key = lambda row: row.timestamp)
+	else:
+		# One query per ICCID (and bucket), merged by timestamp: no IN over partitions.
+		if bucketed:
+			query = "select nodeid,iccid,timestamp,band,devicemode,devicestate,devicesubmode,frequency,interfacename,internalinterface,lac,operator,pci,rscp,rsrp,rsrq,rssi from monroe_meta_device_modem_by_day where nodeid='{}' and iccid='{{}}' and bucket={{}} and timestamp >= {} and timestamp < {}".format(nodeID, startTime, endTime)
+			buckets = BucketStarts(startTime, endTime, BUCKET_SECONDS['_by_day'])
+			table = "monroe_meta_device_modem_by_day"
+		else:
+			query = "select nodeid,iccid,timestamp,band,devicemode,devicestate,devicesubmode,frequency,interfacename,internalinterface,lac,operator,pci,rscp,rsrp,rsrq,rssi from monroe_meta_device_modem where nodeid='{}' and iccid='{{}}' and timestamp >= {} and timestamp < {}".format(nodeID, startTime, endTime)
+			buckets = None
+			table = "monroe_meta_device_modem"
+		print query
+		# One stream per ICCID (its buckets one after the other).
+		rows = PartitionedRows(session, query, [(iccid,) for iccid in iccids], FetchSize(table), buckets = buckets)
 	count = 0
 	for row in rows:
 		try:
@@ -139,144 +111,176 @@ def FetchModemStatus(session, startTime, endTime, nodeID, iccids, operator):
 
 
 ###############################################################################
-# Returns the list of iccids associated to the given nodeID
-def FetchNodeICCIDs(session, nodeID):
+# Returns the list of iccids associated to the given nodeID ([] if none).
+def FetchNodeICCIDs(session, nodeID, cache = None):
+	if cache is not None:
+		return cache.Get("devices", ("interfaces", nodeID), lambda: list(FetchNodeICCIDs(session, nodeID)), MUTABLE_TTL)
 	print "Extracting ICCIDs for node {}".format(nodeID)
 	
-	session.default_fetch_size = None
 	query = "select interfaces from devices where nodeid={}".format(nodeID)
 	print query
-	rows = session.execute(query, timeout = None)
-	try:
-		iccids = rows[0].interfaces
-	except Exception as error:
-		print "Error in row:", rows[0], error
-	return iccids
+	rows = list(PagedRows(session, query, None))
+	# Unknown node, or no interfaces.
+	if len(rows) == 0 or rows[0].interfaces is None:
+		print "No ICCIDs for node {}".format(nodeID)
+		return []
+	return list(rows[0].interfaces)
+
+
+###############################################################################
+# Returns the list of (nodeID, iccids) of the nodes of a country, or of a site of a country.
+def FetchSiteNodes(session, country, site):
+	print "Extracting nodes for country {}, site {}".format(country, site)
+
+	if site is None:
+		query = "select nodeid, interfaces from devices where country='{}' allow filtering".format(country)
+	else:
+		query = "select nodeid, interfaces from devices where country='{}' and site='{}'".format(country, site)
+	print query
+	nodes = [(row.nodeid, row.interfaces) for row in PagedRows(session, query, FetchSize("devices"))]
+	print "Read {} nodes\n".format(len(nodes))
+	return nodes
+
+
+###############################################################################
+#  Fetches the GPS positions and modem statuses of a node in parallel (in fetchPool) and joins
+# them. iccids are read from the devices table if None. All queries go through cache if given.
+def FetchNode(fetchPool, session, args, nodeID, iccids, cache = None):
+	if iccids is None:
+		iccids = FetchNodeICCIDs(session, nodeID, cache)
+	print "Node {} has ICCIDs: {}\n".format(nodeID, iccids)
+	gps = fetchPool.apply_async(FetchPositions, (session, args.startTime, args.endTime, nodeID, args.bucketed, args.rmc, cache))
+	modem = fetchPool.apply_async(FetchModemStatus, (session, args.startTime, args.endTime, nodeID, iccids, args.operatorName, args.bucketed, cache))
+	points = JoinGPSAndModem(gps.get(), modem.get(), args.minGPSInterval)
+	return SimplifyPoints(points, args.tolerance, args.minDistance, args.gridSize)
+
+
+#  Yields (nodeID, AsyncResult of FetchNode) for every (nodeID, iccids) of nodes, in order. At most
+# "ahead" nodes are submitted to nodePool before the caller takes their results, so only the
+# points of those nodes are held in memory, however many nodes there are.
+def FetchNodes(nodePool, fetchPool, session, args, nodes, ahead, cache = None):
+	pending = deque()
+	for (nodeID, iccids) in nodes:
+		pending.append((nodeID, nodePool.apply_async(FetchNode, (fetchPool, session, args, nodeID, iccids, cache))))
+		if len(pending) >= ahead:
+			yield pending.popleft()
+	while len(pending) > 0:
+		yield pending.popleft()
+
+
+###############################################################################
+# Columns of the rows returned by FetchPositions and FetchModemStatus.
+GPS_COLUMNS = ['nodeid', 'timestamp', 'latitude', 'longitude', 'altitude', 'speed', 'satellitecount']
+MODEM_COLUMNS = ['nodeid', 'iccid', 'timestamp', 'band', 'devicemode', 'devicestate', 'devicesubmode', 'frequency', 'interfacename', 'internalinterface', 'lac', 'operator', 'pci', 'rscp', 'rsrp', 'rsrq', 'rssi']
+
+# Returns the GPS rows as a DataFrame with float coordinates and speed in Km/h.
+def GPSFrame(gps):
+	frame = pandas.DataFrame.from_records(gps, columns = GPS_COLUMNS)
+	for column in ('timestamp', 'latitude', 'longitude', 'altitude', 'speed'):
+		frame[column] = pandas.to_numeric(frame[column], errors = 'coerce')
+	frame['speed'] *= 1.852	# Knots to Km/h
+	return frame.sort_values('timestamp', kind = 'mergesort')
+
+# Returns the modem rows as a DataFrame. modemIndex identifies each modem status.
+def ModemFrame(modem):
+	frame = pandas.DataFrame.from_records(modem, columns = MODEM_COLUMNS).drop('nodeid', axis = 1)
+	frame['timestamp'] = pandas.to_numeric(frame['timestamp'], errors = 'coerce')
+	frame = frame.sort_values('timestamp', kind = 'mergesort')
+	frame['modemIndex'] = numpy.arange(len(frame))
+	return frame
+
+
+###############################################################################
+#  Joins a list of GPS positions and a list of modem statuses based on timestamp: for every
+# GPS position and ICCID, the last known status of that ICCID's modem (as-of join). Positions
+# before the first status of an ICCID are dropped.
+#  With minGPSInterval > 0, a position is kept only if it falls in a different
+# minGPSInterval-long time slot than the previous one or the modem status changed.
+#  Returns a DataFrame with one row per kept position and ICCID, in timestamp order.
+def JoinGPSAndModem(gps, modem, minGPSInterval):
+	gpsFrame = GPSFrame(gps)
+	modemFrame = ModemFrame(modem)
+
+	parts = []
+	for (iccid, statuses) in modemFrame.groupby('iccid', sort = False):
+		joined = pandas.merge_asof(gpsFrame, statuses, on = 'timestamp', direction = 'backward')
+		# Restore the modem column types (int columns become float while unmatched rows exist).
+		joined = joined[joined['modemIndex'].notnull()].astype(statuses.dtypes.to_dict())
+		if minGPSInterval > 0:
+			slot = numpy.floor(joined['timestamp'] / minGPSInterval)
+			keep = (slot != slot.shift()) | (joined['modemIndex'] != joined['modemIndex'].shift())
+			joined = joined[keep]
+		parts.append(joined)
+
+	if len(parts) == 0:
+		return pandas.DataFrame(columns = list(gpsFrame.columns) + list(modemFrame.columns.drop('timestamp')))
+	return pandas.concat(parts).sort_values('timestamp', kind = 'mergesort').reset_index(drop = True)
 
 
 ###############################################################################
-#  Traverses a list of GPS positions and a list of modem statuses and combines
-# them based on timestamp.
-#  Returns a list of position-modem status.
-def TraverseGPSAndModem(gps, modem, minGPSInterval):
-	combinedEntries = []
-	lastModem = None
-	lastGPS = None
-	lastTimestamp = 0
-	iModem = 0
-	iGPS = 0
-	while (iModem < len(modem)) and (iGPS < len(gps)):	# TODO Change to or and check for buffer overruns.
-		filteredPos = False	# Marks whether we are skipping a GPS position or not.
-		# Update the last known GPS and modem entries.
-		if (gps[iGPS].timestamp == modem[iModem].timestamp):
-			lastGPS = gps[iGPS]
-			lastModem = modem[iModem]
-			lastTimestamp = lastGPS.timestamp
-			iGPS += 1
-			iModem += 1
-		elif (gps[iGPS].timestamp < modem[iModem].timestamp):
-			if (gps[iGPS].timestamp >= (lastTimestamp + minGPSInterval)):
-				lastGPS = gps[iGPS]
-				lastTimestamp = lastGPS.timestamp
-			else:
-				filteredPos = True
-			iGPS += 1
-		else:	# gps[iGPS].timestamp > modem[iModem].timestamp
-			lastModem = modem[iModem]
-			lastTimestamp = lastModem.timestamp
-			iModem += 1
-
-		# Create a new entry with the last known GPS and modem values
-		if (lastGPS != None) and (lastModem != None) and not filteredPos:
-			iconStyle = "#IconUnknown" if lastModem.devicemode == 0 else "#IconDisconnected" if lastModem.devicemode == 1 else "#IconNoService" if lastModem.devicemode == 2 else "#Icon2G" if lastModem.devicemode == 3 else "#Icon3G" if lastModem.devicemode == 4 else "#IconLTE" if lastModem.devicemode == 5 else "#IconUnknown"
-			try:
-				combinedEntries.append(
-					{'description': 
-						"Node: {}\nTimestamp: {}\nLatitude: {} {}\nLongitude: {} {}\nAltitude: {}\n"
-						"Speed: {} Km/h\nSatellites: {}\n"
-						"Modem mode: {}\nModem submode: {}\n"
-						"ICCID: {}\nBand: {}\nDeviceState: {}\n"
-						"Frequency: {}\nInterfaceName: {}\nInternalInterface: {}\n"
-						"LAC: {}\nOperator: {}\nPCI: {}\nRSCP: {}\nRSRP: {}\nRSSI: {}".format(
-							lastGPS.nodeid, lastGPS.timestamp,						
-                        	                	lastGPS.latitude, 'N' if lastGPS.latitude >= 0.0 else 'S',
-                                	        	lastGPS.longitude, 'E' if lastGPS.longitude >= 0.0 else 'W',
-                                        		lastGPS.altitude, 
-							lastGPS.speed * Decimal('1.852') if lastGPS.speed != None else lastGPS.speed,
-							lastGPS.satellitecount,
-							"Unknown (0)" if lastModem.devicemode == 0 
-								else "Disconnected (1)" if lastModem.devicemode == 1 
-								else "No service (2)" if lastModem.devicemode == 2 
-								else "2G (3)" if lastModem.devicemode == 3 
-								else "3G (4)" if lastModem.devicemode == 4 
-								else "LTE (5)" if lastModem.devicemode == 5 
-								else "None" if lastModem.devicemode == None 
-								else "?? ({})".format(lastModem.devicemode),
-							"Unknown (0)" if lastModem.devicesubmode == 0 
-								else "UMTS (1)" if lastModem.devicesubmode == 1 
-								else "WCDMA (2)" if lastModem.devicesubmode == 2 
-								else "EVDO (3)" if lastModem.devicesubmode == 3 
-								else "HSPA (4)" if lastModem.devicesubmode == 4 
-								else "HSPA+ (5)" if lastModem.devicesubmode == 5 
-								else "DC HSPA (6)" if lastModem.devicesubmode == 6 
-								else "DC HSPA+ (7)" if lastModem.devicesubmode == 7 
-								else "HSDPA (8)" if lastModem.devicesubmode == 8 
-								else "HSUPA (9)" if lastModem.devicesubmode == 9 
-								else "HSDPA+HSUPA (10)" if lastModem.devicesubmode == 10 
-								else "HSDPA+ (11)" if lastModem.devicesubmode == 11 
-								else "HSDPA+HSUPA (12)" if lastModem.devicesubmode == 12 
-								else "DC HSDPA+ (13)" if lastModem.devicesubmode == 13 
-								else "DC HSDPA + HSUPA (14)" if lastModem.devicesubmode == 14 
-								else "None" if lastModem.devicesubmode == None 
-								else "?? ({})".format(lastModem.devicesubmode),
-							lastModem.iccid, lastModem.band, 
-							"Unknown (0)" if lastModem.devicestate == 0 
-								else "Registered (1)" if lastModem.devicestate == 1 
-								else "Unregistered (2)" if lastModem.devicestate == 2 
-								else "Connected (3)" if lastModem.devicestate == 3 
-								else "Disconnected (4)" if lastModem.devicestate == 4 
-								else "None" if lastModem.devicestate == None 
-								else "?? ({})".format(lastModem.devicestate),
-							lastModem.frequency, 
-							lastModem.interfacename, lastModem.internalinterface, lastModem.lac,
-							lastModem.operator.encode('latin-1'), lastModem.pci, lastModem.rscp, lastModem.rsrp,
-							lastModem.rssi),
-					'iconStyle': iconStyle,
-					'longitude': lastGPS.longitude,
-					'latitude': lastGPS.latitude,
-					'altitude': lastGPS.altitude
-					} )
-			except Exception as error:
-				print "-------------------- EXCEPTION: ", error
-				print lastGPS
-				print lastModem
-				print "--------------------"
-	return combinedEntries
+#  Simplifies the track of every ICCID (see TrackSimplify.Simplify), keeping the positions where
+# the modem mode changes. Returns points unchanged if tolerance, minDistance and gridSize are 0.
+def SimplifyPoints(points, tolerance, minDistance, gridSize):
+	if (tolerance <= 0 and minDistance <= 0 and gridSize <= 0) or len(points) == 0:
+		return points
+	mask = numpy.zeros(len(points), dtype = bool)
+	for (iccid, rows) in points.groupby('iccid', sort = False).indices.items():
+		track = points.iloc[rows]
+		mask[rows] = Simplify(track['latitude'].values, track['longitude'].values, track['devicemode'].values,
+			tolerance, minDistance, gridSize)
+	print "Simplified track: kept {} of {} positions\n".format(mask.sum(), len(points))
+	return points[mask].reset_index(drop = True)
 
 
 ###############################################################################
 def ParseCommandLine():
 	parser = argparse.ArgumentParser(description = "Modem status - GPS to KML mapper")
 
-	parser.add_argument('-n', '--nodeID', help = 'ID of the node to analyze', required = True, type = int)
+	parser.add_argument('-n', '--nodeID', help = 'ID(s) of the node(s) to analyze', required = False, type = int, nargs = '+')
+	parser.add_argument('-C', '--country', help = 'Analyze all nodes of this country (devices table)', required = False, type = str)
+	parser.add_argument('-S', '--site', help = 'Analyze all nodes of this site (requires --country)', required = False, type = str)
+	parser.add_argument('-f', '--format', help = 'Output format (default kml)', required = False, choices = FORMATS, default = 'kml')
+	parser.add_argument('-m', '--merged', help = 'Write all nodes to a single file', required = False, action = 'store_true')
+	parser.add_argument('-c', '--concurrency', help = 'Number of nodes fetched in parallel (default 4)', required = False, type = int, default = 4)
 	parser.add_argument('-s', '--startTime', help = 'Starting timestamp', required = True, type = int)
 	parser.add_argument('-e', '--endTime', help = 'Ending timestamp (+24 hours by default)', required = False, type = int, default = 0)
 	parser.add_argument('-o', '--operatorName', help = 'Name of the operator to filter (beware of issues when not filtering!). E.g., "voda ES"', required = False, type = str)
 	parser.add_argument('-i', '--minGPSInterval', help = 'Minimum interval between GPS positions with the same modem data', required = False, type = int, default = 0)
+	parser.add_argument('-t', '--tolerance', help = 'Simplify the tracks (Douglas-Peucker) with this tolerance in metres', required = False, type = float, default = 0)
+	parser.add_argument('-d', '--minDistance', help = 'Keep one GPS position every minDistance metres travelled', required = False, type = float, default = 0)
+	parser.add_argument('-g', '--gridSize', help = 'Keep one GPS position per modem mode in every gridSize x gridSize metres cell', required = False, type = float, default = 0)
+	parser.add_argument('-b', '--bucketed', help = 'Read the time-bucketed (_by_day) variants of the GPS and modem tables', required = False, action = 'store_true')
+	parser.add_argument('-R', '--rmc', help = 'Read the GPS positions from the GPRMC-only table (monroe_meta_device_gps_rmc)', required = False, action = 'store_true')
+	parser.add_argument('--cacheDir', help = 'Cache the query results in this directory for later runs (e.g., ~/.monroe_cache)', required = False, type = str)
+	parser.add_argument('--cacheSize', help = 'Maximum size of the cache in MB (default 2048)', required = False, type = int, default = 2048)
 
 	args = parser.parse_args()
 
 	# Validate args
 	if (args.endTime < args.startTime):
 		args.endTime = args.startTime + 3600*24
+	if (args.nodeID is None) and (args.country is None):
+		parser.error("either --nodeID or --country is required")
+	if (args.site is not None) and (args.country is None):
+		parser.error("--site requires --country")
+	if (args.concurrency < 1):
+		args.concurrency = 1
 
 	# Print parameters
 	print "Modem status - GPS to KML mapper runs with the following parameters:"
 	print "NodeID: {}".format(args.nodeID)
+	print "Country: {}".format(args.country)
+	print "Site: {}".format(args.site)
+	print "Format: {}".format(args.format)
+	print "Merged: {}".format(args.merged)
+	print "Concurrency: {}".format(args.concurrency)
 	print "StartTime: {}".format(args.startTime)
 	print "EndTime: {}".format(args.endTime)
 	print "OperatorName: {}".format(args.operatorName)
 	print "MinGPSInterval: {}".format(args.minGPSInterval)
+	print "Bucketed: {}".format(args.bucketed)
+	print "RMC: {}".format(args.rmc)
+	print "CacheDir: {}".format(args.cacheDir)
 
 	return args
 
@@ -293,18 +297,52 @@ if __name__ == '__main__':
 	session.default_timeout = None
 	session.default_fetch_size = 1000
 
-	iccids = FetchNodeICCIDs(session, args.nodeID)
-	print "Node {} has ICCIDs: {}\n".format(args.nodeID, iccids)
-        gps = FetchPositions(session, args.startTime, args.endTime, args.nodeID);
-	modem = FetchModemStatus(session, args.startTime, args.endTime, args.nodeID, iccids, args.operatorName);
-	combinedEntries = TraverseGPSAndModem(gps, modem, args.minGPSInterval)
-	DumpKML(args.nodeID, args.startTime, args.endTime, combinedEntries)
-
-	#print "Total combined entries: {}".format(len(combinedEntries))
-	#for entry in combinedEntries:
-	#	print "{}, {}, {}, {}".format(
-	#		entry['description'], entry['longitude'], entry['latitude'], entry['altitude'])
-	#	print "------------\n"
+	cache = None
+	if args.cacheDir is not None:
+		cache = QueryCache(os.path.expanduser(args.cacheDir), args.cacheSize*1024**2)
+
+	if args.nodeID is not None:
+		nodes = [(nodeID, None) for nodeID in args.nodeID]
+	else:
+		nodes = FetchSiteNodes(session, args.country, args.site)
+
+	# Nodes run in nodePool, their GPS and modem queries in fetchPool (never the same pool, so
+	#  waiting nodes cannot starve the queries they wait for).
+	nodePool = ThreadPool(processes = args.concurrency)
+	fetchPool = ThreadPool(processes = 2*args.concurrency)
+	# Nodes are fetched at most 2*concurrency ahead of the one being written.
+	results = FetchNodes(nodePool, fetchPool, session, args, nodes, 2*args.concurrency, cache)
+
+	mergedWriter = None
+	if args.merged:
+		label = args.country if args.nodeID is None else "-".join(str(nodeID) for nodeID in args.nodeID)
+		if args.site is not None:
+			label += "-" + args.site
+		mergedWriter = MapWriter("{}_{}_{}".format(label, args.startTime, args.endTime), args.format)
+
+	# Every node is written as soon as it is ready and then released.
+	for (nodeID, result) in results:
+		try:
+			points = result.get()
+		except Exception as error:
+			print "Error in node:", nodeID, error
+			continue
+		if mergedWriter is not None:
+			mergedWriter.Write(points.itertuples(index = False))
+		else:
+			writer = MapWriter("{}_{}_{}".format(nodeID, args.startTime, args.endTime), args.format)
+			writer.Write(points.itertuples(index = False))
+			writer.Close()
+		(points, result) = (None, None)
+	nodePool.close()
+	fetchPool.close()
+
+	if mergedWriter is not None:
+		mergedWriter.Close()
+	if cache is not None:
+		print cache.Stats()
+
+	#print "Total combined points: {}".format(len(points))
 	#print "------ GPS ------"
 	#for ii in gps:
 	#	print "{}, {}, {}, {}".format(ii.timestamp, ii.latitude, ii.longitude, ii.altitude)
@@ -6,7 +6,13 @@
   Creator: Miguel Peon Quiros, IMDEA Networks Institute
   mikepeon@imdea.org
 
- Dependencies: sudo pip install cassandra-driver python-dateutil
+ Positions can be thinned with --tolerance, --minDistance and --gridSize (see TrackSimplify),
+  which then need numpy. With --cacheDir, the positions of whole days are read through a local
+  on-disk cache (see QueryCache). With --bucketed, they are read from the time-bucketed (_by_day)
+  variant of the table, one day partition after the other. E.g.:
+    ./GPS2KML.py --nodeID 54 --startTime 1473940800 --endTime 1473944400 --tolerance 10
+
+ Dependencies: sudo pip install cassandra-driver python-dateutil [numpy]
 
  Cassandra driver (Python) documentation: https://datastax.github.io/python-driver/index.html
 """
@@ -18,15 +24,23 @@ from datetime import datetime
 from calendar import timegm
 from dateutil.relativedelta import relativedelta
 from decimal import *
+from PagedReader import PagedRows, BucketedRows, FetchSize
+import argparse
+import os
 
-def DumpPositions(session, startTime, endTime, nodeID):
+#  With tolerance, minDistance or gridSize (metres) > 0, the GPRMC positions are buffered and
+# simplified with TrackSimplify.Simplify before writing; otherwise they are streamed.
+#  With rmc, the positions are read from the GPRMC-only table filled by the importer
+# (monroe_meta_device_gps_rmc), so no NMEA text is transferred.
+#  With bucketed, the positions are read from the time-bucketed (_by_day) variant of the table.
+#  With cache (a QueryCache), the rows are read through it.
+def DumpPositions(session, startTime, endTime, nodeID, tolerance = 0, minDistance = 0, gridSize = 0, rmc = False, cache = None, bucketed = False):
 	print "\n======================================================================"
 	print "======================================================================"
 	print "======================================================================"
 	print "Extracting GPS positions for node {} during interval [{}, {})\n".format(nodeID, startTime, endTime)
 	
 	########## monroe_meta_device_gps #################
-	session.default_fetch_size = 1000
 	fileName = "{}_{}_{}.kml".format(nodeID, startTime, endTime)
 	with open(fileName, "wt") as output:
                 # Write KML file headers.
@@ -42,13 +56,31 @@ def DumpPositions(session, startTime, endTime, nodeID):
 				#"</Style>\n"
 				"<Folder>\n")
 
-		query = "select nmea, nodeid, timestamp, latitude, longitude, altitude, speed, satellitecount from monroe_meta_device_gps where nodeid='{}' and timestamp >= {} and timestamp < {} order by timestamp".format(nodeID, startTime, endTime)
-		print query
-		rows = session.execute(query, timeout=None)
+		if rmc:
+			table = "monroe_meta_device_gps_rmc"
+			columns = ["nodeid", "timestamp", "latitude", "longitude", "altitude", "speed", "satellitecount"]
+		else:
+			table = "monroe_meta_device_gps"
+			columns = ["nmea", "nodeid", "timestamp", "latitude", "longitude", "altitude", "speed", "satellitecount"]
+		if bucketed:
+			table += "_by_day"
+		if cache is not None:
+			rows = cache.Rows(session, table, columns, "nodeid='{}'".format(nodeID), startTime, endTime, FetchSize(table))
+		elif bucketed:
+			# One query per day partition; "{{}}" is replaced by each bucket.
+			query = "select {} from {} where nodeid='{}' and bucket = {{}} and timestamp >= {} and timestamp < {} order by timestamp".format(", ".join(columns), table, nodeID, startTime, endTime)
+			print query
+			rows = BucketedRows(session, table, query, startTime, endTime, FetchSize(table))
+		else:
+			query = "select {} from {} where nodeid='{}' and timestamp >= {} and timestamp < {} order by timestamp".format(", ".join(columns), table, nodeID, startTime, endTime)
+			print query
+			rows = PagedRows(session, query, FetchSize(table))
+		if tolerance > 0 or minDistance > 0 or gridSize > 0:
+			rows = SimplifyRows(rows, tolerance, minDistance, gridSize, rmc)
 		count = 0
 		for row in rows:
 			try:
-				if row.nmea.find("GPRMC") != -1:
+				if rmc or row.nmea.find("GPRMC") != -1:
 					description = "Latitud: {} {}\nLongitud: {} {}\nAltitud: {}\nVelocidad: {} Km/h\n".format(
                                         	row.latitude, 'N' if row.latitude >= 0.0 else 'S',
                                         	row.longitude, 'E' if row.longitude >= 0.0 else 'W',
@@ -68,7 +100,42 @@ def DumpPositions(session, startTime, endTime, nodeID):
 	print "Dumped {} positions to {}\n".format(count, fileName)
 
 
+# Returns the GPRMC rows with valid coordinates kept by TrackSimplify.Simplify.
+def SimplifyRows(rows, tolerance, minDistance, gridSize, rmc = False):
+	from TrackSimplify import Simplify
+	rows = [row for row in rows if (rmc or row.nmea.find("GPRMC") != -1) and row.latitude is not None and row.longitude is not None]
+	mask = Simplify([float(row.latitude) for row in rows], [float(row.longitude) for row in rows], None,
+		tolerance, minDistance, gridSize)
+	print "Simplified track: kept {} of {} positions".format(mask.sum(), len(rows))
+	return [row for (row, keep) in zip(rows, mask) if keep]
+
+
+###############################################################################
+def ParseCommandLine():
+	parser = argparse.ArgumentParser(description = "GPS positions to KML")
+
+	parser.add_argument('-n', '--nodeID', help = 'ID(s) of the node(s) to dump, one KML file per node', required = True, type = int, nargs = '+')
+	parser.add_argument('-s', '--startTime', help = 'Starting timestamp', required = True, type = int)
+	parser.add_argument('-e', '--endTime', help = 'Ending timestamp (+24 hours by default)', required = False, type = int, default = 0)
+	parser.add_argument('-t', '--tolerance', help = 'Simplify the tracks (Douglas-Peucker) with this tolerance in metres', required = False, type = float, default = 0)
+	parser.add_argument('-d', '--minDistance', help = 'Keep one GPS position every minDistance metres travelled', required = False, type = float, default = 0)
+	parser.add_argument('-g', '--gridSize', help = 'Keep one GPS position in every gridSize x gridSize metres cell', required = False, type = float, default = 0)
+	parser.add_argument('-R', '--rmc', help = 'Read the GPS positions from the GPRMC-only table (monroe_meta_device_gps_rmc)', required = False, action = 'store_true')
+	parser.add_argument('-b', '--bucketed', help = 'Read the time-bucketed (_by_day) variant of the GPS table', required = False, action = 'store_true')
+	parser.add_argument('--cacheDir', help = 'Cache the query results in this directory for later runs (e.g., ~/.monroe_cache)', required = False, type = str)
+	parser.add_argument('--cacheSize', help = 'Maximum size of the cache in MB (default 2048)', required = False, type = int, default = 2048)
+
+	args = parser.parse_args()
+
+	# Validate args
+	if (args.endTime < args.startTime):
+		args.endTime = args.startTime + 3600*24
+
+	return args
+
+###############################################################################
 if __name__ == '__main__':
+	args = ParseCommandLine()
 
 	auth = PlainTextAuthProvider(username = "xxxx", password = "yyyy")
 	cluster = Cluster(contact_points = ['127.0.0.1'], port = 9042, auth_provider = auth)
@@ -77,10 +144,17 @@ if __name__ == '__main__':
 	session.default_timeout = None
 	session.default_fetch_size = 1000
 
-	# Thu Sep 15 2016 14:00:00 GMT+0200 (Romance Daylight Time)
-	DumpPositions(session, 1473940800, 1473940800 + 3600*1, 54);
+	cache = None
+	if args.cacheDir is not None:
+		from QueryCache import QueryCache
+		cache = QueryCache(os.path.expanduser(args.cacheDir), args.cacheSize*1024**2)
+
+	for nodeID in args.nodeID:
+		DumpPositions(session, args.startTime, args.endTime, nodeID, args.tolerance, args.minDistance, args.gridSize, args.rmc, cache, args.bucketed)
+
+	if cache is not None:
+		print cache.Stats()
 
 	cluster.shutdown() # Closes connection to the DB and frees resources.
 
 	print "DUMP FINISHED.\n"
-
@@ -0,0 +1,170 @@
+#!/usr/bin/python
+
+"""
+ Example tool to find the measurements done near a place: the GPS positions of all nodes inside
+  a bounding box during a time interval, joined with the modem status and ping RTT of every ICCID
+  of the node at each position. Output is a CSV file.
+  https://www.monroe-project.eu
+
+ Positions are read from the geohash index monroe_meta_device_gps_geo (filled by the importer,
+  see importer/monroe_geo.py): the bounding box is covered with geohash cells and one partition
+  is read per cell and day, instead of the GPS data of every node. The modem statuses and pings
+  are then read only for the nodes found, and joined as in CoverageGPS.
+
+ Dependencies: sudo pip install cassandra-driver numpy pandas
+
+ Cassandra driver (Python) documentation: https://datastax.github.io/python-driver/index.html
+"""
+
+from cassandra.cluster import Cluster
+from cassandra.auth import PlainTextAuthProvider
+from multiprocessing.pool import ThreadPool
+import pandas
+from PagedReader import PagedRows, FetchSize, BucketStarts
+from CoverageGPS import FetchModemStatus, FetchNodeICCIDs, JoinGPSAndModem, GPS_COLUMNS
+import argparse
+import os
+import sys
+
+# The geohash index of the importer (monroe_geo.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "importer"))
+import monroe_geo
+
+MAX_CELLS = 10000
+
+###############################################################################
+# Returns the sorted list of geohash cells covering a bounding box.
+def CoveringCells(minLat, minLon, maxLat, maxLon, precision = monroe_geo.PRECISION):
+	cellHeight = 180.0 / 2**(5 * precision // 2)
+	cellWidth = 360.0 / 2**((5 * precision + 1) // 2)
+	rows = int((maxLat + 90.0) // cellHeight) - int((minLat + 90.0) // cellHeight) + 1
+	columns = int((maxLon + 180.0) // cellWidth) - int((minLon + 180.0) // cellWidth) + 1
+	if rows * columns > MAX_CELLS:
+		raise ValueError("The bounding box covers {} geohash cells (max {})".format(rows * columns, MAX_CELLS))
+	# Cell centres, starting at the cell containing (minLat, minLon).
+	firstLat = ((minLat + 90.0) // cellHeight + 0.5) * cellHeight - 90.0
+	firstLon = ((minLon + 180.0) // cellWidth + 0.5) * cellWidth - 180.0
+	cells = set()
+	for row in range(rows):
+		for column in range(columns):
+			cells.add(monroe_geo.encode(min(firstLat + row * cellHeight, 90.0), min(firstLon + column * cellWidth, 180.0), precision))
+	return sorted(cells)
+
+
+###############################################################################
+#  Returns the GPS positions (tuples of GPS_COLUMNS) inside the bounding box during [startTime,
+# endTime), reading one cell and day partition per query, concurrency queries at a time.
+def FetchPositionsInBox(session, minLat, minLon, maxLat, maxLon, startTime, endTime, concurrency):
+	cells = CoveringCells(minLat, minLon, maxLat, maxLon)
+	buckets = BucketStarts(startTime, endTime, monroe_geo.BUCKET_SECONDS)
+	print "Extracting GPS positions in [{}, {}] x [{}, {}] during interval [{}, {}): {} cells, {} days".format(
+		minLat, maxLat, minLon, maxLon, startTime, endTime, len(cells), len(buckets))
+
+	query = "select nodeid, timestamp, latitude, longitude, altitude, speed, satellitecount from monroe_meta_device_gps_geo where geohash='{}' and bucket={} and timestamp >= {} and timestamp < {}"
+	def FetchPartition(partition):
+		(cell, bucket) = partition
+		rows = PagedRows(session, query.format(cell, bucket, startTime, endTime), FetchSize("monroe_meta_device_gps_geo"))
+		# Cells extend beyond the bounding box.
+		return [tuple(row) for row in rows if row.latitude is not None and row.longitude is not None and
+			minLat <= row.latitude <= maxLat and minLon <= row.longitude <= maxLon]
+
+	pool = ThreadPool(processes = concurrency)
+	partitions = [(cell, bucket) for cell in cells for bucket in buckets]
+	gps = []
+	for rows in pool.imap_unordered(FetchPartition, partitions):
+		gps.extend(rows)
+	pool.close()
+	pool.join()
+	print "Read {} GPS positions\n".format(len(gps))
+	return gps
+
+
+###############################################################################
+# Returns a DataFrame with the pings of a node (iccid, pingtimestamp, rtt) during [startTime, endTime).
+def FetchPings(session, startTime, endTime, nodeID, iccids):
+	query = "select iccid, timestamp, rtt from monroe_exp_ping where nodeid='{}' and iccid in ('{}') and timestamp >= {} and timestamp < {}".format(nodeID, "','".join(iccids), startTime, endTime)
+	print query
+	pings = pandas.DataFrame.from_records([tuple(row) for row in PagedRows(session, query, FetchSize("monroe_exp_ping"))],
+		columns = ['iccid', 'pingtimestamp', 'rtt'])
+	pings['pingtimestamp'] = pandas.to_numeric(pings['pingtimestamp'], errors = 'coerce')
+	pings['timestamp'] = pings['pingtimestamp']
+	return pings.sort_values('timestamp', kind = 'mergesort')
+
+#  Joins the positions of a node with the modem status of each of its ICCIDs (see
+# CoverageGPS.JoinGPSAndModem) and the closest ping of that ICCID within window seconds.
+def JoinNode(session, nodeID, gps, window, operator):
+	startTime = min(position[1] for position in gps)
+	endTime = max(position[1] for position in gps) + 1
+	iccids = FetchNodeICCIDs(session, nodeID)
+	if not iccids:
+		return None
+	# Modem statuses from window seconds before the first position, so that it has one.
+	modem = FetchModemStatus(session, startTime - window, endTime, nodeID, iccids, operator)
+	points = JoinGPSAndModem(gps, modem, 0)
+	pings = FetchPings(session, startTime - window, endTime + window, nodeID, iccids)
+	if len(points) == 0 or len(pings) == 0:
+		points['pingtimestamp'] = None
+		points['rtt'] = None
+		return points
+	return pandas.merge_asof(points, pings, on = 'timestamp', by = 'iccid', direction = 'nearest', tolerance = window)
+
+#  Returns a DataFrame with the positions inside the bounding box during [startTime, endTime) and
+# their modem and ping data.
+def QueryBox(session, minLat, minLon, maxLat, maxLon, startTime, endTime, window = 60, operator = None, concurrency = 8):
+	gps = FetchPositionsInBox(session, minLat, minLon, maxLat, maxLon, startTime, endTime, concurrency)
+	nodes = {}
+	for position in gps:
+		nodes.setdefault(position[0], []).append(position)
+	parts = []
+	for (nodeID, positions) in sorted(nodes.items()):
+		points = JoinNode(session, nodeID, positions, window, operator)
+		if points is not None:
+			parts.append(points)
+	if len(parts) == 0:
+		return pandas.DataFrame(columns = GPS_COLUMNS)
+	return pandas.concat(parts).sort_values(['nodeid', 'timestamp'], kind = 'mergesort').reset_index(drop = True)
+
+
+###############################################################################
+def ParseCommandLine():
+	parser = argparse.ArgumentParser(description = "Measurements in a bounding box")
+
+	parser.add_argument('-b', '--box', help = 'Bounding box: minLatitude minLongitude maxLatitude maxLongitude', required = True, type = float, nargs = 4)
+	parser.add_argument('-s', '--startTime', help = 'Starting timestamp', required = True, type = int)
+	parser.add_argument('-e', '--endTime', help = 'Ending timestamp (+24 hours by default)', required = False, type = int, default = 0)
+	parser.add_argument('-w', '--window', help = 'Maximum seconds between a position and its modem status or ping (default 60)', required = False, type = int, default = 60)
+	parser.add_argument('-o', '--operatorName', help = 'Name of the operator to filter. E.g., "voda ES"', required = False, type = str)
+	parser.add_argument('-c', '--concurrency', help = 'Number of partitions read in parallel (default 8)', required = False, type = int, default = 8)
+
+	args = parser.parse_args()
+
+	# Validate args
+	if (args.endTime < args.startTime):
+		args.endTime = args.startTime + 3600*24
+	(minLat, minLon, maxLat, maxLon) = args.box
+	if minLat > maxLat or minLon > maxLon:
+		parser.error("--box must be minLatitude minLongitude maxLatitude maxLongitude")
+
+	return args
+
+###############################################################################
+if __name__ == '__main__':
+	args = ParseCommandLine()
+
+	# Connect to the DB
+	auth = PlainTextAuthProvider(username = "xxxx", password = "yyyy")
+	cluster = Cluster(contact_points = ['127.0.0.1'], port = 9042, auth_provider = auth)
+	session = None
+	session = cluster.connect("monroe") # Set default keyspace to 'monroe'
+	session.default_timeout = None
+	session.default_fetch_size = 1000
+
+	(minLat, minLon, maxLat, maxLon) = args.box
+	points = QueryBox(session, minLat, minLon, maxLat, maxLon, args.startTime, args.endTime, args.window, args.operatorName, args.concurrency)
+	fileName = "{}_{}_{}_{}_{}_{}.csv".format(minLat, minLon, maxLat, maxLon, args.startTime, args.endTime)
+	points.to_csv(fileName, index = False)
+	print "Dumped {} positions to {}\n".format(len(points), fileName)
+
+	cluster.shutdown() # Closes connection to the DB and frees resources.
+
+	print "QUERY FINISHED.\n"
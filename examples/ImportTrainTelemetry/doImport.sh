@@ -1,41 +1,4 @@
 #!/bin/bash
 
-for fichero in 206_292/*.csv; do  ./importTrainTelemetry.py -n 206 -f $fichero; done
-for fichero in 206_292/*.csv; do  ./importTrainTelemetry.py -n 292 -f $fichero; done
-
-for fichero in 228_229/*.csv; do  ./importTrainTelemetry.py -n 228 -f $fichero; done
-for fichero in 228_229/*.csv; do  ./importTrainTelemetry.py -n 229 -f $fichero; done
-
-for fichero in 254_255/*.csv; do  ./importTrainTelemetry.py -n 254 -f $fichero; done
-for fichero in 254_255/*.csv; do  ./importTrainTelemetry.py -n 255 -f $fichero; done
-
-for fichero in 261_291/*.csv; do  ./importTrainTelemetry.py -n 261 -f $fichero; done
-for fichero in 261_291/*.csv; do  ./importTrainTelemetry.py -n 291 -f $fichero; done
-
-for fichero in 289_290/*.csv; do  ./importTrainTelemetry.py -n 289 -f $fichero; done
-for fichero in 289_290/*.csv; do  ./importTrainTelemetry.py -n 290 -f $fichero; done
-
-for fichero in 296_297/*.csv; do  ./importTrainTelemetry.py -n 296 -f $fichero; done
-for fichero in 296_297/*.csv; do  ./importTrainTelemetry.py -n 297 -f $fichero; done
-
-for fichero in 304_305/*.csv; do  ./importTrainTelemetry.py -n 304 -f $fichero; done
-for fichero in 304_305/*.csv; do  ./importTrainTelemetry.py -n 305 -f $fichero; done
-
-for fichero in 448_449/*.csv; do  ./importTrainTelemetry.py -n 448 -f $fichero; done
-for fichero in 448_449/*.csv; do  ./importTrainTelemetry.py -n 449 -f $fichero; done
-
-for fichero in 366_367/*.csv; do  ./importTrainTelemetry.py -n 366 -f $fichero; done
-for fichero in 366_367/*.csv; do  ./importTrainTelemetry.py -n 367 -f $fichero; done
-
-for fichero in 368_369/*.csv; do  ./importTrainTelemetry.py -n 368 -f $fichero; done
-for fichero in 368_369/*.csv; do  ./importTrainTelemetry.py -n 369 -f $fichero; done
-
-for fichero in 462_463/*.csv; do  ./importTrainTelemetry.py -n 462 -f $fichero; done
-for fichero in 462_463/*.csv; do  ./importTrainTelemetry.py -n 463 -f $fichero; done
-
-for fichero in 460_461/*.csv; do  ./importTrainTelemetry.py -n 460 -f $fichero; done
-for fichero in 460_461/*.csv; do  ./importTrainTelemetry.py -n 461 -f $fichero; done
-
-for fichero in 456_457/*.csv; do  ./importTrainTelemetry.py -n 456 -f $fichero; done
-for fichero in 456_457/*.csv; do  ./importTrainTelemetry.py -n 457 -f $fichero; done
-
+# Every directory holds the telemetry of one train and is named after its nodes (e.g., 206_292).
+./importTrainTelemetry.py -d 206_292 228_229 254_255 261_291 289_290 296_297 304_305 448_449 366_367 368_369 462_463 460_461 456_457
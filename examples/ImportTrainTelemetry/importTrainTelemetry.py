@@ -6,6 +6,11 @@
   Creator: Miguel Peon Quiros, IMDEA Networks Institute
   mikepeon@imdea.org
 
+ Every telemetry file is imported for every node of the train (-n NODES -f FILES), or for the
+  nodes named by its directory (-d 206_292 ..., with the files in 206_292/*.csv). All the files
+  are imported in one process and connection, with a prepared statement executed concurrently
+  (--concurrency requests in flight).
+
  Dependencies: sudo pip install cassandra-driver python-dateutil
 
  Cassandra driver (Python) documentation: https://datastax.github.io/python-driver/index.html
@@ -13,23 +18,88 @@
 
 from cassandra.cluster import Cluster
 from cassandra.auth import PlainTextAuthProvider
+from cassandra.concurrent import execute_concurrent_with_args
+from decimal import Decimal, InvalidOperation
+from glob import glob
 import argparse
 import csv
+import os
+import time
+
+INSERT_QUERY = "insert into monroe_meta_device_gps (NodeId, Timestamp, DataId, DataVersion, SequenceNumber, Longitude, Latitude, Speed, SatelliteCount) values (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+
+###############################################################################
+#  Yields the insert parameters of every line of a telemetry file for a node. SequenceNumber is
+# the line number, so importing a file again overwrites the same rows. Invalid lines are
+# counted in errors (a list with one counter).
+def Parameters(fileName, nodeID, errors):
+	with open(fileName, "rb") as iFile:
+		theReader = csv.reader(iFile, delimiter = ',')
+		count = 0
+		theReader.next() # Skip CSV header
+		for line in theReader:
+			try:
+				yield (str(nodeID), Decimal(int(line[2])), "MONROE.META.DEVICE.GPS", 2, count,
+					Decimal(line[6]), Decimal(line[5]), Decimal(line[8]), int(line[7]))
+			except (IndexError, ValueError, InvalidOperation) as error:
+				print "Error in line {} of {}: {}".format(count + 2, fileName, error)
+				errors[0] += 1
+			count = count + 1
+
+# Imports a telemetry file for a node. Returns (inserted lines, failed lines).
+def ImportFile(session, statement, fileName, nodeID, concurrency):
+	errors = [0]
+	inserted = 0
+	results = execute_concurrent_with_args(session, statement, Parameters(fileName, nodeID, errors),
+		concurrency = concurrency, raise_on_first_error = False, results_generator = True)
+	for (success, result) in results:
+		if success:
+			inserted += 1
+		else:
+			print "Error in insert for node {} from {}: {}".format(nodeID, fileName, result)
+			errors[0] += 1
+	return (inserted, errors[0])
 
 
+###############################################################################
+# Returns the list of (nodeID, fileName) to import.
+def ImportJobs(args):
+	jobs = []
+	for nodeID in args.nodeID or []:
+		for fileName in args.fileName or []:
+			jobs.append((nodeID, fileName))
+	# Directories are named after the nodes of the train, e.g., 206_292.
+	for directory in args.directory or []:
+		nodeIDs = [int(nodeID) for nodeID in os.path.basename(os.path.normpath(directory)).split("_")]
+		for nodeID in nodeIDs:
+			for fileName in sorted(glob(os.path.join(directory, "*.csv"))):
+				jobs.append((nodeID, fileName))
+	return jobs
+
 ###############################################################################
 def ParseCommandLine():
 	parser = argparse.ArgumentParser(description = "Train telemetry (GPS) importer")
 
-	parser.add_argument('-n', '--nodeID', help = 'ID of the node in the train', required = True, type = int)
-	parser.add_argument('-f', '--fileName', help = 'Telemetry filename (CSV)', required = True, type = str)
+	parser.add_argument('-n', '--nodeID', help = 'ID(s) of the node(s) in the train', required = False, type = int, nargs = '+')
+	parser.add_argument('-f', '--fileName', help = 'Telemetry filename(s) (CSV), imported for every node', required = False, type = str, nargs = '+')
+	parser.add_argument('-d', '--directory', help = 'Directories of telemetry files named after the nodes of the train (e.g., 206_292)', required = False, type = str, nargs = '+')
+	parser.add_argument('-c', '--concurrency', help = 'Number of inserts in flight (default 100)', required = False, type = int, default = 100)
 
 	args = parser.parse_args()
 
+	# Validate args
+	if (args.nodeID is None) != (args.fileName is None):
+		parser.error("--nodeID and --fileName must be used together")
+	if (args.nodeID is None) and (args.directory is None):
+		parser.error("either --nodeID and --fileName or --directory is required")
+
 	# Print parameters
 	print "Train telemetry (GPS) runs with the following parameters:"
 	print "NodeID: {}".format(args.nodeID)
-	print "StartTime: {}".format(args.fileName)
+	print "FileName: {}".format(args.fileName)
+	print "Directory: {}".format(args.directory)
+	print "Concurrency: {}".format(args.concurrency)
 
 	return args
 
@@ -44,20 +114,25 @@ if __name__ == '__main__':
 	session = cluster.connect("monroe") # Set default keyspace to 'monroe'
 	session.default_timeout = None
 	session.default_fetch_size = 1000
-
-	with open(args.fileName, "rb") as iFile:
-		theReader = csv.reader(iFile, delimiter = ',')
-		count = 0
-		theReader.next() # Skip CSV header
-		for line in theReader:
-			query = "insert into monroe_meta_device_gps (NodeId, Timestamp, DataId, DataVersion, SequenceNumber, Longitude, Latitude, Speed, SatelliteCount) values ('{}', {:.6f}, '{}', {}, {}, {}, {}, {}, {})".format(args.nodeID, int(line[2]), "MONROE.META.DEVICE.GPS", 2, count, line[6], line[5], line[8], line[7])
-			#print query
-			session.execute(query, timeout = None)
-			count = count + 1
-
-	print "Inserted {} lines.".format(count)
+	statement = session.prepare(INSERT_QUERY)
+
+	jobs = ImportJobs(args)
+	totalInserted = 0
+	totalErrors = 0
+	startTime = time.time()
+	for (index, (nodeID, fileName)) in enumerate(jobs):
+		fileStart = time.time()
+		(inserted, errors) = ImportFile(session, statement, fileName, nodeID, args.concurrency)
+		elapsed = time.time() - fileStart
+		totalInserted += inserted
+		totalErrors += errors
+		print "[{}/{}] Node {}, {}: inserted {} lines ({} errors) in {:.1f} s, {:.0f} rows/s".format(
+			index + 1, len(jobs), nodeID, fileName, inserted, errors, elapsed, inserted / elapsed if elapsed > 0 else 0)
+
+	elapsed = time.time() - startTime
+	print "Inserted {} lines ({} errors) in {} node/file imports in {:.1f} s, {:.0f} rows/s.".format(
+		totalInserted, totalErrors, len(jobs), elapsed, totalInserted / elapsed if elapsed > 0 else 0)
 
 	cluster.shutdown() # Closes connection to the DB and frees resources.
 
 	print "DUMP FINISHED.\n"
-
@@ -0,0 +1,170 @@
+#!/usr/bin/python
+
+"""
+ Streaming map writer for the MONROE example tools (KML, KMZ or GeoJSON).
+  https://www.monroe-project.eu
+
+ Points (GPS positions joined with modem statuses, e.g., the rows of CoverageGPS.JoinGPSAndModem)
+  are written one at a time as they are produced by any iterable, so no list of formatted
+  entries is kept in memory. Write() may be called several times (e.g., once per node) before
+  Close().
+
+ Modem codes are translated with the lookup tables DEVICE_MODES, DEVICE_SUBMODES and
+  DEVICE_STATES (see CoverageGPS_legend.txt for the icons).
+
+ KMZ files are written as KML to a temporary file, which is compressed into the KMZ (together with
+  the Mark_*.png icons) on Close().
+"""
+
+from math import isnan
+import json
+import os
+import zipfile
+
+FORMATS = ['kml', 'kmz', 'geojson']
+
+DEVICE_MODES = {0: "Unknown", 1: "Disconnected", 2: "No service", 3: "2G", 4: "3G", 5: "LTE"}
+DEVICE_SUBMODES = {0: "Unknown", 1: "UMTS", 2: "WCDMA", 3: "EVDO", 4: "HSPA", 5: "HSPA+", 6: "DC HSPA", 7: "DC HSPA+",
+	8: "HSDPA", 9: "HSUPA", 10: "HSDPA+HSUPA", 11: "HSDPA+", 12: "HSDPA+HSUPA", 13: "DC HSDPA+", 14: "DC HSDPA + HSUPA"}
+DEVICE_STATES = {0: "Unknown", 1: "Registered", 2: "Unregistered", 3: "Connected", 4: "Disconnected"}
+ICON_STYLES = {0: "IconUnknown", 1: "IconDisconnected", 2: "IconNoService", 3: "Icon2G", 4: "Icon3G", 5: "IconLTE"}
+
+# Precomputed "<name> (<code>)" labels.
+def _Labels(names):
+	return dict((code, "{} ({})".format(name, code)) for (code, name) in names.items())
+
+DEVICE_MODE_LABELS = _Labels(DEVICE_MODES)
+DEVICE_SUBMODE_LABELS = _Labels(DEVICE_SUBMODES)
+DEVICE_STATE_LABELS = _Labels(DEVICE_STATES)
+
+KML_HEADER = ("<?xml version=\"1.0\" encoding=\"UTF-8\"?><kml xmlns=\"http://www.opengis.net/kml/2.2\">\n"
+	"<Document>\n" +
+	"".join("<Style id=\"{}\">\n"
+		"  <IconStyle>\n"
+		"    <scale>0.5</scale>\n"
+		"    <Icon>\n"
+		"      <href>Mark_{}.png</href>\n"
+		"    </Icon>\n"
+		"  </IconStyle>\n"
+		"</Style>\n".format(style, style[len("Icon"):]) for (code, style) in sorted(ICON_STYLES.items())) +
+	"<Folder>\n")
+KML_FOOTER = "</Folder>\n</Document>\n</kml>\n"
+KML_PLACEMARK = ("\n<Placemark>\n"
+	"<description>{}</description>\n"
+	"<styleUrl>#{}</styleUrl>\n"
+	"<Point> <coordinates>{},{},{} </coordinates> </Point>\n"
+	"</Placemark>\n")
+
+DESCRIPTION = ("Node: {}\nTimestamp: {}\nLatitude: {} {}\nLongitude: {} {}\nAltitude: {}\n"
+	"Speed: {} Km/h\nSatellites: {}\n"
+	"Modem mode: {}\nModem submode: {}\n"
+	"ICCID: {}\nBand: {}\nDeviceState: {}\n"
+	"Frequency: {}\nInterfaceName: {}\nInternalInterface: {}\n"
+	"LAC: {}\nOperator: {}\nPCI: {}\nRSCP: {}\nRSRP: {}\nRSSI: {}")
+
+# Point attributes written as GeoJSON properties.
+PROPERTIES = ['nodeid', 'timestamp', 'altitude', 'speed', 'satellitecount', 'iccid', 'band', 'devicemode', 'devicesubmode',
+	'devicestate', 'frequency', 'interfacename', 'internalinterface', 'lac', 'operator', 'pci', 'rscp', 'rsrp', 'rssi']
+
+
+def Value(value):
+	# Returns value as a plain Python value (not a NumPy scalar); None for missing values (None, NaN).
+	if hasattr(value, 'item'):
+		value = value.item()
+	if value is None or (isinstance(value, float) and isnan(value)):
+		return None
+	return value
+
+
+def Label(labels, code):
+	# Returns the label of a modem code from one of the *_LABELS tables.
+	code = Value(code)
+	if code is None:
+		return "None"
+	return labels.get(code) or "?? ({})".format(code)
+
+
+def Description(point):
+	# Returns the KML description of a point.
+	latitude = Value(point.latitude)
+	longitude = Value(point.longitude)
+	operator = Value(point.operator)
+	return DESCRIPTION.format(
+		Value(point.nodeid), Value(point.timestamp),
+		latitude, 'N' if latitude >= 0.0 else 'S',
+		longitude, 'E' if longitude >= 0.0 else 'W',
+		Value(point.altitude), Value(point.speed), Value(point.satellitecount),
+		Label(DEVICE_MODE_LABELS, point.devicemode), Label(DEVICE_SUBMODE_LABELS, point.devicesubmode),
+		Value(point.iccid), Value(point.band), Label(DEVICE_STATE_LABELS, point.devicestate),
+		Value(point.frequency), Value(point.interfacename), Value(point.internalinterface), Value(point.lac),
+		operator.encode('latin-1') if operator is not None else None,
+		Value(point.pci), Value(point.rscp), Value(point.rsrp), Value(point.rssi))
+
+
+def IconStyle(point):
+	return ICON_STYLES.get(Value(point.devicemode), "IconUnknown")
+
+
+class MapWriter(object):
+	def __init__(self, fileName, fileFormat = 'kml'):
+		# fileName is given without extension.
+		if fileFormat not in FORMATS:
+			raise ValueError("Unknown map format {}".format(fileFormat))
+		self.fileFormat = fileFormat
+		self.fileName = "{}.{}".format(fileName, fileFormat)
+		self.count = 0
+		if fileFormat == 'kmz':
+			self.outputName = "{}.kml.tmp".format(fileName)
+		else:
+			self.outputName = self.fileName
+		self.output = open(self.outputName, "wt")
+		if fileFormat == 'geojson':
+			self.output.write('{"type": "FeatureCollection", "features": [\n')
+		else:
+			self.output.write(KML_HEADER)
+
+	def Write(self, points):
+		# Writes every point of the iterable points. Returns the number of points written.
+		count = 0
+		for point in points:
+			try:
+				if self.fileFormat == 'geojson':
+					self.WriteFeature(point)
+				else:
+					self.output.write(KML_PLACEMARK.format(Description(point), IconStyle(point),
+						Value(point.longitude), Value(point.latitude), Value(point.altitude)))
+				count += 1
+				self.count += 1
+			except Exception as error:
+				print "Error in point:", point, error
+		return count
+
+	def WriteFeature(self, point):
+		properties = dict((name, Value(getattr(point, name))) for name in PROPERTIES)
+		properties['mode'] = DEVICE_MODES.get(properties['devicemode'])
+		properties['submode'] = DEVICE_SUBMODES.get(properties['devicesubmode'])
+		properties['state'] = DEVICE_STATES.get(properties['devicestate'])
+		feature = json.dumps({'type': 'Feature',
+			'geometry': {'type': 'Point', 'coordinates': [Value(point.longitude), Value(point.latitude)]},
+			'properties': properties})
+		self.output.write(feature if self.count == 0 else ",\n" + feature)
+
+	def Close(self):
+		# Writes the file footer (and compresses KMZ files). Returns the number of points written.
+		if self.fileFormat == 'geojson':
+			self.output.write('\n]}\n')
+		else:
+			self.output.write(KML_FOOTER)
+		self.output.close()
+		if self.fileFormat == 'kmz':
+			# The KMZ also carries the icons, if they are found next to this file.
+			iconDir = os.path.dirname(os.path.abspath(__file__))
+			with zipfile.ZipFile(self.fileName, "w", zipfile.ZIP_DEFLATED) as kmz:
+				kmz.write(self.outputName, "doc.kml")
+				for style in ICON_STYLES.values():
+					iconName = "Mark_{}.png".format(style[len("Icon"):])
+					if os.path.exists(os.path.join(iconDir, iconName)):
+						kmz.write(os.path.join(iconDir, iconName), iconName)
+			os.unlink(self.outputName)
+		print "Dumped {} positions to {}\n".format(self.count, self.fileName)
+		return self.count
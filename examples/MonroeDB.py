@@ -0,0 +1,211 @@
+#!/usr/bin/python
+
+"""
+ Query client for the MONROE tables returning NumPy arrays or pandas DataFrames.
+  https://www.monroe-project.eu
+
+ The tables, their columns and keys are read from db_schema.cql by the parser of the importer
+  (importer/monroe_schema.py). Queries are built from the partition key values and time range
+  given as arguments and run as prepared statements with bound parameters, so no CQL is
+  formatted by hand:
+
+	db = Connect(user = "xxxx", password = "yyyy")
+	gps = db.DataFrame("monroe_meta_device_gps", ["timestamp", "latitude", "longitude"],
+		startTime = 1473940800, endTime = 1473944400, nodeid = ["54", "55"])
+	db.Close()
+
+ A list of values for a key column (or several buckets of a bucketed table) makes one
+  query per partition; the queries run concurrently (concurrency), each one paged (fetch sizes
+  as in PagedReader), and their rows are merged in timestamp order.
+
+ Rows are never materialized as Python objects: the session uses a columnar row factory (each
+  page is a list of values per column), and every column is converted to one NumPy array of the
+  type of its CQL column (e.g., float64 for the decimal Timestamp, NaN for missing values).
+  The session given to MonroeDB must therefore not be used for other queries.
+
+ Dependencies: sudo pip install cassandra-driver numpy [pandas]
+
+ Cassandra driver (Python) documentation: https://datastax.github.io/python-driver/index.html
+"""
+
+from decimal import Decimal
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+import itertools
+import os
+import sys
+import numpy
+from PagedReader import FetchSize, BucketStarts
+
+# The schema parser and bucket sizes of the importer (monroe_schema.py, monroe_buckets.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "importer"))
+import monroe_schema
+import monroe_buckets
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "db_schema.cql")
+
+# NumPy type of the CQL types; other types (text, uuid, collections...) are kept as objects.
+INTEGER_TYPES = set(["int", "bigint", "smallint", "tinyint", "varint", "counter"])
+FLOAT_TYPES = set(["double", "float", "decimal"])
+
+
+###############################################################################
+# Returns {table name: monroe_schema.Table} of the tables created in a CQL file. Names are lowercase.
+def LoadSchema(path = SCHEMA_FILE):
+	return monroe_schema.load_schema(path)
+
+
+###############################################################################
+# Row factory returning each page as (column names, list of values per column).
+def ColumnarFactory(columnNames, rows):
+	if len(rows) == 0:
+		return (columnNames, [[] for name in columnNames])
+	return (columnNames, [list(column) for column in zip(*rows)])
+
+# Returns the values of a column of CQL type cqlType as a NumPy array.
+def ToArray(values, cqlType):
+	if cqlType in FLOAT_TYPES:
+		return numpy.fromiter((numpy.nan if value is None else float(value) for value in values), numpy.float64, len(values))
+	if cqlType in INTEGER_TYPES:
+		if None in values:
+			return numpy.fromiter((numpy.nan if value is None else value for value in values), numpy.float64, len(values))
+		return numpy.fromiter(values, numpy.int64, len(values))
+	if cqlType == "boolean" and None not in values:
+		return numpy.fromiter(values, numpy.bool_, len(values))
+	array = numpy.empty(len(values), dtype = object)
+	array[:] = values
+	return array
+
+
+###############################################################################
+class MonroeDB(object):
+	def __init__(self, session, schemaFile = SCHEMA_FILE, concurrency = 8, fetchSizes = None, cluster = None):
+		self.session = session
+		self.session.row_factory = ColumnarFactory
+		self.tables = LoadSchema(schemaFile)
+		self.fetchSizes = fetchSizes
+		self.cluster = cluster
+		self.pool = ThreadPool(processes = concurrency)
+		self.statements = {}
+		self.lock = Lock()
+
+	def Close(self):
+		self.pool.close()
+		if self.cluster is not None:
+			self.cluster.shutdown()
+
+	def Table(self, table):
+		if table not in self.tables:
+			raise ValueError("Unknown table {} (not in db_schema.cql)".format(table))
+		return self.tables[table]
+
+	# Returns the prepared statement of query (prepared once).
+	def Prepare(self, query):
+		with self.lock:
+			statement = self.statements.get(query)
+		if statement is None:
+			statement = self.session.prepare(query)
+			with self.lock:
+				self.statements[query] = statement
+		return statement
+
+	#  Returns the columns of all pages of statement executed with parameters, as lists of values.
+	# The next page is requested before the current one is appended.
+	def FetchColumns(self, statement, parameters, fetchSize):
+		statement.fetch_size = fetchSize
+		future = self.session.execute_async(statement, parameters)
+		columns = None
+		while future is not None:
+			result = future.result()
+			if result.paging_state is not None:
+				future = self.session.execute_async(statement, parameters, paging_state = result.paging_state)
+			else:
+				future = None
+			(names, values) = result.current_rows
+			if columns is None:
+				columns = values
+			else:
+				for (column, page) in zip(columns, values):
+					column.extend(page)
+		return columns
+
+	#  Returns {column: NumPy array} of the rows of table in [startTime, endTime) (if given) whose
+	# columns are equal to the values of keys, e.g., nodeid = "54" or nodeid = ["54", "55"]. The
+	# partition key must be given, except the bucket of bucketed tables (computed from the time
+	# range); any other column requires allowFiltering. columns defaults to all columns.
+	# The rows are sorted by orderBy (if it is one of the columns).
+	def Query(self, table, columns = None, startTime = None, endTime = None, orderBy = "timestamp", allowFiltering = False, **keys):
+		definition = self.Table(table)
+		columns = sorted(definition.columns) if columns is None else [column.lower() for column in columns]
+		keys = dict((column.lower(), value) for (column, value) in keys.items())
+		for column in columns + list(keys):
+			if column not in definition.columns:
+				raise ValueError("Unknown column {} in {}".format(column, table))
+		if "bucket" in definition.partition_key and "bucket" not in keys:
+			if startTime is None or endTime is None:
+				raise ValueError("{} is bucketed, startTime and endTime are required".format(table))
+			# Daily buckets unless a _by_week table (e.g., monroe_meta_device_gps_geo).
+			split = monroe_buckets.split_table_name(table)
+			keys["bucket"] = BucketStarts(startTime, endTime, split[1] if split is not None else monroe_buckets.DAY)
+		missing = [column for column in definition.partition_key if column not in keys]
+		if len(missing) > 0 and not allowFiltering:
+			raise ValueError("Missing partition key column(s) {} of {}".format(", ".join(missing), table))
+		others = [column for column in keys if column not in definition.partition_key]
+		if len(others) > 0 and not allowFiltering:
+			raise ValueError("Column(s) {} of {} are not in the partition key, use allowFiltering".format(", ".join(others), table))
+
+		# One query per combination of key values.
+		keyColumns = sorted(keys)
+		restrictions = ["{} = ?".format(column) for column in keyColumns]
+		if startTime is not None:
+			restrictions.append("timestamp >= ?")
+		if endTime is not None:
+			restrictions.append("timestamp < ?")
+		query = "SELECT {} FROM {}".format(", ".join(columns), table)
+		if len(restrictions) > 0:
+			query += " WHERE " + " AND ".join(restrictions)
+		if allowFiltering:
+			query += " ALLOW FILTERING"
+		statement = self.Prepare(query)
+		timeParameters = [ToTimestamp(value, definition.columns.get("timestamp")) for value in (startTime, endTime) if value is not None]
+		keyValues = [keys[column] if isinstance(keys[column], (list, tuple, set)) else [keys[column]] for column in keyColumns]
+		fetchSize = FetchSize(table, self.fetchSizes)
+		results = [self.pool.apply_async(self.FetchColumns, (statement, list(values) + timeParameters, fetchSize))
+			for values in itertools.product(*keyValues)]
+
+		data = dict((column, []) for column in columns)
+		for result in results:
+			for (column, values) in zip(columns, result.get()):
+				data[column].extend(values)
+		arrays = dict((column, ToArray(data[column], definition.columns[column])) for column in columns)
+		# Partitions are read one after the other, DESC clustering columns in reverse order.
+		if orderBy in arrays and (len(results) > 1 or definition.clustering_order.get(orderBy) == "desc"):
+			order = numpy.argsort(arrays[orderBy], kind = "mergesort")
+			arrays = dict((column, array[order]) for (column, array) in arrays.items())
+		return arrays
+
+	# Same as Query(), as a pandas DataFrame with the columns in the given order.
+	def DataFrame(self, table, columns = None, *args, **kwargs):
+		import pandas
+		arrays = self.Query(table, columns, *args, **kwargs)
+		columns = sorted(arrays) if columns is None else [column.lower() for column in columns]
+		return pandas.DataFrame(arrays, columns = columns)
+
+
+# Returns a time bound as a parameter of a column of CQL type cqlType (Timestamp is decimal).
+def ToTimestamp(value, cqlType):
+	if cqlType == "decimal":
+		return Decimal(repr(value)) if isinstance(value, float) else Decimal(value)
+	return value
+
+
+###############################################################################
+# Connects to the DB and returns a MonroeDB with its own session.
+def Connect(hosts = ['127.0.0.1'], port = 9042, keyspace = "monroe", user = "xxxx", password = "yyyy", **kwargs):
+	from cassandra.cluster import Cluster
+	from cassandra.auth import PlainTextAuthProvider
+	auth = PlainTextAuthProvider(username = user, password = password)
+	cluster = Cluster(contact_points = hosts, port = port, auth_provider = auth)
+	session = cluster.connect(keyspace)
+	session.default_timeout = None
+	return MonroeDB(session, cluster = cluster, **kwargs)
@@ -0,0 +1,192 @@
+#!/usr/bin/python
+
+"""
+ Paged reader shared by the MONROE example tools.
+  https://www.monroe-project.eu
+
+ Iterating over a ResultSet makes the driver stop and fetch the next page of rows only when
+  the current one is exhausted. PagedRows() instead keeps the request for the next page in
+  flight (execute_async + paging_state) while the rows of the current page are processed, so
+  network time overlaps with the formatting/writing done by the caller.
+
+ Fetch sizes are configured per table in FETCH_SIZES; tables not listed there use
+  DEFAULT_FETCH_SIZE. A fetch size of None disables paging (the whole result in one page),
+  which Cassandra requires for queries with both an IN restriction and ORDER BY.
+
+ Tables with time-bucketed partitions (the _by_day/_by_week variants in db_schema.cql) are read
+  with BucketedRows(), which queries the partitions of a time range one bucket after another
+  (ChainedRows(): the first page of the next bucket is requested with the last page of the
+  current one).
+
+ Instead of one query with IN over a partition key column (which makes the coordinator gather all
+  partitions, and cannot be paged with ORDER BY), PartitionedRows() queries every partition
+  concurrently, each one paged, and merges the rows (ordered by timestamp in every partition) with
+  a k-way merge: at most one page per partition is in memory, whatever the time range. The buckets
+  of a bucketed partition are chained into one stream, and at most MAX_STREAMS pages are
+  requested ahead of the merge.
+
+ Dependencies: sudo pip install cassandra-driver
+
+ Cassandra driver (Python) documentation: https://datastax.github.io/python-driver/index.html
+"""
+
+from cassandra.query import SimpleStatement
+import heapq
+import os
+import sys
+
+# The bucket arithmetic of the importer (monroe_buckets.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "importer"))
+import monroe_buckets
+
+DEFAULT_FETCH_SIZE = 1000
+
+# Rows of monroe_meta_node_sensor are large, keep their pages small.
+FETCH_SIZES = {
+	'monroe_meta_node_sensor': 10,
+	'monroe_meta_node_sensor_by_day': 10,
+}
+
+# Bucket sizes (seconds) of the bucketed table variants, by table name suffix.
+BUCKET_SECONDS = monroe_buckets.SUFFIXES
+
+# Maximum number of pages PartitionedRows() requests ahead of the merge.
+MAX_STREAMS = 16
+
+
+def FetchSize(table, fetchSizes=None):
+	# Returns the fetch size to use for the given table.
+	# fetchSizes (optional) overrides the module defaults for this call.
+	if fetchSizes is not None and table in fetchSizes:
+		return fetchSizes[table]
+	return FETCH_SIZES.get(table, DEFAULT_FETCH_SIZE)
+
+
+def PagedResults(session, query, fetchSize=DEFAULT_FETCH_SIZE, parameters=None, timeout=None, pagingState=None):
+	# Generator over the pages of query as (rows, pagingState) tuples, pagingState being the
+	#  state to resume the query after this page (None after the last page). The next page is
+	#  requested before the current one is handed to the caller.
+	# pagingState (optional) resumes a query from a state returned by a previous run.
+	statement = SimpleStatement(query, fetch_size=fetchSize)
+	future = session.execute_async(statement, parameters, timeout=timeout, paging_state=pagingState)
+	while future is not None:
+		result = future.result()
+		if result.paging_state is not None:
+			future = session.execute_async(statement, parameters, timeout=timeout, paging_state=result.paging_state)
+		else:
+			future = None
+		yield (result.current_rows, result.paging_state)
+
+
+def PagedRows(session, query, fetchSize=DEFAULT_FETCH_SIZE, parameters=None, timeout=None):
+	# Generator over the rows of query, see PagedResults().
+	for (rows, pagingState) in PagedResults(session, query, fetchSize, parameters, timeout):
+		for row in rows:
+			yield row
+
+
+def BucketStarts(startTime, endTime, bucketSeconds):
+	# Returns the start of every bucket overlapping [startTime, endTime), as the importer computes
+	#  them (weeks start on Monday).
+	return monroe_buckets.bucket_range(startTime, endTime, bucketSeconds)
+
+
+def BucketedRows(session, table, query, startTime, endTime, fetchSize=DEFAULT_FETCH_SIZE, timeout=None):
+	# Generator over the rows of query in every bucket of table overlapping [startTime, endTime),
+	#  in bucket order. query must restrict "bucket = {}"; it is formatted with each bucket.
+	split = monroe_buckets.split_table_name(table)
+	if split is None:
+		raise ValueError("{} is not a bucketed table".format(table))
+	(baseTable, bucketSeconds) = split
+	statements = [SimpleStatement(query.format(bucket), fetch_size=fetchSize) for bucket in BucketStarts(startTime, endTime, bucketSeconds)]
+	if len(statements) == 0:
+		return
+	for row in ChainedRows(RequestWindow(session, 1, timeout=timeout), statements):
+		yield row
+
+
+class RequestWindow(object):
+	# Page requests of one or more streams (see ChainedRows()), at most "size" of them requested
+	#  ahead of the caller at once.
+	def __init__(self, session, size, parameters=None, timeout=None):
+		self.session = session
+		self.size = size
+		self.parameters = parameters
+		self.timeout = timeout
+		self.inFlight = 0
+
+	# Returns the future of a page of statement, or None if the window is full (unless force).
+	def Request(self, statement, pagingState=None, force=False):
+		if self.inFlight >= self.size and not force:
+			return None
+		self.inFlight += 1
+		return self.session.execute_async(statement, self.parameters, timeout=self.timeout, paging_state=pagingState)
+
+	def Result(self, future):
+		self.inFlight -= 1
+		return future.result()
+
+
+def ChainedRows(window, statements, future=None):
+	# Generator over the rows of statements, one statement after the other, requested through
+	#  window (a RequestWindow). future is the first page of statements[0] if already requested.
+	#  The next page (or the first page of the next statement) is requested before the current one
+	#  is handed to the caller if the window has room, otherwise once its rows are consumed.
+	index = 0
+	pagingState = None
+	while True:
+		if future is None:
+			future = window.Request(statements[index], pagingState, force=True)
+		result = window.Result(future)
+		if result.paging_state is not None:
+			pagingState = result.paging_state
+		elif index + 1 < len(statements):
+			index += 1
+			pagingState = None
+		else:
+			for row in result.current_rows:
+				yield row
+			return
+		future = window.Request(statements[index], pagingState)
+		for row in result.current_rows:
+			yield row
+
+
+def MergedRows(streams, key):
+	# Generator merging the rows of streams (iterables, each ordered by key) in key order.
+	#  Equal keys come in stream order.
+	heap = []
+	for (index, stream) in enumerate(streams):
+		iterator = iter(stream)
+		for row in iterator:
+			heap.append((key(row), index, row, iterator))
+			break
+	heapq.heapify(heap)
+	while heap:
+		(rowKey, index, row, iterator) = heap[0]
+		yield row
+		for row in iterator:
+			heapq.heapreplace(heap, (key(row), index, row, iterator))
+			break
+		else:
+			heapq.heappop(heap)
+
+
+def PartitionedRows(session, query, partitions, fetchSize=DEFAULT_FETCH_SIZE, timeout=None, key=lambda row: row.timestamp, buckets=None, maxStreams=MAX_STREAMS):
+	# Generator over the rows of query in all partitions, in key order (timestamp by default).
+	#  query must restrict the partition key columns with "{}" placeholders (e.g., "iccid = '{}'");
+	#  it is formatted with every tuple of partitions. With buckets (e.g., BucketStarts()), query
+	#  ends with a "bucket = {}" placeholder too, and the buckets of every partition are read one
+	#  after the other as a single stream (key must then grow with the bucket, as timestamp does).
+	#  At most maxStreams pages are requested ahead of the merge (the first page of the first
+	#  maxStreams partitions, then the next page of the streams being merged).
+	window = RequestWindow(session, maxStreams, timeout=timeout)
+	streams = []
+	for partition in partitions:
+		if buckets is None:
+			statements = [SimpleStatement(query.format(*partition), fetch_size=fetchSize)]
+		else:
+			statements = [SimpleStatement(query.format(*(tuple(partition) + (bucket,))), fetch_size=fetchSize) for bucket in buckets]
+		if len(statements) > 0:
+			streams.append(ChainedRows(window, statements, window.Request(statements[0])))
+	return MergedRows(streams, key)
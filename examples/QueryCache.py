@@ -0,0 +1,142 @@
+#!/usr/bin/python
+
+"""
+ Local read-through cache of query results for the MONROE example tools.
+  https://www.monroe-project.eu
+
+ Rows are cached on disk per table, partition (the WHERE restriction without the time range) and
+  day, so that repeated runs over the same nodes and days (e.g., CoverageGPS with another
+  --minGPSInterval or --operatorName) read them from disk instead of Cassandra. Each cache file
+  holds the rows of one day in columnar form (one list per column), pickled and compressed.
+
+ Days are immutable once they are older than IMMUTABLE_AFTER (the importer accepts entries up to
+  two weeks late, see TS_GRACE in importer/monroevalidator.py); more recent days, and other
+  values such as the ICCIDs of a node, are cached for MUTABLE_TTL seconds only.
+
+ The cache is bounded to maxBytes: the least recently used files are deleted first (every hit
+  refreshes the modification time of its file).
+"""
+
+from collections import namedtuple
+from threading import Lock
+import cPickle as pickle
+import hashlib
+import os
+import time
+import zlib
+from PagedReader import PagedRows, BucketStarts, DEFAULT_FETCH_SIZE
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".monroe_cache")
+DEFAULT_MAX_BYTES = 2*1024**3
+DAY = 3600*24
+IMMUTABLE_AFTER = 3600*24*14
+MUTABLE_TTL = 3600
+
+
+class QueryCache(object):
+	def __init__(self, cacheDir = DEFAULT_CACHE_DIR, maxBytes = DEFAULT_MAX_BYTES):
+		self.cacheDir = cacheDir
+		self.maxBytes = maxBytes
+		self.hits = 0
+		self.misses = 0
+		self.lock = Lock()
+		if not os.path.isdir(cacheDir):
+			os.makedirs(cacheDir)
+		self.size = sum(size for (mtime, size, path) in self.Files())
+
+	# Returns the (mtime, size, path) of every cache file.
+	def Files(self):
+		files = []
+		for (root, dirs, names) in os.walk(self.cacheDir):
+			for name in names:
+				if name.endswith(".cache"):
+					path = os.path.join(root, name)
+					try:
+						stat = os.stat(path)
+					except OSError:
+						continue	# Evicted meanwhile
+					files.append((stat.st_mtime, stat.st_size, path))
+		return files
+
+	def Path(self, table, key):
+		return os.path.join(self.cacheDir, table, hashlib.sha1(repr(key)).hexdigest() + ".cache")
+
+	#  Returns the value cached for key, or the value returned by fetch() (which is then cached).
+	# With ttl, a cached value older than ttl seconds is fetched again.
+	def Get(self, table, key, fetch, ttl = None):
+		path = self.Path(table, key)
+		try:
+			with open(path, "rb") as cacheFile:
+				(written, value) = pickle.loads(zlib.decompress(cacheFile.read()))
+			if ttl is None or time.time() - written < ttl:
+				os.utime(path, None)	# Most recently used
+				self.hits += 1
+				return value
+		except (IOError, OSError, EOFError, ValueError, zlib.error, pickle.UnpicklingError):
+			pass	# Not cached, evicted meanwhile or incomplete
+		self.misses += 1
+		value = fetch()
+		self.Put(path, value)
+		return value
+
+	def Put(self, path, value):
+		data = zlib.compress(pickle.dumps((time.time(), value), pickle.HIGHEST_PROTOCOL), 1)
+		if not os.path.isdir(os.path.dirname(path)):
+			try:
+				os.makedirs(os.path.dirname(path))
+			except OSError:
+				pass	# Created by another thread
+		# Written under another name first, so readers never see a partial file.
+		tmpPath = "{}.{}.{}.tmp".format(path, os.getpid(), id(value))
+		with open(tmpPath, "wb") as cacheFile:
+			cacheFile.write(data)
+		with self.lock:
+			# An expired value is replaced: only the difference counts.
+			try:
+				oldSize = os.path.getsize(path)
+			except OSError:
+				oldSize = 0
+			os.rename(tmpPath, path)
+			self.size += len(data) - oldSize
+			if self.size > self.maxBytes:
+				self.Evict()
+
+	# Deletes the least recently used files until the cache fits in maxBytes.
+	def Evict(self):
+		files = sorted(self.Files())
+		self.size = sum(size for (mtime, size, path) in files)
+		for (mtime, size, path) in files:
+			if self.size <= self.maxBytes:
+				break
+			try:
+				os.unlink(path)
+			except OSError:
+				pass
+			self.size -= size
+
+	#  Yields the rows (namedtuples of columns, which must include timestamp) of table matching where
+	# (a restriction of the partition key, e.g., "nodeid='54'") during [startTime, endTime), in
+	# timestamp order. Whole days are fetched and cached; for the _by_day tables, the bucket of each
+	# day is added to where.
+	def Rows(self, session, table, columns, where, startTime, endTime, fetchSize = DEFAULT_FETCH_SIZE):
+		Row = namedtuple("Row", columns)
+		timestampIndex = columns.index("timestamp")
+		for day in BucketStarts(startTime, endTime, DAY):
+			dayWhere = where
+			if table.endswith("_by_day"):
+				dayWhere += " and bucket = {}".format(day)
+			query = "select {} from {} where {} and timestamp >= {} and timestamp < {} order by timestamp asc".format(
+				", ".join(columns), table, dayWhere, day, day + DAY)
+			def FetchDay():
+				rows = list(PagedRows(session, query, fetchSize))
+				if len(rows) == 0:
+					return [[] for column in columns]
+				return [list(column) for column in zip(*rows)]
+			ttl = None if day + DAY <= time.time() - IMMUTABLE_AFTER else MUTABLE_TTL
+			data = self.Get(table, (query, ), FetchDay, ttl)
+			for row in zip(*data):
+				if startTime <= row[timestampIndex] < endTime:
+					yield Row(*row)
+
+	def Stats(self):
+		return "Query cache {}: {} hits, {} misses, {} MB".format(self.cacheDir, self.hits, self.misses, self.size // 1024**2)
@@ -0,0 +1,143 @@
+#!/usr/bin/python
+
+"""
+ Resumable table dumps for the MONROE example tools.
+  https://www.monroe-project.eu
+
+ A ResumableDump writes the dump of one query to <fileName>.part and, after every page of rows
+  has been written, stores a checkpoint in <fileName>.checkpoint with the driver paging_state,
+  the number of rows and the size of the partial file. If the dump dies (e.g., a timeout in a
+  long filtered scan), running it again truncates the partial file to the last checkpoint and
+  resumes the query from the stored paging_state. When the whole query has been written the
+  partial file is atomically renamed to fileName and the checkpoint is removed.
+
+ Usage:
+	with ResumableDump(fileName, query, header) as output:
+		count = output.count
+		for row in output.Rows(session, fetchSize):
+			output.write(...)
+			count += 1
+
+ The paging_state is only valid for exactly the same query, so a checkpoint stored for a
+  different query is ignored and the dump starts from scratch.
+
+ A finished dump also leaves <fileName>.done with its number of rows. Running it again skips it
+  (output.Rows() yields nothing and output.count is the stored number of rows) unless force is
+  given, so a rerun of failed dumps does not truncate and rewrite the ones that finished.
+"""
+
+from binascii import hexlify, unhexlify
+import json
+import os
+from PagedReader import PagedResults, DEFAULT_FETCH_SIZE
+
+
+class ResumableDump(object):
+	def __init__(self, fileName, query, header="", force=False):
+		self.fileName = fileName
+		self.partName = fileName + ".part"
+		self.checkpointName = fileName + ".checkpoint"
+		self.doneName = fileName + ".done"
+		self.query = query
+		self.header = header
+		self.force = force
+		self.output = None
+		self.count = 0				# Rows written up to the last checkpoint.
+		self.pagingState = None			# Where to resume the query.
+		self.complete = False			# The query has been completely written.
+		self.resumed = False
+		self.skipped = False			# Already dumped by a previous run.
+
+	def __enter__(self):
+		if not self.force and os.path.exists(self.fileName):
+			self.count = self.LoadDoneCount()
+			self.complete = True
+			self.skipped = True
+			print "Skipping {}: already dumped ({} rows)".format(self.fileName, self.count)
+			return self
+		checkpoint = self.LoadCheckpoint()
+		if checkpoint is not None and os.path.exists(self.partName):
+			self.output = open(self.partName, "r+")
+			self.output.seek(checkpoint['offset'])
+			self.output.truncate()
+			self.count = checkpoint['count']
+			self.pagingState = unhexlify(checkpoint['pagingState']) if checkpoint['pagingState'] is not None else None
+			self.complete = checkpoint['complete']
+			self.resumed = True
+			print "Resuming {} after {} rows".format(self.fileName, self.count)
+		else:
+			self.output = open(self.partName, "wt")
+			self.output.write(self.header)
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		if self.skipped:
+			return False
+		self.output.close()
+		# On errors keep the partial file and the checkpoint for the next run.
+		if excType is None:
+			os.rename(self.partName, self.fileName)
+			self.SaveDoneCount()
+			if os.path.exists(self.checkpointName):
+				os.unlink(self.checkpointName)
+		return False
+
+	def write(self, text):
+		self.output.write(text)
+
+	def Rows(self, session, fetchSize=DEFAULT_FETCH_SIZE):
+		# Generator over the rows of the query not yet written. A checkpoint is stored when the
+		#  caller asks for the first row of the next page, i.e., after writing the current one.
+		if self.complete:
+			return
+		for (rows, pagingState) in PagedResults(session, self.query, fetchSize, pagingState=self.pagingState):
+			for row in rows:
+				yield row
+			self.count += len(rows)
+			self.pagingState = pagingState
+			self.complete = pagingState is None
+			self.SaveCheckpoint()
+
+	def LoadCheckpoint(self):
+		# Returns the stored checkpoint for this query, or None.
+		try:
+			with open(self.checkpointName, "rt") as f:
+				checkpoint = json.load(f)
+		except (IOError, ValueError):
+			return None
+		if checkpoint.get('query') != self.query:
+			return None
+		return checkpoint
+
+	def SaveCheckpoint(self):
+		# Data must reach the disk before the checkpoint that refers to it.
+		self.output.flush()
+		os.fsync(self.output.fileno())
+		checkpoint = {
+			'query': self.query,
+			'offset': self.output.tell(),
+			'count': self.count,
+			'pagingState': hexlify(self.pagingState).decode('ascii') if self.pagingState is not None else None,
+			'complete': self.complete,
+		}
+		tempName = self.checkpointName + ".tmp"
+		with open(tempName, "wt") as f:
+			json.dump(checkpoint, f)
+		os.rename(tempName, self.checkpointName)
+
+	def LoadDoneCount(self):
+		# Returns the number of rows of the finished dump. Without a .done file (e.g., written by
+		#  an older version), the lines after the header.
+		try:
+			with open(self.doneName, "rt") as f:
+				return json.load(f)['count']
+		except (IOError, ValueError, KeyError):
+			pass
+		with open(self.fileName, "rt") as f:
+			return max(sum(1 for line in f) - self.header.count("\n"), 0)
+
+	def SaveDoneCount(self):
+		tempName = self.doneName + ".tmp"
+		with open(tempName, "wt") as f:
+			json.dump({'count': self.count}, f)
+		os.rename(tempName, self.doneName)
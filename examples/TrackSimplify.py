@@ -0,0 +1,128 @@
+#!/usr/bin/python
+
+"""
+ Track simplification and spatial downsampling of GPS positions (NumPy).
+  https://www.monroe-project.eu
+
+ Simplify() returns a boolean mask of the positions to keep, applying in this order:
+  - minDistance: keeps one position every minDistance metres travelled along the track.
+  - tolerance: Douglas-Peucker simplification, drops positions closer than tolerance metres to
+    the simplified track.
+  - gridSize: keeps one position per gridSize x gridSize metres cell (and per group), which
+    collapses repeated journeys over the same track.
+ If groups (e.g., the modem mode of each position) are given, the positions on both sides of
+  every group change are always kept by the first two steps, and the grid keeps one position per
+  cell and group, so the simplified output still shows where the mode changes.
+
+ Positions are projected to metres on a plane tangent at their mean latitude, which is accurate
+  enough for tracks a few hundred kilometres long.
+
+ Dependencies: sudo pip install numpy
+"""
+
+import numpy
+
+EARTH_RADIUS = 6371000.0	# Metres
+
+
+def ProjectMetres(latitude, longitude):
+	# Returns (x, y) arrays in metres.
+	latitude = numpy.asarray(latitude, dtype = float)
+	longitude = numpy.asarray(longitude, dtype = float)
+	if len(latitude) == 0:
+		return (longitude, latitude)
+	scale = numpy.cos(numpy.radians(numpy.nanmean(latitude)))
+	return (EARTH_RADIUS * numpy.radians(longitude) * scale, EARTH_RADIUS * numpy.radians(latitude))
+
+
+def GroupChanges(groups):
+	# Returns the indices of the first and last positions and of the positions on both sides of
+	#  every change of groups.
+	groups = numpy.asarray(groups).astype(str)
+	count = len(groups)
+	if count == 0:
+		return numpy.zeros(0, dtype = int)
+	changes = numpy.flatnonzero(groups[1:] != groups[:-1]) + 1
+	return numpy.unique(numpy.concatenate(([0, count - 1], changes - 1, changes)))
+
+
+def DistanceFilter(x, y, minDistance, keep):
+	# Returns a mask keeping the first position of every minDistance metres along the track.
+	if len(x) == 0:
+		return numpy.zeros(0, dtype = bool)
+	travelled = numpy.concatenate(([0.0], numpy.cumsum(numpy.hypot(numpy.diff(x), numpy.diff(y)))))
+	slot = numpy.floor(travelled / minDistance)
+	mask = numpy.concatenate(([True], slot[1:] != slot[:-1]))
+	mask[keep] = True
+	return mask
+
+
+def DouglasPeucker(x, y, tolerance, keep):
+	# Returns a mask of the positions kept by Douglas-Peucker with the given tolerance (metres).
+	#  The positions in keep are kept and split the track into independently simplified parts.
+	count = len(x)
+	mask = numpy.zeros(count, dtype = bool)
+	if count == 0:
+		return mask
+	anchors = numpy.unique(numpy.concatenate(([0, count - 1], keep)))
+	mask[anchors] = True
+	segments = list(zip(anchors[:-1], anchors[1:]))
+	while segments:
+		(first, last) = segments.pop()
+		if last - first < 2:
+			continue
+		dx = x[last] - x[first]
+		dy = y[last] - y[first]
+		px = x[first + 1:last] - x[first]
+		py = y[first + 1:last] - y[first]
+		length = numpy.hypot(dx, dy)
+		if length > 0:
+			distance = numpy.abs(dx * py - dy * px) / length
+		else:
+			distance = numpy.hypot(px, py)
+		farthest = numpy.argmax(distance)
+		if distance[farthest] > tolerance:
+			index = first + 1 + farthest
+			mask[index] = True
+			segments.append((first, index))
+			segments.append((index, last))
+	return mask
+
+
+def GridCluster(x, y, gridSize, groups = None):
+	# Returns a mask keeping the first position of every grid cell (and group).
+	count = len(x)
+	mask = numpy.zeros(count, dtype = bool)
+	if count == 0:
+		return mask
+	columns = [numpy.floor(x / gridSize).astype(numpy.int64), numpy.floor(y / gridSize).astype(numpy.int64)]
+	if groups is not None:
+		columns.append(numpy.unique(numpy.asarray(groups).astype(str), return_inverse = True)[1].astype(numpy.int64))
+	(cells, first) = numpy.unique(numpy.column_stack(columns), axis = 0, return_index = True)
+	mask[first] = True
+	return mask
+
+
+def Simplify(latitude, longitude, groups = None, tolerance = 0, minDistance = 0, gridSize = 0):
+	# Returns a boolean mask of the positions to keep (all of them if every option is 0).
+	(x, y) = ProjectMetres(latitude, longitude)
+	if groups is not None:
+		groups = numpy.asarray(groups)
+	selected = numpy.arange(len(x))	# Indices of the positions kept so far.
+
+	def Keep():
+		# Indices (within selected) that every step must keep.
+		if groups is None:
+			return numpy.zeros(0, dtype = int)
+		return GroupChanges(groups[selected])
+
+	if minDistance > 0:
+		selected = selected[DistanceFilter(x[selected], y[selected], minDistance, Keep())]
+	if tolerance > 0:
+		selected = selected[DouglasPeucker(x[selected], y[selected], tolerance, Keep())]
+	if gridSize > 0:
+		selected = selected[GridCluster(x[selected], y[selected], gridSize, None if groups is None else groups[selected])]
+
+	mask = numpy.zeros(len(x), dtype = bool)
+	mask[selected] = True
+	return mask
@@ -6,10 +6,21 @@
   Creator: Miguel Peon Quiros, IMDEA Networks Institute
   mikepeon@imdea.org
 
- The method shown here is the easiest, but the least efficient because it runs in a single
-  thread and stops to fetch the next page of rows. More efficient options are asynchronous
-  retrieval of rows (in parallel with the processing of the previous page), multithreading
-  or multiprocessing (e.g., one process per query).
+ Rows are read through PagedReader, which retrieves the next page of rows asynchronously in
+  parallel with the processing of the current one. Fetch sizes per table are configured in
+  PagedReader.FETCH_SIZES.
+
+ Each table is written to <file>.part with a checkpoint after every page (see ResumableDump). If
+  a dump fails, running the same days again resumes every unfinished table from its last
+  checkpoint; finished tables are renamed to their final .csv name and skipped by later runs
+  (their row count is reported again) unless --force is given.
+
+ Every (table, day) pair is dumped as an independent job. With --processes N the jobs run in a
+  pool of N processes; --startDate/--endDate backfill a range of days. E.g.:
+    ./dailyCassandra2CSV.py --startDate 2017-03-01 --endDate 2017-03-31 --processes 8
+
+ With --bucketed, the tables with a time-bucketed variant (_by_day/_by_week in db_schema.cql) are
+  read from it, one bucket per day, e.g. for a DB imported with monroe_dbimporter --bucketed=only.
 
  One connection per process. If using fork(), remember not to reuse the same connection from the
   child process.
@@ -21,60 +32,69 @@
 
 from cassandra.cluster import Cluster
 from cassandra.auth import PlainTextAuthProvider
-from time import struct_time, strftime, gmtime
+from time import strftime, gmtime, time
 from datetime import datetime
 from calendar import timegm
 from dateutil.relativedelta import relativedelta
+from PagedReader import FetchSize, BucketStarts
+from ResumableDump import ResumableDump
+from multiprocessing import Pool
+from multiprocessing.util import Finalize
+import argparse
+import os
+import sys
+
+# The bucket sizes of the importer (monroe_buckets.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "importer"))
+import monroe_buckets
 
 def FileNamePrefix(startTime):
 	# Returns a date-stamped file name prefix including path.
 	return "/experiments/dailyDumps/{}_".format(strftime("%Y-%m-%d", gmtime(startTime)))
 
-def CalcDumpTimes(daysBack):
-	# Get current time and build a timestamp for 00:00 of the PREVIOUS day.
-	t = (datetime.utcnow() + relativedelta(days=-daysBack)).utctimetuple()
-	s = struct_time(tuple([t.tm_year, t.tm_mon, t.tm_mday, 0, 0, 0, 0, 0, 0]))
-	startTime = timegm(s)
-	return (startTime, startTime + 3600*24)
-
 def FormatDate():
 	return "[{} (UTC)] --".format(datetime.utcnow())
 
+#  Returns (query, table) for the rows of table during [startTime, endTime) (one day). With
+# --bucketed, a table with a bucketed variant in the keyspace (see workerVariants) is read from
+# the variant instead, restricted to the bucket of the day (the importer with --bucketed=only
+# writes nothing to the table itself).
+def DumpQuery(table, startTime, endTime):
+	variant = workerVariants.get(table) if workerBucketed else None
+	if variant is None:
+		return ("select * from {} where timestamp >= {} and timestamp < {} allow filtering".format(table, startTime, endTime), table)
+	# Days never span two day or week buckets.
+	bucket = BucketStarts(startTime, endTime, monroe_buckets.split_table_name(variant)[1])[0]
+	return ("select * from {} where bucket = {} and timestamp >= {} and timestamp < {} allow filtering".format(variant, bucket, startTime, endTime), variant)
+
 
-def DumpOneDay(session, daysBack):
-	(startTime, endTime) = CalcDumpTimes(daysBack)
-	print "\n======================================================================"
-	print "======================================================================"
-	print "======================================================================"
-	print FormatDate(), "Dumping MONROE tables for interval [{}, {})\n".format(startTime, endTime)
-	
+def DumpExpPing(session, startTime, endTime):
 	########## monroe_exp_ping ###############
-	session.default_fetch_size = 1000
 	fileName = FileNamePrefix(startTime) + "{}_monroe_exp_ping.csv".format(startTime)
-	with open(fileName, "wt") as output:	
-		output.write("nodeid,iccid,timestamp,sequencenumber,bytes,dataid,dataversion,guid,host,operator,rtt\n")
-		query = "select * from monroe_exp_ping where timestamp >= {} and timestamp < {} allow filtering".format(startTime, endTime)
+	(query, table) = DumpQuery("monroe_exp_ping", startTime, endTime)
+	with ResumableDump(fileName, query, "nodeid,iccid,timestamp,sequencenumber,bytes,dataid,dataversion,guid,host,operator,rtt\n", workerForce) as output:
 		print query
-		rows = session.execute(query, timeout=None)
-		count = 0;
+		rows = output.Rows(session, FetchSize(table))
+		count = output.count
 		for row in rows:
-			# The driver automatically fetches the next page of rows when the current one is exhausted.
+			# The next page of rows is already being fetched while this one is written.
 			try:
 				output.write("{},{},{},{},{},{},{},{},{},{},{}\n".format(row.nodeid, row.iccid, row.timestamp, row.sequencenumber, row.bytes, row.dataid, row.dataversion, row.guid, row.host, row.operator.encode('latin-1'), row.rtt))
 			except Exception as error:
                                 print "Error in row:", row, error
 			count += 1
 	print FormatDate(), "Dumped {} rows to {}\n".format(count, fileName)
+	return count
+
 
+def DumpExpHttpDownload(session, startTime, endTime):
 	########## monroe_exp_http_download ###############
-	session.default_fetch_size = 1000
 	fileName = FileNamePrefix(startTime) + "{}_monroe_exp_http_download.csv".format(startTime)
-	with open(fileName, "wt") as output:
-		output.write("nodeid,iccid,timestamp,sequencenumber,bytes,dataid,dataversion,downloadtime,guid,host,operator,port,setuptime,speed,totaltime,errorcode,url\n")
-		query = "select * from monroe_exp_http_download where timestamp >= {} and timestamp < {} allow filtering".format(startTime, endTime)
+	(query, table) = DumpQuery("monroe_exp_http_download", startTime, endTime)
+	with ResumableDump(fileName, query, "nodeid,iccid,timestamp,sequencenumber,bytes,dataid,dataversion,downloadtime,guid,host,operator,port,setuptime,speed,totaltime,errorcode,url\n", workerForce) as output:
 		print query
-		rows = session.execute(query, timeout=None)
-		count = 0
+		rows = output.Rows(session, FetchSize(table))
+		count = output.count
 		for row in rows:
 			try:
 				output.write("{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n".format(row.nodeid, row.iccid, row.timestamp, row.sequencenumber, row.bytes, row.dataid, row.dataversion, row.downloadtime, row.guid, row.host, row.operator, row.port, row.setuptime, row.speed, row.totaltime, row.errorcode, row.url))
@@ -82,16 +102,17 @@ def DumpOneDay(session, daysBack):
                                 print "Error in row:", row, error
 			count += 1
 	print FormatDate(), "Dumped {} rows to {}\n".format(count, fileName)
+	return count
+
 
+def DumpMetaDeviceGps(session, startTime, endTime):
 	########## monroe_meta_device_gps #################
-	session.default_fetch_size = 1000
 	fileName = FileNamePrefix(startTime) + "{}_monroe_meta_device_gps.csv".format(startTime)
-	with open(fileName, "wt") as output:
-		output.write("nodeid,timestamp,sequencenumber,altitude,dataid,dataversion,latitude,longitude,nmea,satellitecount,speed\n")
-		query = "select * from monroe_meta_device_gps where timestamp >= {} and timestamp < {} allow filtering".format(startTime, endTime)
+	(query, table) = DumpQuery("monroe_meta_device_gps", startTime, endTime)
+	with ResumableDump(fileName, query, "nodeid,timestamp,sequencenumber,altitude,dataid,dataversion,latitude,longitude,nmea,satellitecount,speed\n", workerForce) as output:
 		print query
-		rows = session.execute(query, timeout=None)
-		count = 0
+		rows = output.Rows(session, FetchSize(table))
+		count = output.count
 		for row in rows:
 			try:
 				nmea = row.nmea.replace("\r","\\r").replace("\n","\\n") if row.nmea is not None else ""
@@ -100,16 +121,17 @@ def DumpOneDay(session, daysBack):
                                 print "Error in row:", row, error
 			count += 1
 	print FormatDate(), "Dumped {} rows to {}\n".format(count, fileName)
+	return count
+
 
+def DumpMetaDeviceModem(session, startTime, endTime):
 	########## monroe_meta_device_modem ###############
-	session.default_fetch_size = 1000
 	fileName = FileNamePrefix(startTime) + "{}_monroe_meta_device_modem.csv".format(startTime)
-	with open(fileName, "wt") as output:
-		output.write("nodeid,iccid,timestamp,sequencenumber,band,cid,dataid,dataversion,devicemode,devicestate,devicesubmode,ecio,enodebid,frequency,imei,imsi,imsimccmnc,interfacename,internalinterface,internalipaddress,ipaddress,lac,mccmnc,nwmccmnc,operator,pci,rscp,rsrp,rsrq,rssi\n")
-		query = "select * from monroe_meta_device_modem where timestamp >= {} and timestamp < {} allow filtering".format(startTime, endTime)
+	(query, table) = DumpQuery("monroe_meta_device_modem", startTime, endTime)
+	with ResumableDump(fileName, query, "nodeid,iccid,timestamp,sequencenumber,band,cid,dataid,dataversion,devicemode,devicestate,devicesubmode,ecio,enodebid,frequency,imei,imsi,imsimccmnc,interfacename,internalinterface,internalipaddress,ipaddress,lac,mccmnc,nwmccmnc,operator,pci,rscp,rsrp,rsrq,rssi\n", workerForce) as output:
 		print query
-		rows = session.execute(query, timeout=None)
-		count = 0
+		rows = output.Rows(session, FetchSize(table))
+		count = output.count
 		for row in rows:
 			try:
 				output.write("{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n".format(row.nodeid, row.iccid, row.timestamp, row.sequencenumber, row.band, row.cid, row.dataid, row.dataversion, row.devicemode, row.devicestate, row.devicesubmode, row.ecio, row.enodebid, row.frequency, row.imei, row.imsi, row.imsimccmnc, row.interfacename, row.internalinterface, row.internalipaddress, row.ipaddress, row.lac, row.mccmnc, row.nwmccmnc, row.operator.encode('latin-1'), row.pci, row.rscp, row.rsrp, row.rsrq, row.rssi))
@@ -117,16 +139,17 @@ def DumpOneDay(session, daysBack):
                                 print "Error in row:", row, error
 			count += 1
 	print FormatDate(), "Dumped {} rows to {}\n".format(count, fileName)
+	return count
 
+
+def DumpMetaNodeEvent(session, startTime, endTime):
 	########## monroe_meta_node_event ###############
-	session.default_fetch_size = 1000
 	fileName = FileNamePrefix(startTime) + "{}_monroe_meta_node_event.csv".format(startTime)
-	with open(fileName, "wt") as output:
-		output.write("nodeid, sequencenumber, timestamp, dataid, dataversion, eventtype, message, user, id\n")
-		query = "select * from monroe_meta_node_event where timestamp >= {} and timestamp < {} allow filtering".format(startTime, endTime)
+	query = "select * from monroe_meta_node_event where timestamp >= {} and timestamp < {} allow filtering".format(startTime, endTime)
+	with ResumableDump(fileName, query, "nodeid, sequencenumber, timestamp, dataid, dataversion, eventtype, message, user, id\n", workerForce) as output:
 		print query
-		rows = session.execute(query, timeout=None)
-		count = 0
+		rows = output.Rows(session, FetchSize("monroe_meta_node_event"))
+		count = output.count
 		for row in rows:
 			try:
 				output.write('{},{},{},{},{},{},"{}",{},{}\n'.format(row.nodeid, row.sequencenumber, row.timestamp, row.dataid, row.dataversion, row.eventtype, row.message, row.user, row.id))
@@ -134,16 +157,17 @@ def DumpOneDay(session, daysBack):
                                 print "Error in row:", row, error
 			count += 1
 	print FormatDate(), "Dumped {} rows to {}\n".format(count, fileName)
+	return count
 
+
+def DumpMetaNodeSensor(session, startTime, endTime):
 	########## monroe_meta_node_sensor ###############
-	session.default_fetch_size = 10
 	fileName = FileNamePrefix(startTime) + "{}_monroe_meta_node_sensor.csv".format(startTime)
-	with open(fileName, "wt") as output:
-		output.write("nodeid, timestamp, sequencenumber, apps, cpu, current, dataid, dataversion, dlb, free, guest, id, idle, iowait, irq, modems, nice, percent, running, softirq, start, steal, swap, system, total, usb0, usb0charging, usb1, usb1charging, usb2, usb2charging, usbmonitor, user\n")
-		query = "select * from monroe_meta_node_sensor where timestamp >= {} and timestamp < {} allow filtering".format(startTime, endTime)
+	(query, table) = DumpQuery("monroe_meta_node_sensor", startTime, endTime)
+	with ResumableDump(fileName, query, "nodeid, timestamp, sequencenumber, apps, cpu, current, dataid, dataversion, dlb, free, guest, id, idle, iowait, irq, modems, nice, percent, running, softirq, start, steal, swap, system, total, usb0, usb0charging, usb1, usb1charging, usb2, usb2charging, usbmonitor, user\n", workerForce) as output:
 		print query
-		rows = session.execute(query, timeout=None)
-		count = 0
+		rows = output.Rows(session, FetchSize(table))
+		count = output.count
 		for row in rows:
 			try:
 				output.write('{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n'.format(row.nodeid, row.timestamp, row.sequencenumber, row.apps, row.cpu, row.current, row.dataid, row.dataversion, row.dlb, row.free, row.guest, row.id, row.idle, row.iowait, row.irq, row.modems, row.nice, row.percent, row.running, row.softirq, row.start, row.steal, row.swap, row.system, row.total, row.usb0, row.usb0charging, row.usb1, row.usb1charging, row.usb2, row.usb2charging, row.usbmonitor, row.user))
@@ -151,16 +175,17 @@ def DumpOneDay(session, daysBack):
                                 print "Error in row:", row, error
 			count += 1
 	print FormatDate(), "Dumped {} rows to {}\n".format(count, fileName)
+	return count
+
 
+def DumpExpSimpleTraceroute(session, startTime, endTime):
 	########## monroe_exp_simple_traceroute ###############
-	session.default_fetch_size = 1000
 	fileName = FileNamePrefix(startTime) + "{}_monroe_exp_simple_traceroute.csv".format(startTime)
-	with open(fileName, "wt") as output:
-		output.write("NodeId\ttimestamp\tendTime\tDataId\tDataVersion\tcontainerTimestamp\thop\ttargetdomainname\tInterfaceName\tIpDst\tnumberOfHops\tsizeOfProbes\tIP\tHopName\tRTTSection\tannotationSection\n")
-		query = "select * from monroe_exp_simple_traceroute where timestamp >= {} and timestamp < {}".format(startTime, endTime)
+	query = "select * from monroe_exp_simple_traceroute where timestamp >= {} and timestamp < {}".format(startTime, endTime)
+	with ResumableDump(fileName, query, "NodeId\ttimestamp\tendTime\tDataId\tDataVersion\tcontainerTimestamp\thop\ttargetdomainname\tInterfaceName\tIpDst\tnumberOfHops\tsizeOfProbes\tIP\tHopName\tRTTSection\tannotationSection\n", workerForce) as output:
 		print query
-		rows = session.execute(query, timeout=None)
-		count = 0
+		rows = output.Rows(session, FetchSize("monroe_exp_simple_traceroute"))
+		count = output.count
 		for row in rows:
 			try:
 				output.write('{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(row.nodeid, row.timestamp, row.endtime, row.dataid, row.dataversion, row.containertimestamp, row.hop, row.targetdomainname, row.interfacename, row.ipdst, row.numberofhops, row.sizeofprobes, row.ip, row.hopname, row.rttsection, row.annotationsection))
@@ -168,16 +193,17 @@ def DumpOneDay(session, daysBack):
                                 print "Error in row:", row, error
 			count += 1
 	print FormatDate(), "Dumped {} rows to {}\n".format(count, fileName)
+	return count
+
 
+def DumpExpExhaustiveParis(session, startTime, endTime):
 	########## monroe_exp_exhaustive_paris ###############
-	session.default_fetch_size = 1000
 	fileName = FileNamePrefix(startTime) + "{}_monroe_exp_exhaustive_paris.csv".format(startTime)
-	with open(fileName, "wt") as output:
-		output.write("NodeId\ttimestamp\tendTime\tDataId\tDataVersion\tcontainerTimestamp\thop\ttargetdomainname\tInterfaceName\tIpDst\tPortDst\tIpSrc\tPortSrc\tIP\tProto\tAlgorithm\tduration\tMinHopRTT\tMedianHopRTT\tMaxHopRTT\tStdHopRTT\tannotation\tflowIds\tMPLS\tTransmittedProbes\tSuccessfulProbes\n")
-		query = "select * from monroe_exp_exhaustive_paris where timestamp >= {} and timestamp < {}".format(startTime, endTime)
+	query = "select * from monroe_exp_exhaustive_paris where timestamp >= {} and timestamp < {}".format(startTime, endTime)
+	with ResumableDump(fileName, query, "NodeId\ttimestamp\tendTime\tDataId\tDataVersion\tcontainerTimestamp\thop\ttargetdomainname\tInterfaceName\tIpDst\tPortDst\tIpSrc\tPortSrc\tIP\tProto\tAlgorithm\tduration\tMinHopRTT\tMedianHopRTT\tMaxHopRTT\tStdHopRTT\tannotation\tflowIds\tMPLS\tTransmittedProbes\tSuccessfulProbes\n", workerForce) as output:
 		print query
-		rows = session.execute(query, timeout=None)
-		count = 0
+		rows = output.Rows(session, FetchSize("monroe_exp_exhaustive_paris"))
+		count = output.count
 		for row in rows:
 			try:
 				output.write('{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(row.nodeid, row.timestamp, row.endtime, row.dataid, row.dataversion, row.containertimestamp, row.hop, row.targetdomainname, row.interfacename, row.ipdst, row.portdst, row.ipsrc, row.portsrc, row.ip, row.proto, row.algorithm, row.duration, row.minhoprtt, row.medianhoprtt, row.maxhoprtt, row.stdhoprtt, row.annotation, row.flowids, row.mpls, row.transmittedprobes, row.successfulprobes))
@@ -185,16 +211,17 @@ def DumpOneDay(session, daysBack):
 				print "Error in row:", row, error
 			count += 1
 	print FormatDate(), "Dumped {} rows to {}\n".format(count, fileName)
+	return count
 
+
+def DumpExpTstatUdpComplete(session, startTime, endTime):
 	########## monroe_exp_tstat_udp_complete ###############
-	session.default_fetch_size = 1000
 	fileName = FileNamePrefix(startTime) + "{}_monroe_exp_tstat_udp_complete.csv".format(startTime)
-	with open(fileName, "wt") as output:
-		output.write("NodeId,Iccid,DataId,c_ip,c_port,c_first_abs,c_durat,c_bytes_all,c_pkts_all,c_isint,c_iscrypto,c_type,s_ip,s_port,s_first_abs,s_durat,s_bytes_all,s_pkts_all,s_isint,s_iscrypto,s_type,fqdn\n")
-		query = "select * from monroe_exp_tstat_udp_complete where c_first_abs >= {} and c_first_abs < {} allow filtering".format(startTime, endTime)
+	query = "select * from monroe_exp_tstat_udp_complete where c_first_abs >= {} and c_first_abs < {} allow filtering".format(startTime, endTime)
+	with ResumableDump(fileName, query, "NodeId,Iccid,DataId,c_ip,c_port,c_first_abs,c_durat,c_bytes_all,c_pkts_all,c_isint,c_iscrypto,c_type,s_ip,s_port,s_first_abs,s_durat,s_bytes_all,s_pkts_all,s_isint,s_iscrypto,s_type,fqdn\n", workerForce) as output:
 		print query
-		rows = session.execute(query, timeout=None)
-		count = 0
+		rows = output.Rows(session, FetchSize("monroe_exp_tstat_udp_complete"))
+		count = output.count
 		for row in rows:
 			try:
 				output.write('{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n'.format(row.nodeid, row.iccid, row.dataid, row.c_ip, row.c_port, row.c_first_abs, row.c_durat, row.c_bytes_all, row.c_pkts_all, row.c_isint, row.c_iscrypto, row.c_type, row.s_ip, row.s_port, row.s_first_abs, row.s_durat, row.s_bytes_all, row.s_pkts_all, row.s_isint, row.s_iscrypto, row.s_type, row.fqdn))
@@ -202,16 +229,17 @@ def DumpOneDay(session, daysBack):
 				print "Error in row:", row, error
 			count += 1
 	print FormatDate(), "Dumped {} rows to {}\n".format(count, fileName)
+	return count
+
 
+def DumpExpTstatHttpComplete(session, startTime, endTime):
 	########## monroe_exp_tstat_http_complete ###############
-	session.default_fetch_size = 1000
 	fileName = FileNamePrefix(startTime) + "{}_monroe_exp_tstat_http_complete.csv".format(startTime)
-	with open(fileName, "wt") as output:
-		output.write("NodeId,Iccid,DataId,c_ip,c_port,s_ip,s_port,time_abs,method_HTTP,hostname_response,fqdn_content_len,path_content_type,referer_server,user_agent_range,cookie_location,dnt_set_cookie\n")
-		query = "select * from monroe_exp_tstat_http_complete where time_abs >= {} and time_abs < {} allow filtering".format(startTime, endTime)
+	query = "select * from monroe_exp_tstat_http_complete where time_abs >= {} and time_abs < {} allow filtering".format(startTime, endTime)
+	with ResumableDump(fileName, query, "NodeId,Iccid,DataId,c_ip,c_port,s_ip,s_port,time_abs,method_HTTP,hostname_response,fqdn_content_len,path_content_type,referer_server,user_agent_range,cookie_location,dnt_set_cookie\n", workerForce) as output:
 		print query
-		rows = session.execute(query, timeout=None)
-		count = 0
+		rows = output.Rows(session, FetchSize("monroe_exp_tstat_http_complete"))
+		count = output.count
 		for row in rows:
 			try:
 				output.write('{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n'.format(row.nodeid, row.iccid, row.dataid, row.c_ip, row.c_port, row.s_ip, row.s_port, row.time_abs, row.method_http, row.hostname_response, row.fqdn_content_len, row.path_content_type, row.referer_server, row.user_agent_range, row.cookie_location, row.dnt_set_cookie))
@@ -219,16 +247,17 @@ def DumpOneDay(session, daysBack):
 				print "Error in row:", row, error
 			count += 1
 	print FormatDate(), "Dumped {} rows to {}\n".format(count, fileName)
+	return count
+
 
+def DumpExpTstatTcpComplete(session, startTime, endTime):
 	########## monroe_exp_tstat_tcp_complete ###############
-	session.default_fetch_size = 1000
 	fileName = FileNamePrefix(startTime) + "{}_monroe_exp_tstat_tcp_complete.csv".format(startTime)
-	with open(fileName, "wt") as output:
-		output.write("NodeId,Iccid,DataId,c_ip,c_port,c_pkts_all,c_rst_cnt,c_ack_cnt,c_ack_cnt_p,c_bytes_uniq,c_pkts_data,c_bytes_all,c_pkts_retx,c_bytes_retx,c_pkts_ooo,c_syn_cnt,c_fin_cnt,s_ip,s_port,s_pkts_all,s_rst_cnt,s_ack_cnt,s_ack_cnt_p,s_bytes_uniq,s_pkts_data,s_bytes_all,s_pkts_retx,s_bytes_retx,s_pkts_ooo,s_syn_cnt,s_fin_cnt,first,last,durat,c_first,s_first,c_last,s_last,c_first_ack,s_first_ack,c_isint,s_isint,c_iscrypto,s_iscrypto,con_t,p2p_t,http_t,c_rtt_avg,c_rtt_min,c_rtt_max,c_rtt_std,c_rtt_cnt,c_ttl_min,c_ttl_max,s_rtt_avg,s_rtt_min,s_rtt_max,s_rtt_std,s_rtt_cnt,s_ttl_min,s_ttl_max,p2p_st,ed2k_data,ed2k_sig,ed2k_c2s,ed2k_c2c,ed2k_chat,c_f1323_opt,c_tm_opt,c_win_scl,c_sack_opt,c_sack_cnt,c_mss,c_mss_max,c_mss_min,c_win_max,c_win_min,c_win_0,c_cwin_max,c_cwin_min,c_cwin_ini,c_pkts_rto,c_pkts_fs,c_pkts_reor,c_pkts_dup,c_pkts_unk,c_pkts_fc,c_pkts_unrto,c_pkts_unfs,c_syn_retx,s_f1323_opt,s_tm_opt,s_win_scl,s_sack_opt,s_sack_cnt,s_mss,s_mss_max,s_mss_min,s_win_max,s_win_min,s_win_0,s_cwin_max,s_cwin_min,s_cwin_ini,s_pkts_rto,s_pkts_fs,s_pkts_reor,s_pkts_dup,s_pkts_unk,s_pkts_fc,s_pkts_unrto,s_pkts_unfs,s_syn_retx,http_req_cnt,http_res_cnt,http_res,c_pkts_push,s_pkts_push,c_tls_SNI,s_tls_SCN,c_npnalpn,s_npnalpn,c_tls_sesid,c_last_handshakeT,s_last_handshakeT,c_appdataT,s_appdataT,c_appdataB,s_appdataB,fqdn,dns_rslv,req_tm,res_tm\n")
-		query = "select * from monroe_exp_tstat_tcp_complete where first >= {} and first < {} allow filtering".format(startTime, endTime)
+	query = "select * from monroe_exp_tstat_tcp_complete where first >= {} and first < {} allow filtering".format(startTime, endTime)
+	with ResumableDump(fileName, query, "NodeId,Iccid,DataId,c_ip,c_port,c_pkts_all,c_rst_cnt,c_ack_cnt,c_ack_cnt_p,c_bytes_uniq,c_pkts_data,c_bytes_all,c_pkts_retx,c_bytes_retx,c_pkts_ooo,c_syn_cnt,c_fin_cnt,s_ip,s_port,s_pkts_all,s_rst_cnt,s_ack_cnt,s_ack_cnt_p,s_bytes_uniq,s_pkts_data,s_bytes_all,s_pkts_retx,s_bytes_retx,s_pkts_ooo,s_syn_cnt,s_fin_cnt,first,last,durat,c_first,s_first,c_last,s_last,c_first_ack,s_first_ack,c_isint,s_isint,c_iscrypto,s_iscrypto,con_t,p2p_t,http_t,c_rtt_avg,c_rtt_min,c_rtt_max,c_rtt_std,c_rtt_cnt,c_ttl_min,c_ttl_max,s_rtt_avg,s_rtt_min,s_rtt_max,s_rtt_std,s_rtt_cnt,s_ttl_min,s_ttl_max,p2p_st,ed2k_data,ed2k_sig,ed2k_c2s,ed2k_c2c,ed2k_chat,c_f1323_opt,c_tm_opt,c_win_scl,c_sack_opt,c_sack_cnt,c_mss,c_mss_max,c_mss_min,c_win_max,c_win_min,c_win_0,c_cwin_max,c_cwin_min,c_cwin_ini,c_pkts_rto,c_pkts_fs,c_pkts_reor,c_pkts_dup,c_pkts_unk,c_pkts_fc,c_pkts_unrto,c_pkts_unfs,c_syn_retx,s_f1323_opt,s_tm_opt,s_win_scl,s_sack_opt,s_sack_cnt,s_mss,s_mss_max,s_mss_min,s_win_max,s_win_min,s_win_0,s_cwin_max,s_cwin_min,s_cwin_ini,s_pkts_rto,s_pkts_fs,s_pkts_reor,s_pkts_dup,s_pkts_unk,s_pkts_fc,s_pkts_unrto,s_pkts_unfs,s_syn_retx,http_req_cnt,http_res_cnt,http_res,c_pkts_push,s_pkts_push,c_tls_SNI,s_tls_SCN,c_npnalpn,s_npnalpn,c_tls_sesid,c_last_handshakeT,s_last_handshakeT,c_appdataT,s_appdataT,c_appdataB,s_appdataB,fqdn,dns_rslv,req_tm,res_tm\n", workerForce) as output:
 		print query
-		rows = session.execute(query, timeout=None)
-		count = 0
+		rows = output.Rows(session, FetchSize("monroe_exp_tstat_tcp_complete"))
+		count = output.count
 		for row in rows:
 			try:
 				output.write('{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n'.format(row.nodeid, row.iccid, row.dataid, row.c_ip, row.c_port, row.c_pkts_all, row.c_rst_cnt, row.c_ack_cnt, row.c_ack_cnt_p, row.c_bytes_uniq, row.c_pkts_data, row.c_bytes_all, row.c_pkts_retx, row.c_bytes_retx, row.c_pkts_ooo, row.c_syn_cnt, row.c_fin_cnt, row.s_ip, row.s_port, row.s_pkts_all, row.s_rst_cnt, row.s_ack_cnt, row.s_ack_cnt_p, row.s_bytes_uniq, row.s_pkts_data, row.s_bytes_all, row.s_pkts_retx, row.s_bytes_retx, row.s_pkts_ooo, row.s_syn_cnt, row.s_fin_cnt, row.first, row.last, row.durat, row.c_first, row.s_first, row.c_last, row.s_last, row.c_first_ack, row.s_first_ack, row.c_isint, row.s_isint, row.c_iscrypto, row.s_iscrypto, row.con_t, row.p2p_t, row.http_t, row.c_rtt_avg, row.c_rtt_min, row.c_rtt_max, row.c_rtt_std, row.c_rtt_cnt, row.c_ttl_min, row.c_ttl_max, row.s_rtt_avg, row.s_rtt_min, row.s_rtt_max, row.s_rtt_std, row.s_rtt_cnt, row.s_ttl_min, row.s_ttl_max, row.p2p_st, row.ed2k_data, row.ed2k_sig, row.ed2k_c2s, row.ed2k_c2c, row.ed2k_chat, row.c_f1323_opt, row.c_tm_opt, row.c_win_scl, row.c_sack_opt, row.c_sack_cnt, row.c_mss, row.c_mss_max, row.c_mss_min, row.c_win_max, row.c_win_min, row.c_win_0, row.c_cwin_max, row.c_cwin_min, row.c_cwin_ini, row.c_pkts_rto, row.c_pkts_fs, row.c_pkts_reor, row.c_pkts_dup, row.c_pkts_unk, row.c_pkts_fc, row.c_pkts_unrto, row.c_pkts_unfs, row.c_syn_retx, row.s_f1323_opt, row.s_tm_opt, row.s_win_scl, row.s_sack_opt, row.s_sack_cnt, row.s_mss, row.s_mss_max, row.s_mss_min, row.s_win_max, row.s_win_min, row.s_win_0, row.s_cwin_max, row.s_cwin_min, row.s_cwin_ini, row.s_pkts_rto, row.s_pkts_fs, row.s_pkts_reor, row.s_pkts_dup, row.s_pkts_unk, row.s_pkts_fc, row.s_pkts_unrto, row.s_pkts_unfs, row.s_syn_retx, row.http_req_cnt, row.http_res_cnt, row.http_res, row.c_pkts_push, row.s_pkts_push, row.c_tls_sni, row.s_tls_scn, row.c_npnalpn, row.s_npnalpn, row.c_tls_sesid, row.c_last_handshaket, row.s_last_handshaket, row.c_appdatat, row.s_appdatat, row.c_appdatab, row.s_appdatab, row.fqdn, row.dns_rslv, row.req_tm, row.res_tm))
@@ -236,16 +265,17 @@ def DumpOneDay(session, daysBack):
 				print "Error in row:", row, error
 			count += 1
 	print FormatDate(), "Dumped {} rows to {}\n".format(count, fileName)
+	return count
 
+
+def DumpExpTstatTcpNocomplete(session, startTime, endTime):
 	########## monroe_exp_tstat_tcp_nocomplete ###############
-	session.default_fetch_size = 1000
 	fileName = FileNamePrefix(startTime) + "{}_monroe_exp_tstat_tcp_nocomplete.csv".format(startTime)
-	with open(fileName, "wt") as output:
-		output.write("NodeId,Iccid,DataId,c_ip,c_port,c_pkts_all,c_rst_cnt,c_ack_cnt,c_ack_cnt_p,c_bytes_uniq,c_pkts_data,c_bytes_all,c_pkts_retx,c_bytes_retx,c_pkts_ooo,c_syn_cnt,c_fin_cnt,s_ip,s_port,s_pkts_all,s_rst_cnt,s_ack_cnt,s_ack_cnt_p,s_bytes_uniq,s_pkts_data,s_bytes_all,s_pkts_retx,s_bytes_retx,s_pkts_ooo,s_syn_cnt,s_fin_cnt,first,last,durat,c_first,s_first,c_last,s_last,c_first_ack,s_first_ack,c_isint,s_isint,c_iscrypto,s_iscrypto,con_t,p2p_t,http_t\n")
-		query = "select * from monroe_exp_tstat_tcp_nocomplete where first >= {} and first < {} allow filtering".format(startTime, endTime)
+	query = "select * from monroe_exp_tstat_tcp_nocomplete where first >= {} and first < {} allow filtering".format(startTime, endTime)
+	with ResumableDump(fileName, query, "NodeId,Iccid,DataId,c_ip,c_port,c_pkts_all,c_rst_cnt,c_ack_cnt,c_ack_cnt_p,c_bytes_uniq,c_pkts_data,c_bytes_all,c_pkts_retx,c_bytes_retx,c_pkts_ooo,c_syn_cnt,c_fin_cnt,s_ip,s_port,s_pkts_all,s_rst_cnt,s_ack_cnt,s_ack_cnt_p,s_bytes_uniq,s_pkts_data,s_bytes_all,s_pkts_retx,s_bytes_retx,s_pkts_ooo,s_syn_cnt,s_fin_cnt,first,last,durat,c_first,s_first,c_last,s_last,c_first_ack,s_first_ack,c_isint,s_isint,c_iscrypto,s_iscrypto,con_t,p2p_t,http_t\n", workerForce) as output:
 		print query
-		rows = session.execute(query, timeout=None)
-		count = 0
+		rows = output.Rows(session, FetchSize("monroe_exp_tstat_tcp_nocomplete"))
+		count = output.count
 		for row in rows:
 			try:
 				output.write('{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n'.format(row.nodeid, row.iccid, row.dataid, row.c_ip, row.c_port, row.c_pkts_all, row.c_rst_cnt, row.c_ack_cnt, row.c_ack_cnt_p, row.c_bytes_uniq, row.c_pkts_data, row.c_bytes_all, row.c_pkts_retx, row.c_bytes_retx, row.c_pkts_ooo, row.c_syn_cnt, row.c_fin_cnt, row.s_ip, row.s_port, row.s_pkts_all, row.s_rst_cnt, row.s_ack_cnt, row.s_ack_cnt_p, row.s_bytes_uniq, row.s_pkts_data, row.s_bytes_all, row.s_pkts_retx, row.s_bytes_retx, row.s_pkts_ooo, row.s_syn_cnt, row.s_fin_cnt, row.first, row.last, row.durat, row.c_first, row.s_first, row.c_last, row.s_last, row.c_first_ack, row.s_first_ack, row.c_isint, row.s_isint, row.c_iscrypto, row.s_iscrypto, row.con_t, row.p2p_t, row.http_t))
@@ -253,38 +283,183 @@ def DumpOneDay(session, daysBack):
 				print "Error in row:", row, error
 			count += 1
 	print FormatDate(), "Dumped {} rows to {}\n".format(count, fileName)
+	return count
 
+
+def DumpExpNettest(session, startTime, endTime):
 	########## monroe_exp_nettest ###############
-	session.default_fetch_size = 1000
 	fileName = FileNamePrefix(startTime) + "{}_monroe_exp_nettest.csv".format(startTime)
-	with open(fileName, "wt") as output:	
-		output.write("timestamp,iccid,nodeid,dataversion,dataid,sequencenumber,guid,operator,errorcode,cnf_server_host,res_id_test,res_time_start_s,res_time_end_s,res_status,res_status_msg,res_version_client,res_version_server,res_server_ip,res_server_port,res_encrypt,res_chunksize,res_tcp_congestion,res_total_bytes_dl,res_total_bytes_ul,res_uname_sysname,res_uname_nodename,res_uname_release,res_uname_version,res_uname_machine,res_rtt_tcp_payload_num,res_rtt_tcp_payload_client_ns,res_rtt_tcp_payload_server_ns,res_dl_num_flows,res_dl_time_ns,res_dl_bytes,res_dl_throughput_kbps,res_ul_num_flows,res_ul_time_ns,res_ul_bytes,res_ul_throughput_kbps,IMSIMCCMNC,NWMCCMNC\n")
-		query = "select * from monroe_exp_nettest where timestamp >= {} and timestamp < {} allow filtering".format(startTime, endTime)
+	query = "select * from monroe_exp_nettest where timestamp >= {} and timestamp < {} allow filtering".format(startTime, endTime)
+	with ResumableDump(fileName, query, "timestamp,iccid,nodeid,dataversion,dataid,sequencenumber,guid,operator,errorcode,cnf_server_host,res_id_test,res_time_start_s,res_time_end_s,res_status,res_status_msg,res_version_client,res_version_server,res_server_ip,res_server_port,res_encrypt,res_chunksize,res_tcp_congestion,res_total_bytes_dl,res_total_bytes_ul,res_uname_sysname,res_uname_nodename,res_uname_release,res_uname_version,res_uname_machine,res_rtt_tcp_payload_num,res_rtt_tcp_payload_client_ns,res_rtt_tcp_payload_server_ns,res_dl_num_flows,res_dl_time_ns,res_dl_bytes,res_dl_throughput_kbps,res_ul_num_flows,res_ul_time_ns,res_ul_bytes,res_ul_throughput_kbps,IMSIMCCMNC,NWMCCMNC\n", workerForce) as output:
 		print query
-		rows = session.execute(query, timeout=None)
-		count = 0;
+		rows = output.Rows(session, FetchSize("monroe_exp_nettest"))
+		count = output.count
 		for row in rows:
-			# The driver automatically fetches the next page of rows when the current one is exhausted.
+			# The next page of rows is already being fetched while this one is written.
 			try:
 				output.write("{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n".format(row.timestamp, row.iccid, row.nodeid, row.dataversion, row.dataid, row.sequencenumber, row.guid, row.operator.encode('latin-1'), row.errorcode, row.cnf_server_host, row.res_id_test, row.res_time_start_s, row.res_time_end_s, row.res_status, row.res_status_msg, row.res_version_client, row.res_version_server, row.res_server_ip, row.res_server_port, row.res_encrypt, row.res_chunksize, row.res_tcp_congestion, row.res_total_bytes_dl, row.res_total_bytes_ul, row.res_uname_sysname, row.res_uname_nodename, row.res_uname_release, row.res_uname_version, row.res_uname_machine, row.res_rtt_tcp_payload_num, row.res_rtt_tcp_payload_client_ns, row.res_rtt_tcp_payload_server_ns, row.res_dl_num_flows, row.res_dl_time_ns, row.res_dl_bytes, row.res_dl_throughput_kbps, row.res_ul_num_flows, row.res_ul_time_ns, row.res_ul_bytes, row.res_ul_throughput_kbps, row.imsimccmnc, row.nwmccmnc))
 			except Exception as error:
                                 print "Error in row:", row, error
 			count += 1
 	print FormatDate(), "Dumped {} rows to {}\n".format(count, fileName)
+	return count
+
+
+# Tables dumped every day, in dump order, with the function that dumps each of them.
+TABLE_DUMPERS = [
+	("monroe_exp_ping", DumpExpPing),
+	("monroe_exp_http_download", DumpExpHttpDownload),
+	("monroe_meta_device_gps", DumpMetaDeviceGps),
+	("monroe_meta_device_modem", DumpMetaDeviceModem),
+	("monroe_meta_node_event", DumpMetaNodeEvent),
+	("monroe_meta_node_sensor", DumpMetaNodeSensor),
+	("monroe_exp_simple_traceroute", DumpExpSimpleTraceroute),
+	("monroe_exp_exhaustive_paris", DumpExpExhaustiveParis),
+	("monroe_exp_tstat_udp_complete", DumpExpTstatUdpComplete),
+	("monroe_exp_tstat_http_complete", DumpExpTstatHttpComplete),
+	("monroe_exp_tstat_tcp_complete", DumpExpTstatTcpComplete),
+	("monroe_exp_tstat_tcp_nocomplete", DumpExpTstatTcpNocomplete),
+	("monroe_exp_nettest", DumpExpNettest),
+]
 
-if __name__ == '__main__':
 
+###############################################################################
+# Dump orchestration: every (table, day) pair is an independent job. Jobs run in a pool of
+#  worker processes, each with its own connection to the DB.
+
+workerCluster = None
+workerSession = None
+workerBucketed = False
+workerForce = False
+workerVariants = {}	# Table -> its bucketed variant in the keyspace
+
+def Connect():
+	# Returns (cluster, session) connected to the 'monroe' keyspace.
 	auth = PlainTextAuthProvider(username = "xxxx", password = "yyy")
 	cluster = Cluster(contact_points = ['127.0.0.1'], port = 9042, auth_provider = auth)
-	session = None
 	session = cluster.connect("monroe") # Set default keyspace to 'monroe'
 	session.default_timeout = None
 	session.default_fetch_size = 1000
+	return (cluster, session)
 
-	for ii in range (1, 2): # Default is one day back (the previous day).
-		DumpOneDay(session, ii)
+def InitWorker(bucketed = False, force = False):
+	# Runs once in every worker process, after fork(): the connection is never shared.
+	# The connection is closed when the worker process exits (atexit handlers do not run in
+	#  pool processes, multiprocessing finalizers do).
+	global workerCluster, workerSession, workerBucketed, workerForce, workerVariants
+	(workerCluster, workerSession) = Connect()
+	Finalize(None, workerCluster.shutdown, exitpriority = 10)
+	workerBucketed = bucketed
+	workerForce = force
+	workerVariants = {}
+	if bucketed:
+		tables = workerCluster.metadata.keyspaces["monroe"].tables
+		for name in sorted(tables):
+			split = monroe_buckets.split_table_name(name)
+			if split is not None and split[0] in tables:
+				workerVariants.setdefault(split[0], name)
 
-	cluster.shutdown() # Closes connection to the DB and frees resources.
+def CalcDayTimes(day):
+	# Returns the interval [00:00, 24:00) UTC of the given date.
+	startTime = timegm(day.timetuple())
+	return (startTime, startTime + 3600*24)
 
-	print FormatDate(), "DUMP FINISHED.\n"
+def DumpJob(job):
+	# Dumps one table for one day. Returns (job, rows, seconds, error).
+	(table, startTime, endTime) = job
+	dumper = dict(TABLE_DUMPERS)[table]
+	t0 = time()
+	try:
+		count = dumper(workerSession, startTime, endTime)
+		return (job, count, time() - t0, None)
+	except Exception as error:
+		return (job, 0, time() - t0, str(error))
+
+def DumpJobs(days, tables, processes, bucketed = False, force = False):
+	# Dumps the given tables for every given day using at most "processes" worker processes.
+	#  With bucketed, tables are read from their bucketed variants (see DumpQuery). Tables already
+	#  dumped by a previous run are skipped unless force (see ResumableDump).
+	# Returns the list of jobs that failed.
+	jobs = []
+	for day in days:
+		(startTime, endTime) = CalcDayTimes(day)
+		for table in tables:
+			jobs.append((table, startTime, endTime))
+
+	print FormatDate(), "Dumping {} tables x {} days ({} jobs) with {} processes\n".format(len(tables), len(days), len(jobs), processes)
+	if processes > 1:
+		pool = Pool(processes = processes, initializer = InitWorker, initargs = (bucketed, force))
+		results = pool.imap_unordered(DumpJob, jobs)
+	else:
+		pool = None
+		InitWorker(bucketed, force)
+		results = (DumpJob(job) for job in jobs)
+
+	failed = []
+	done = 0
+	for (job, count, seconds, error) in results:
+		done += 1
+		(table, startTime, endTime) = job
+		day = strftime("%Y-%m-%d", gmtime(startTime))
+		if error is None:
+			print FormatDate(), "[{}/{}] {} {}: {} rows in {:.1f} s".format(done, len(jobs), day, table, count, seconds)
+		else:
+			print FormatDate(), "[{}/{}] {} {}: FAILED after {:.1f} s: {}".format(done, len(jobs), day, table, seconds, error)
+			failed.append(job)
 
+	if pool is not None:
+		pool.close()
+		pool.join()
+	else:
+		workerCluster.shutdown()
+	return failed
+
+###############################################################################
+def ParseDate(text):
+	return datetime.strptime(text, "%Y-%m-%d").date()
+
+def ParseCommandLine():
+	parser = argparse.ArgumentParser(description = "Daily dump of the MONROE tables to CSV")
+
+	parser.add_argument('-d', '--daysBack', help = 'Dump the day this many days back (default 1, the previous day)', required = False, type = int, default = 1)
+	parser.add_argument('-s', '--startDate', help = 'First day to dump (YYYY-MM-DD), for backfills', required = False, type = ParseDate)
+	parser.add_argument('-e', '--endDate', help = 'Last day to dump (YYYY-MM-DD, included; same as --startDate by default)', required = False, type = ParseDate)
+	parser.add_argument('-t', '--tables', help = 'Tables to dump (all by default)', required = False, nargs = '+', choices = [table for (table, dumper) in TABLE_DUMPERS])
+	parser.add_argument('-b', '--bucketed', help = 'Read the tables from their time-bucketed (_by_day/_by_week) variants, for a DB imported with --bucketed', required = False, action = 'store_true')
+	parser.add_argument('-f', '--force', help = 'Dump again the tables already dumped by a previous run', required = False, action = 'store_true')
+	parser.add_argument('-p', '--processes', help = 'Maximum number of concurrent dump processes (default 1)', required = False, type = int, default = 1)
+
+	args = parser.parse_args()
+
+	# Validate args
+	if args.startDate is None:
+		args.startDate = (datetime.utcnow() + relativedelta(days=-args.daysBack)).date()
+	if args.endDate is None:
+		args.endDate = args.startDate
+	elif args.endDate < args.startDate:
+		parser.error("--endDate {} is before the first day {}".format(args.endDate, args.startDate))
+	if args.tables is None:
+		args.tables = [table for (table, dumper) in TABLE_DUMPERS]
+	if args.processes < 1:
+		args.processes = 1
+
+	return args
+
+if __name__ == '__main__':
+	args = ParseCommandLine()
+
+	days = []
+	day = args.startDate
+	while day <= args.endDate:
+		days.append(day)
+		day += relativedelta(days=1)
+
+	failed = DumpJobs(days, args.tables, args.processes, args.bucketed, args.force)
+
+	if len(failed) > 0:
+		print FormatDate(), "DUMP FINISHED WITH {} FAILED JOBS:".format(len(failed))
+		for (table, startTime, endTime) in failed:
+			print "  {} {}".format(strftime("%Y-%m-%d", gmtime(startTime)), table)
+		raise SystemExit(1)
+
+	print FormatDate(), "DUMP FINISHED.\n"
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""The example tools are imported as top-level modules, as they import each other."""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
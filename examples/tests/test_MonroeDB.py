@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("cassandra")
+import MonroeDB
+
+
+class Result(object):
+	def __init__(self, rows, pagingState):
+		self.current_rows = rows
+		self.paging_state = pagingState
+
+
+class Future(object):
+	def __init__(self, result):
+		self.value = result
+
+	def result(self):
+		return self.value
+
+
+# Session returning two pages of 3 rows (timestamp, rtt) per partition, nodeid * 10 + i.
+class Session(object):
+	row_factory = None
+
+	def __init__(self):
+		self.queries = []
+
+	def prepare(self, query):
+		self.queries.append(query)
+		return type("Statement", (), {})()
+
+	def execute_async(self, statement, parameters, paging_state = None):
+		base = int(parameters[0]) * 10 + (3 if paging_state else 0)
+		rows = [(Decimal(base + i), 1.5) for i in range(3)]
+		return Future(Result(self.row_factory(["timestamp", "rtt"], rows), None if paging_state else "next"))
+
+
+def test_schema_keys():
+	tables = MonroeDB.LoadSchema()
+	for name in ["monroe_exp_nettest", "monroe_exp_udp_ping"]:
+		assert tables[name].partition_key == ["nodeid"]
+		assert "primary" not in tables[name].columns
+
+
+def test_query_partitions():
+	session = Session()
+	db = MonroeDB.MonroeDB(session, concurrency = 2)
+	arrays = db.Query("monroe_exp_udp_ping", ["timestamp", "rtt"], startTime = 0, endTime = 100, nodeid = ["5", "1"])
+	db.Close()
+	assert session.queries == ["SELECT timestamp, rtt FROM monroe_exp_udp_ping WHERE nodeid = ? AND timestamp >= ? AND timestamp < ?"]
+	assert list(arrays["timestamp"]) == [10, 11, 12, 13, 14, 15, 50, 51, 52, 53, 54, 55]
+	assert arrays["timestamp"].dtype.name == "float64"
+
+
+def test_query_errors():
+	db = MonroeDB.MonroeDB(Session())
+	with pytest.raises(ValueError):
+		db.Query("monroe_exp_udp_ping", ["nosuchcolumn"], nodeid = "1")
+	with pytest.raises(ValueError):
+		db.Query("monroe_exp_udp_ping", ["rtt"], iccid = "1")
+	db.Close()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+from collections import namedtuple
+
+import pytest
+
+pytest.importorskip("cassandra")
+import PagedReader
+
+Row = namedtuple("Row", ["iccid", "timestamp"])
+
+
+class Result(object):
+	def __init__(self, rows, pagingState):
+		self.current_rows = rows
+		self.paging_state = pagingState
+
+
+class Future(object):
+	def __init__(self, session, result):
+		self.session = session
+		self.value = result
+
+	def result(self):
+		self.session.inFlight -= 1
+		return self.value
+
+
+#  Session returning two pages of 2 rows for the queries "<iccid> <bucket>", with timestamps
+# bucket + iccid + 0/10/20/30. Counts the requests in flight (not taken with result()).
+class Session(object):
+	def __init__(self):
+		self.queries = []
+		self.inFlight = 0
+		self.maxInFlight = 0
+
+	def execute_async(self, statement, parameters = None, timeout = None, paging_state = None):
+		self.queries.append((statement, paging_state))
+		self.inFlight += 1
+		self.maxInFlight = max(self.maxInFlight, self.inFlight)
+		(iccid, bucket) = [int(value) for value in statement.split()]
+		offsets = [20, 30] if paging_state else [0, 10]
+		rows = [Row(iccid, bucket + iccid + offset) for offset in offsets]
+		return Future(self, Result(rows, None if paging_state else "next"))
+
+
+@pytest.fixture(autouse = True)
+def statements(monkeypatch):
+	monkeypatch.setattr(PagedReader, "SimpleStatement", lambda query, fetch_size: query)
+
+
+def test_chained_rows():
+	session = Session()
+	statements = ["1 0", "1 100"]
+	window = PagedReader.RequestWindow(session, 1)
+	rows = PagedReader.ChainedRows(window, statements, window.Request(statements[0]))
+	assert [row.timestamp for row in rows] == [1, 11, 21, 31, 101, 111, 121, 131]
+	assert session.queries == [("1 0", None), ("1 0", "next"), ("1 100", None), ("1 100", "next")]
+	assert session.maxInFlight == 1
+
+
+def test_bucketed_rows():
+	session = Session()
+	rows = list(PagedReader.BucketedRows(session, "table_by_day", "2 {}", 0, 3600*24 + 1))
+	assert [row.timestamp for row in rows] == [2, 12, 22, 32, 86402, 86412, 86422, 86432]
+	assert list(PagedReader.BucketedRows(session, "table_by_day", "2 {}", 3600*48, 3600*48)) == []
+	with pytest.raises(ValueError):
+		list(PagedReader.BucketedRows(session, "table", "2 {}", 0, 10))
+
+
+def test_partitioned_rows_one_stream_per_partition():
+	session = Session()
+	partitions = [(iccid,) for iccid in range(1, 6)]
+	rows = list(PagedReader.PartitionedRows(session, "{} {}", partitions, buckets = [0, 100, 200], maxStreams = 2))
+	timestamps = [row.timestamp for row in rows]
+	assert timestamps == sorted(timestamps)
+	assert len(rows) == 5 * 3 * 4
+	# Never one page per (partition, bucket) in flight.
+	assert session.maxInFlight <= 3
+	assert len(session.queries) == 5 * 3 * 2
+
+
+def test_partitioned_rows_caps_first_pages():
+	session = Session()
+	partitions = [(iccid,) for iccid in range(1, 4)]
+	rows = PagedReader.PartitionedRows(session, "{} 0", partitions, maxStreams = 1)
+	assert next(rows).timestamp == 1
+	assert session.maxInFlight <= 2
+	assert sorted(row.timestamp for row in rows) == sorted([2, 3] + [iccid + offset for iccid in range(1, 4) for offset in (10, 20, 30)])
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+import TrackSimplify
+
+
+def test_douglas_peucker_straight_line():
+	x = numpy.arange(10, dtype = float)
+	y = numpy.zeros(10)
+	mask = TrackSimplify.DouglasPeucker(x, y, 0.5, numpy.zeros(0, dtype = int))
+	assert list(numpy.flatnonzero(mask)) == [0, 9]
+
+
+def test_douglas_peucker_keeps_corner_and_keep():
+	x = numpy.array([0.0, 1, 2, 3, 3, 3, 3])
+	y = numpy.array([0.0, 0, 0, 0, 1, 2, 3])
+	mask = TrackSimplify.DouglasPeucker(x, y, 0.1, numpy.array([1]))
+	assert list(numpy.flatnonzero(mask)) == [0, 1, 3, 6]
+	assert not TrackSimplify.DouglasPeucker(x[:0], y[:0], 1, numpy.zeros(0, dtype = int)).any()
+
+
+def test_group_changes():
+	assert list(TrackSimplify.GroupChanges(["a", "a", "b", "b", "b", "a"])) == [0, 1, 2, 4, 5]
+	assert len(TrackSimplify.GroupChanges([])) == 0
+
+
+def test_simplify():
+	# A straight track of 1001 positions ~11 m apart, with a change of operator in the middle.
+	latitude = numpy.linspace(59.0, 59.1, 1001)
+	longitude = numpy.full(1001, 18.0)
+	groups = ["a"] * 500 + ["b"] * 501
+	assert TrackSimplify.Simplify(latitude, longitude).all()
+	kept = numpy.flatnonzero(TrackSimplify.Simplify(latitude, longitude, groups, tolerance = 10))
+	assert list(kept) == [0, 499, 500, 1000]
+	kept = numpy.flatnonzero(TrackSimplify.Simplify(latitude, longitude, minDistance = 1000))
+	assert 10 <= len(kept) <= 13
+	kept = numpy.flatnonzero(TrackSimplify.Simplify(latitude, longitude, gridSize = 5000))
+	assert 2 <= len(kept) <= 4
@@ -0,0 +1,157 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Tar archives (e.g. the .txz backups of autocopy.sh) as importer input.
+
+Archives are read as a stream, one member at a time, so they are never
+unpacked to disk nor held in memory. Only the regular .json and .xz members
+are returned.
+
+The members already handled are recorded in a progress file next to the
+archive (see Progress), so an interrupted import resumes after the last
+recorded member instead of starting over.
+
+The .failed sidecars of members (see monroe_dbimporter.write_sidecar), e.g.
+in the failed-<date>.txz backups of the failed dir, are returned with their
+member by iter_members_with_sidecars.
+"""
+import json
+import os
+import tarfile
+
+import lzma
+
+ARCHIVE_EXTENSIONS = ('.txz', '.tar.xz',
+                      '.tgz', '.tar.gz',
+                      '.tbz2', '.tar.bz2',
+                      '.tar')
+MEMBER_EXTENSIONS = ('.json', '.xz')
+_CHUNK_SIZE = 1024 * 1024
+
+
+def is_archive(filename):
+    return filename.endswith(ARCHIVE_EXTENSIONS)
+
+
+class _XZStream(object):
+    """Read-only file object decompressing an xz file on the fly."""
+
+    def __init__(self, f):
+        self._f = f
+        self._decompressor = lzma.LZMADecompressor()
+        self._buffer = b''
+        self._position = 0
+        self._eof = False
+
+    def read(self, size=-1):
+        chunks = []
+        while size != 0:
+            if self._position >= len(self._buffer):
+                data = b'' if self._eof else self._f.read(_CHUNK_SIZE)
+                if not data:
+                    self._eof = True
+                    break
+                self._buffer = self._decompressor.decompress(data)
+                self._position = 0
+                continue
+            if size < 0:
+                end = len(self._buffer)
+            else:
+                end = min(len(self._buffer), self._position + size)
+                size -= end - self._position
+            chunks.append(self._buffer[self._position:end])
+            self._position = end
+        return b''.join(chunks)
+
+
+def iter_members(filename, extensions=MEMBER_EXTENSIONS):
+    """
+    Yield (member name, member data) of the .json and .xz files in filename.
+
+    The data is returned as stored (ie .xz members are still compressed).
+    Other files are returned if their name ends with one of extensions.
+    """
+    with open(filename, 'rb') as f:
+        if filename.endswith(('.txz', '.tar.xz')):
+            # tarfile has no xz support in Python 2
+            archive = tarfile.open(fileobj=_XZStream(f), mode='r|')
+        else:
+            archive = tarfile.open(fileobj=f, mode='r|*')
+        try:
+            for member in archive:
+                if member.isfile() and member.name.endswith(extensions):
+                    yield (member.name, archive.extractfile(member).read())
+        finally:
+            archive.close()
+
+
+def iter_members_with_sidecars(filename, sidecar_extension):
+    """
+    Yield (member name, member data, sidecar data) of the members in filename.
+
+    The sidecar of a member is the file <member name><sidecar_extension>,
+    its data is None if the archive has none. Sidecars are expected before
+    their member or right after it (monroe_archiver adds the files of a
+    folder in name order), so every member is held back until the next
+    file of the archive is read.
+    """
+    sidecars = {}
+    pending = None
+    for name, data in iter_members(filename,
+                                   MEMBER_EXTENSIONS + (sidecar_extension,)):
+        if name.endswith(sidecar_extension):
+            member_name = name[:-len(sidecar_extension)]
+            if pending is not None and pending[0] == member_name:
+                yield (pending[0], pending[1], data)
+                pending = None
+            else:
+                sidecars[member_name] = data
+            continue
+        if pending is not None:
+            yield (pending[0], pending[1], sidecars.pop(pending[0], None))
+        pending = (name, data)
+    if pending is not None:
+        yield (pending[0], pending[1], sidecars.pop(pending[0], None))
+
+
+class Progress(object):
+    """
+    Members of an archive already handled, kept in <archive>.progress.
+
+    The file holds a JSON object {member name: [inserts, failed]} (inserts
+    is -1 for members that could not be parsed) and is rewritten every
+    save_interval recorded members and by save().
+    """
+
+    def __init__(self, archive, save_interval=100):
+        self.path = archive + '.progress'
+        self.save_interval = save_interval
+        self.members = {}
+        self._unsaved = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.members = json.load(f)
+
+    def done(self, name):
+        return name in self.members
+
+    def record(self, name, inserts, failed):
+        self.members[name] = [inserts, failed]
+        self._unsaved += 1
+        if self._unsaved >= self.save_interval:
+            self.save()
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.members, f)
+        os.rename(tmp_path, self.path)
+        self._unsaved = 0
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
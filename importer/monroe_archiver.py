@@ -0,0 +1,325 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+r"""
+Archives the dated folders of the importer's failed and processed dirs.
+
+Every folder of --failed and --processed (as created by monroe_dbimporter,
+e.g. /experiments/processed/2016-09-15) except today's is written to
+<backups>/<kind>-<folder>.txz, where kind is failed or processed. Folders are
+archived concurrently, each one by a multi-threaded xz process.
+
+Each archive is verified while it is written, without reading it back: the
+xz output is decompressed in-process and its SHA-256 compared with the one
+of the tar stream sent to xz. Next to each archive are written:
+  <archive>.sha256  checksum of the archive (sha256sum format)
+  <archive>.index   one JSON object per member: name, size, mtime, sha256
+The sources are deleted only after the archive is verified and synced, and
+only the files that are in the index.
+
+Replaces the former tar/xz -t/rm loop of autocopy.sh (which now runs this).
+"""
+from datetime import date
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import syslog
+import tarfile
+import textwrap
+import threading
+from multiprocessing.pool import ThreadPool
+
+import lzma
+
+CMD_NAME = os.path.basename(__file__)
+VERBOSITY = 1
+CHUNK_SIZE = 1024 * 1024
+
+
+def log_msg(log_str, syslog_level, verbosity_level):
+    """Handles syslog and console messages."""
+    syslog.syslog(syslog_level, log_str)
+    if VERBOSITY > verbosity_level:
+        print (log_str)
+
+
+class _HashingWriter(object):
+    """File object writing to f and hashing what is written."""
+
+    def __init__(self, f):
+        self._f = f
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        self._f.write(data)
+
+
+class _HashingReader(object):
+    """File object reading from f and hashing what is read."""
+
+    def __init__(self, f):
+        self._f = f
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self._f.read(size)
+        self.sha256.update(data)
+        return data
+
+
+class _OutputWriter(threading.Thread):
+    """
+    Copies the xz output to the archive file.
+
+    Computes the SHA-256 of the compressed data and of the decompressed
+    data, the latter must match the SHA-256 of the tar stream.
+    """
+
+    def __init__(self, stream, f):
+        threading.Thread.__init__(self)
+        self._stream = stream
+        self._f = f
+        self.sha256 = hashlib.sha256()
+        self.tar_sha256 = hashlib.sha256()
+        self.size = 0
+        self.error = None
+
+    def run(self):
+        try:
+            decompressor = lzma.LZMADecompressor()
+            while True:
+                data = self._stream.read(CHUNK_SIZE)
+                if not data:
+                    break
+                self._f.write(data)
+                self.sha256.update(data)
+                self.size += len(data)
+                self.tar_sha256.update(decompressor.decompress(data))
+        except Exception as error:
+            self.error = error
+            # Keep reading so xz does not block on a full pipe
+            while self._stream.read(CHUNK_SIZE):
+                pass
+
+
+def _write_tar(tar_stream, base_dir, folder):
+    """
+    Write folder (relative to base_dir) as a tar stream.
+
+    Returns the index: a list of dicts (name, size, mtime, sha256) of the
+    regular files written.
+    """
+    index = []
+    tar = tarfile.open(fileobj=tar_stream, mode='w|')
+    try:
+        for root, dirs, files in os.walk(os.path.join(base_dir, folder)):
+            dirs.sort()
+            for name in [root] + [os.path.join(root, f) for f in sorted(files)]:
+                arcname = os.path.relpath(name, base_dir)
+                tarinfo = tar.gettarinfo(name, arcname)
+                if tarinfo is None:
+                    # Sockets etc. can not be archived
+                    continue
+                if not tarinfo.isreg():
+                    tar.addfile(tarinfo)
+                    continue
+                with open(name, 'rb') as f:
+                    reader = _HashingReader(f)
+                    tar.addfile(tarinfo, reader)
+                index.append({'name': arcname,
+                              'size': tarinfo.size,
+                              'mtime': tarinfo.mtime,
+                              'sha256': reader.sha256.hexdigest()})
+    finally:
+        tar.close()
+    return index
+
+
+def _delete_sources(base_dir, folder, index):
+    """Delete the files in index and the then empty dirs of folder."""
+    for member in index:
+        os.unlink(os.path.join(base_dir, member['name']))
+    left = 0
+    for root, dirs, files in os.walk(os.path.join(base_dir, folder),
+                                     topdown=False):
+        left += len(files)
+        try:
+            os.rmdir(root)
+        except OSError:
+            pass
+    return left
+
+
+def archive_folder(base_dir, folder, dest_path, threads, keep):
+    """
+    Archive base_dir/folder to dest_path and delete it if verified.
+
+    Returns True if the archive was written and verified.
+    """
+    part_path = dest_path + '.part'
+    log_str = "Processing {} into {}".format(os.path.join(base_dir, folder),
+                                             dest_path)
+    log_msg(log_str, syslog.LOG_INFO, 1)
+    with open(part_path, 'wb') as f:
+        xz = subprocess.Popen(['xz', '-z', '-c', '-T', str(threads)],
+                              stdin=subprocess.PIPE,
+                              stdout=subprocess.PIPE)
+        writer = _OutputWriter(xz.stdout, f)
+        writer.start()
+        tar_stream = _HashingWriter(xz.stdin)
+        try:
+            index = _write_tar(tar_stream, base_dir, folder)
+        except Exception as error:
+            index = None
+            log_str = "Error creating file {}: {}".format(dest_path, error)
+            log_msg(log_str, syslog.LOG_ERR, 0)
+        finally:
+            xz.stdin.close()
+            writer.join()
+            returncode = xz.wait()
+        f.flush()
+        os.fsync(f.fileno())
+
+    error = None
+    if index is None:
+        error = "tar failed"
+    elif returncode != 0:
+        error = "xz exited with {}".format(returncode)
+    elif writer.error is not None:
+        error = "decompression failed: {}".format(writer.error)
+    elif writer.tar_sha256.hexdigest() != tar_stream.sha256.hexdigest():
+        error = "decompressed data does not match"
+    elif os.path.getsize(part_path) != writer.size:
+        error = "size on disk does not match"
+    if error is not None:
+        log_str = "Error testing file {}: {}".format(dest_path, error)
+        log_msg(log_str, syslog.LOG_ERR, 0)
+        os.unlink(part_path)
+        return False
+
+    os.rename(part_path, dest_path)
+    with open(dest_path + '.sha256', 'w') as f:
+        f.write("{}  {}\n".format(writer.sha256.hexdigest(),
+                                  os.path.basename(dest_path)))
+    with open(dest_path + '.index', 'w') as f:
+        for member in index:
+            f.write(json.dumps(member))
+            f.write('\n')
+
+    if keep:
+        log_str = "File {} created ({} members, {} bytes).".format(
+            dest_path, len(index), writer.size)
+    else:
+        left = _delete_sources(base_dir, folder, index)
+        log_str = ("File {} created ({} members, {} bytes) and "
+                   "folder removed.").format(dest_path, len(index), writer.size)
+        if left > 0:
+            log_str += " {} file(s) added meanwhile were kept.".format(left)
+    log_msg(log_str, syslog.LOG_INFO, 0)
+    return True
+
+
+def find_folders(src_dirs, backup_dir):
+    """Return [(base_dir, folder, dest_path)] of the folders to archive."""
+    today = str(date.today())
+    jobs = []
+    for src_dir in src_dirs:
+        kind = os.path.basename(os.path.normpath(src_dir))
+        if not os.path.isdir(src_dir):
+            continue
+        for folder in sorted(os.listdir(src_dir)):
+            if not os.path.isdir(os.path.join(src_dir, folder)):
+                continue
+            if folder == today:
+                log_str = "Ignoring {} folder {}".format(kind, folder)
+                log_msg(log_str, syslog.LOG_INFO, 1)
+                continue
+            dest_path = os.path.join(backup_dir,
+                                     "{}-{}.txz".format(kind, folder))
+            jobs.append((src_dir, folder, dest_path))
+    return jobs
+
+
+def create_arg_parser():
+    """Create a argument parser and return it."""
+    parser = argparse.ArgumentParser(
+        prog=CMD_NAME,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''
+            Archives every folder except today's of the failed and
+            processed dirs of the importer into BACKUPS/<kind>-<folder>.txz
+            and deletes it once the archive is verified.'''))
+    parser.add_argument('-F', '--failed',
+                        metavar='DIR',
+                        default="/experiments/failed",
+                        help="Failed files (default /experiments/failed)")
+    parser.add_argument('-P', '--processed',
+                        metavar='DIR',
+                        default="/experiments/processed",
+                        help=("Processed files (default "
+                              "/experiments/processed)"))
+    parser.add_argument('-B', '--backups',
+                        metavar='DIR',
+                        default="/experiments/backups",
+                        help="Archive dir (default /experiments/backups)")
+    parser.add_argument('-c', '--concurrency',
+                        metavar='N',
+                        type=int,
+                        default=2,
+                        help="Folders archived in parallel (default 2)")
+    parser.add_argument('-T', '--threads',
+                        metavar='N',
+                        type=int,
+                        default=0,
+                        help=("xz threads per archive (default 0, as many "
+                              "as cores)"))
+    parser.add_argument('--keep',
+                        action="store_true",
+                        help="Do not delete the archived folders")
+    parser.add_argument('--verbosity',
+                        default=1,
+                        type=int,
+                        choices=range(0, 3),
+                        help="Verbosity level 0-2(default 1)")
+    return parser
+
+
+if __name__ == '__main__':
+    parser = create_arg_parser()
+    args = parser.parse_args()
+    VERBOSITY = args.verbosity
+
+    jobs = find_folders([args.failed, args.processed], args.backups)
+    pool = ThreadPool(processes=args.concurrency)
+    results = [pool.apply_async(archive_folder,
+                                (base_dir,
+                                 folder,
+                                 dest_path,
+                                 args.threads,
+                                 args.keep))
+               for base_dir, folder, dest_path in jobs]
+    pool.close()
+    pool.join()
+
+    failed = 0
+    for result in results:
+        try:
+            if not result.get():
+                failed += 1
+        except Exception as error:
+            log_str = "Error in archiving {}".format(error)
+            log_msg(log_str, syslog.LOG_ERR, 0)
+            failed += 1
+    log_str = "Archived {} of {} folder(s)".format(len(jobs) - failed,
+                                                   len(jobs))
+    log_msg(log_str, syslog.LOG_INFO, 0)
+    sys.exit(1 if failed > 0 else 0)
@@ -0,0 +1,48 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Time buckets for the bucketed table variants in db_schema.cql.
+
+A bucketed variant of a table is named <table>_by_day or <table>_by_week and
+has a Bucket column in its partition key holding the start of the bucket
+(UTC, seconds since epoch) that the entry's Timestamp falls into.
+Weeks start on Monday.
+"""
+
+DAY = 24 * 60 * 60
+WEEK = 7 * DAY
+# The epoch (1970-01-01) is a Thursday, the first Monday is 4 days later
+_WEEK_OFFSET = 4 * DAY
+
+SUFFIXES = {
+    '_by_day': DAY,
+    '_by_week': WEEK,
+}
+
+
+def split_table_name(table_name):
+    """Return (base table name, bucket seconds) or None if not bucketed."""
+    for suffix, seconds in SUFFIXES.items():
+        if table_name.endswith(suffix):
+            return (table_name[:-len(suffix)], seconds)
+    return None
+
+
+def bucket_start(timestamp, seconds):
+    """Return the start of the bucket of size seconds containing timestamp."""
+    offset = _WEEK_OFFSET if seconds == WEEK else 0
+    return int((timestamp - offset) // seconds) * seconds + offset
+
+
+def bucket_range(start_time, end_time, seconds):
+    """Return the starts of all buckets overlapping [start_time, end_time)."""
+    buckets = []
+    bucket = bucket_start(start_time, seconds)
+    while bucket < end_time:
+        buckets.append(bucket)
+        bucket += seconds
+    return buckets
@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Offline bulk output of monroe_dbimporter (--bulk-dir) for large backfills.
+
+Instead of being inserted, the validated entries are written per table as
+JSON lines (lowercase column names) sorted in Cassandra storage order:
+by the Murmur3 token of the partition key, then by the clustering columns.
+All rows of a partition are thus contiguous and the files can be fed in
+order to an offline bulk loader (e.g. CQLSSTableWriter with sorted(), or
+sstableloader after conversion) without any further sorting. Rows with the
+same primary key are merged as an upsert would (later values win).
+
+The table definitions (columns, partition and clustering keys, clustering
+order) are read from db_schema.cql, see monroe_schema. As the input may not fit in memory, rows are sorted in
+runs of at most run_rows rows that are merged when the writer is closed.
+
+Output in out_dir, per table:
+  <table>.jsonl  the sorted rows
+  <table>.cql    the CREATE TABLE and INSERT statements for the loader
+"""
+import heapq
+import json
+import os
+import shutil
+import struct
+import tempfile
+
+from cassandra.metadata import Murmur3Token
+
+from monroe_schema import Table, load_schema, clustering_values
+
+
+def _serialize(value, cql_type):
+    """Serialize a partition key component as Cassandra does."""
+    if cql_type in ('text', 'varchar', 'ascii'):
+        if not isinstance(value, bytes):
+            value = value.encode('utf-8')
+        return value
+    if cql_type == 'int':
+        return struct.pack('>i', int(value))
+    if cql_type == 'bigint':
+        return struct.pack('>q', int(value))
+    raise ValueError("Unsupported partition key type {}".format(cql_type))
+
+
+def partition_token(table, row):
+    """Return the Murmur3 token of the partition key of row."""
+    components = []
+    for column in table.partition_key:
+        if row.get(column) is None:
+            raise ValueError("Missing partition key {}".format(column))
+        components.append(_serialize(row[column], table.columns[column]))
+    if len(components) == 1:
+        key = components[0]
+    else:
+        key = b''.join(struct.pack('>H', len(component)) + component + b'\x00'
+                       for component in components)
+    return Murmur3Token.hash_fn(key)
+
+
+def sort_key(table, row):
+    """
+    Return the storage order key of row (token, partition, clustering).
+
+    The components of DESC clustering columns sort in reverse order.
+    """
+    return ([partition_token(table, row)] +
+            [row[column] for column in table.partition_key] +
+            clustering_values(table, row))
+
+
+class BulkWriter(object):
+    """
+    Writes rows per table in storage order (see the module docstring).
+
+    add() buffers rows and spills sorted runs to a temporary directory in
+    out_dir, close() merges the runs into the output files.
+    """
+
+    def __init__(self, out_dir, tables, run_rows=500000):
+        self.out_dir = out_dir
+        self.tables = tables
+        self.run_rows = run_rows
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        self._tmp_dir = tempfile.mkdtemp(prefix='runs-', dir=out_dir)
+        self._buffers = {}
+        self._buffered = 0
+        self._runs = {}
+
+    def add(self, table_name, entry):
+        """Add entry (a parsed JSON object) as a row of table_name."""
+        table = self.tables[table_name]
+        row = dict((key.lower(), value) for key, value in entry.items())
+        unknown = [key for key in row if key not in table.columns]
+        if unknown:
+            raise ValueError("Unknown column(s) {} in {}".format(
+                ", ".join(unknown), table_name))
+        self._buffers.setdefault(table_name, []).append(
+            (sort_key(table, row), row))
+        self._buffered += 1
+        if self._buffered >= self.run_rows:
+            self._spill()
+
+    def _spill(self):
+        for table_name, rows in self._buffers.items():
+            # The index keeps the input order of rows with the same key
+            rows = sorted((key, nr, row) for nr, (key, row) in enumerate(rows))
+            runs = self._runs.setdefault(table_name, [])
+            path = os.path.join(self._tmp_dir,
+                                '{}.{}'.format(table_name, len(runs)))
+            with open(path, 'w') as f:
+                for key, nr, row in rows:
+                    f.write(json.dumps(row))
+                    f.write('\n')
+            runs.append(path)
+        self._buffers = {}
+        self._buffered = 0
+
+    def _read_run(self, table, run_nr, path):
+        with open(path, 'r') as f:
+            for nr, line in enumerate(f):
+                row = json.loads(line)
+                yield (sort_key(table, row), run_nr, nr, row)
+
+    def close(self):
+        """Merge the runs into the output files, return {table: rows}."""
+        self._spill()
+        counts = {}
+        for table_name, runs in sorted(self._runs.items()):
+            table = self.tables[table_name]
+            merged = heapq.merge(*[self._read_run(table, run_nr, path)
+                                   for run_nr, path in enumerate(runs)])
+            count = 0
+            path = os.path.join(self.out_dir, table_name + '.jsonl')
+            with open(path + '.tmp', 'w') as f:
+                pending_key = None
+                pending = None
+                for key, run_nr, nr, row in merged:
+                    if key == pending_key:
+                        pending.update(row)
+                        continue
+                    if pending is not None:
+                        f.write(json.dumps(pending))
+                        f.write('\n')
+                        count += 1
+                    pending_key = key
+                    pending = row
+                if pending is not None:
+                    f.write(json.dumps(pending))
+                    f.write('\n')
+                    count += 1
+            os.rename(path + '.tmp', path)
+            self._write_statements(table)
+            counts[table_name] = count
+        shutil.rmtree(self._tmp_dir)
+        return counts
+
+    def _write_statements(self, table):
+        columns = sorted(table.columns)
+        insert = 'INSERT INTO {} ({}) VALUES ({});'.format(
+            table.name, ', '.join(columns), ', '.join('?' for _ in columns))
+        path = os.path.join(self.out_dir, table.name + '.cql')
+        with open(path, 'w') as f:
+            f.write(table.statement)
+            f.write('\n')
+            f.write(insert)
+            f.write('\n')
@@ -0,0 +1,179 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Data availability catalog maintained by monroe_dbimporter alongside the
+raw inserts.
+
+For each (table, day, NodeId, Iccid) the importer counts the imported rows
+and their size and keeps the first and last Timestamp, and writes them once
+per scan to monroe_catalog (counters, see db_schema.cql) and
+monroe_catalog_span (one partial row per scan, BatchId, as the counter
+table can not hold the timestamps). The counter updates of a table and day
+are sent in counter batches of up to BATCH_SIZE updates (a single
+partition).
+
+Tools find the nodes/ICCIDs with data in a table and time range with
+read_catalog() or active_partitions() instead of scanning the table.
+"""
+from decimal import Decimal
+from numbers import Number
+from threading import Lock
+import uuid
+
+import monroe_buckets
+
+BATCH_SIZE = 100
+
+COUNTER_QUERY = ("UPDATE monroe_catalog "
+                 "SET RowCount = RowCount + ?, Bytes = Bytes + ? "
+                 "WHERE TableName = ? AND Day = ? AND NodeId = ? AND Iccid = ?")
+
+SPAN_QUERY = ("INSERT INTO monroe_catalog_span "
+              "(TableName, Day, NodeId, Iccid, BatchId, "
+              "MinTimestamp, MaxTimestamp) "
+              "VALUES (?, ?, ?, ?, ?, ?, ?)")
+
+SELECT_COUNTER_QUERY = ("SELECT NodeId, Iccid, RowCount, Bytes "
+                        "FROM monroe_catalog "
+                        "WHERE TableName = ? AND Day = ?")
+
+SELECT_SPAN_QUERY = ("SELECT NodeId, Iccid, MinTimestamp, MaxTimestamp "
+                     "FROM monroe_catalog_span "
+                     "WHERE TableName = ? AND Day = ?")
+
+
+def _decimal(value):
+    if isinstance(value, float):
+        return Decimal(repr(value))
+    return Decimal(value)
+
+
+class CatalogAggregator(object):
+    """
+    Collects the catalog counts of the imported entries.
+
+    add() is called by the worker threads for every inserted entry, flush()
+    writes and resets the counts once per scan.
+    """
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = Lock()
+        self._counter_statement = None
+        self._span_statement = None
+
+    def prepare(self, session):
+        """Prepare the statements, must be called before flush()."""
+        self._counter_statement = session.prepare(COUNTER_QUERY)
+        self._span_statement = session.prepare(SPAN_QUERY)
+
+    def add(self, table_name, entry, size):
+        """
+        Count entry (a parsed JSON object) in table_name.
+
+        size is the size of its JSON in all the tables it was inserted into
+        (bucketed variants and derived tables included).
+        """
+        timestamp = entry.get('Timestamp')
+        if not isinstance(timestamp, Number) or isinstance(timestamp, bool):
+            return
+        day = monroe_buckets.bucket_start(timestamp, monroe_buckets.DAY)
+        node_id = str(entry.get('NodeId'))
+        iccid = entry.get('Iccid', entry.get('ICCID'))
+        key = (table_name, day, node_id, '' if iccid is None else str(iccid))
+        with self._lock:
+            count = self._counts.get(key)
+            if count is None:
+                self._counts[key] = [1, size, timestamp, timestamp]
+            else:
+                count[0] += 1
+                count[1] += size
+                count[2] = min(count[2], timestamp)
+                count[3] = max(count[3], timestamp)
+
+    def __len__(self):
+        return len(self._counts)
+
+    def flush(self, session):
+        """
+        Write the counts and spans and reset them.
+
+        Returns the number of (table, day, NodeId, Iccid) written.
+        """
+        from cassandra.query import BatchStatement, BatchType
+        with self._lock:
+            counts = self._counts
+            self._counts = {}
+        batch_id = uuid.uuid1()
+        batches = []
+        partitions = {}
+        futures = []
+        for (table_name, day, node_id, iccid), count in sorted(counts.items()):
+            (rows, size, min_timestamp, max_timestamp) = count
+            if partitions.get((table_name, day), BATCH_SIZE) >= BATCH_SIZE:
+                batches.append(BatchStatement(batch_type=BatchType.COUNTER))
+                partitions[(table_name, day)] = 0
+            batches[-1].add(self._counter_statement,
+                            (rows, size, table_name, day, node_id, iccid))
+            partitions[(table_name, day)] += 1
+            futures.append(session.execute_async(
+                self._span_statement,
+                (table_name,
+                 day,
+                 node_id,
+                 iccid,
+                 batch_id,
+                 _decimal(min_timestamp),
+                 _decimal(max_timestamp))))
+        for batch in batches:
+            futures.append(session.execute_async(batch))
+        for future in futures:
+            future.result()
+        return len(counts)
+
+
+def read_catalog(session, table_name, day):
+    """
+    Return {(NodeId, Iccid): (rows, bytes, min timestamp, max timestamp)}
+    of table_name for the day starting at day (see monroe_buckets).
+
+    session must return dicts (row_factory dict_factory).
+    """
+    catalog = {}
+    statement = session.prepare(SELECT_COUNTER_QUERY)
+    for row in session.execute(statement, (table_name, day)):
+        catalog[(row['nodeid'], row['iccid'])] = [row['rowcount'],
+                                                  row['bytes'],
+                                                  None,
+                                                  None]
+    statement = session.prepare(SELECT_SPAN_QUERY)
+    for row in session.execute(statement, (table_name, day)):
+        entry = catalog.get((row['nodeid'], row['iccid']))
+        if entry is None:
+            # Span written, counters not (yet)
+            continue
+        if entry[2] is None or row['mintimestamp'] < entry[2]:
+            entry[2] = row['mintimestamp']
+        if entry[3] is None or row['maxtimestamp'] > entry[3]:
+            entry[3] = row['maxtimestamp']
+    return dict((key, tuple(value)) for key, value in catalog.items())
+
+
+def active_partitions(session, table_name, start_time, end_time):
+    """
+    Yield (day, NodeId, Iccid) with data in table_name during
+    [start_time, end_time), day by day.
+    """
+    for day in monroe_buckets.bucket_range(start_time, end_time,
+                                           monroe_buckets.DAY):
+        catalog = read_catalog(session, table_name, day)
+        for (node_id, iccid), (rows, size, first, last) in sorted(
+                catalog.items()):
+            if first is not None and (last < start_time or
+                                      first >= end_time):
+                continue
+            yield (day, node_id, iccid)
@@ -27,30 +27,69 @@ import argparse
 import textwrap
 from multiprocessing.pool import ThreadPool
 from multiprocessing import cpu_count
-import fnmatch
 import monroevalidator
+import monroe_rollup
+import monroe_catalog
+import monroe_buckets
+import monroe_nmea
+import monroe_geo
+import monroe_archive
+import monroe_dedup
+import monroe_shard
+import monroe_log
+from monroe_log import log_msg
+import monroe_statements
+import monroe_retention
 import lzma
 import errno
 import syslog
 
-from cassandra.cluster import Cluster
-# from cassandra.query import Statement
-from cassandra.query import dict_factory
-from cassandra import ConsistencyLevel
-from cassandra import InvalidRequest
-from cassandra.auth import PlainTextAuthProvider
+# The cassandra driver (and monroe_bulk, which uses it) is imported when
+# needed, see connect() and bulk_export()
 
 CMD_NAME = os.path.basename(__file__)
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                           os.pardir,
+                           'db_schema.cql')
 DEBUG = False
 VERBOSITY = 1
+# Move partly failed files as-is with a sidecar of the failed records instead
+# of rewriting them (see write_sidecar)
+SIDECARS = False
+SIDECAR_EXTENSION = '.failed'
+# Failed records are counted per error class and DataId and logged once per
+# scan (log messages are written by a background thread, see monroe_log)
+ERRORS = monroe_log.ErrorAggregator()
+# None, 'dual' (insert into table and bucketed variants) or 'only' (insert
+# only into the bucketed variants of tables that have them)
+BUCKETED = None
+# data_id -> [(data_id of bucketed variant, bucket seconds)]
+BUCKETED_VARIANTS = {}
+# TTL per data_id of the inserts (a monroe_retention.RetentionPolicy) or None
+RETENTION = None
+# data_id -> [(data_id of derived table, function returning its entry or None)]
+DERIVED_TABLES = {
+    monroe_nmea.GPS_DATA_ID: [(monroe_nmea.RMC_DATA_ID, monroe_nmea.rmc_entry),
+                              (monroe_geo.GEO_DATA_ID, monroe_geo.geo_entry)],
+}
+
+
+class ValidationError(Exception):
+    """An entry rejected by monroevalidator."""
+
+
+def log_errors():
+    """Log the failed records counted in ERRORS since the last call."""
+    for log_str in ERRORS.flush():
+        log_msg(log_str, syslog.LOG_ERR, 0)
 
 
-def log_msg(log_str, syslog_level, verbosity_level):
-    """Handles syslog and console messages."""
-    if not DEBUG:
-        syslog.syslog(syslog_level, log_str)
-    if VERBOSITY > verbosity_level:
-        print (log_str)
+def count_error(error, j, nr, filename):
+    """Count the failed record nr (j) of filename in ERRORS."""
+    data_id = j.get('DataId') if isinstance(j, dict) else None
+    ERRORS.add(type(error).__name__,
+               data_id,
+               "{} record {}: {}".format(filename, nr, error))
 
 
 def parse_json(f, filename):
@@ -100,6 +139,22 @@ def parse_json(f, filename):
     return jsons
 
 
+def derived_entries(data_id, entry, tables):
+    """
+    Return [(data_id, entry)] to insert into the derived tables of entry.
+
+    Derived tables (see DERIVED_TABLES) are only written if they exist, ie
+    if their data_id is in tables (e.g. prepared_statements).
+    """
+    derived = []
+    for derived_id, derive in DERIVED_TABLES.get(data_id, []):
+        if derived_id in tables:
+            derived_entry = derive(entry)
+            if derived_entry is not None:
+                derived.append((derived_id, derived_entry))
+    return derived
+
+
 def construct_filepath(filename, dest_dir, middlefix="", extension=None):
     fname, fextension = os.path.splitext(filename)
     if (extension is None):
@@ -109,109 +164,349 @@ def construct_filepath(filename, dest_dir, middlefix="", extension=None):
     return os.path.join(dest_dir, os.path.basename(dest_name))
 
 
+def read_data(filename):
+    """
+    Read a .json or .xz file.
+
+    Returns its content (to hash and parse with parse_data), raises an
+    Exception if the file is empty or of unknown format.
+    """
+    # Sanity Check 1: Zero files size and existance check
+    if os.stat(filename).st_size == 0:
+        raise Exception("Zero file size")
+
+    fname, fextension = os.path.splitext(filename)
+    if not (fextension.endswith('.xz') or fextension.endswith('.json')):
+        raise Exception("Unknown fileformat {}".format(fextension))
+    # WORKAROUND to avoid CRASH in LZMAFile: read and decompress the bytes
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+def read_file(filename):
+    """
+    Read and parse a .json or .xz file.
+
+    Returns the list of JSON objects, raises an Exception if the file is
+    empty, of unknown format or can not be parsed.
+    """
+    return parse_data(read_data(filename), filename)
+
+
+def parse_data(data, filename):
+    """Parse the contents of a .json or .xz file (e.g. an archive member)."""
+    fname, fextension = os.path.splitext(filename)
+    if fextension.endswith('.xz'):
+        data = lzma.LZMADecompressor().decompress(data)
+    elif not fextension.endswith('.json'):
+        raise Exception("Unknown fileformat {}".format(fextension))
+    return parse_json(iter(data.splitlines()), filename)
+
+
+def find_files(in_dir, recursive):
+    """
+    Yield the paths of the .json and .xz files and archives in in_dir.
+
+    Only the first subdirectory is scanned if not recursive.
+    """
+    for root, dirs, files in os.walk(in_dir, topdown=True):
+        if not recursive and len(dirs) > 0:
+            dirs[:] = dirs[0]
+        for filename in files:
+            if (filename.endswith(('.json', '.xz')) or
+                    monroe_archive.is_archive(filename)):
+                yield os.path.join(root, filename)
+
+
+def expand_entries(data_id, entry, tables):
+    """
+    Return [(data_id, entry)] to insert for entry.
+
+    That is entry itself (unless BUCKETED is 'only' and its table has
+    bucketed variants), its derived entries and their bucketed variants.
+    tables holds the data_ids of the existing tables, see derived_entries.
+    """
+    expanded = []
+    entries = [(data_id, entry)]
+    entries.extend(derived_entries(data_id, entry, tables))
+    for entry_id, entry in entries:
+        variants = BUCKETED_VARIANTS.get(entry_id, [])
+        if BUCKETED != 'only' or len(variants) == 0:
+            expanded.append((entry_id, entry))
+        for variant_id, bucket_seconds in variants:
+            bucket = monroe_buckets.bucket_start(entry['Timestamp'],
+                                                 bucket_seconds)
+            expanded.append((variant_id, dict(entry, Bucket=bucket)))
+    return expanded
+
+
+def insert_entries(json_store,
+                   session,
+                   prepared_statements,
+                   rollups=None,
+                   indexes=None,
+                   filename=None,
+                   catalog=None):
+    """
+    Validate and insert the JSON objects in json_store.
+
+    Only the objects at indexes are inserted if given (see read_sidecar).
+    Inserted entries are added to rollups (a RollupAggregator) and catalog
+    (a CatalogAggregator) if given, entries not inserted at all (expired,
+    see RETENTION) are not.
+    Failed objects (of filename) are counted in ERRORS.
+    Entries with a TTL in RETENTION are inserted with the TTL left from
+    their Timestamp, or not at all if it has expired (and are then not
+    counted as inserted).
+    Returns (indices of the inserted objects, [(index, error)] of the rest).
+    """
+    failed_inserts = []
+    processed_inserts = []
+    if indexes is None:
+        indexes = range(len(json_store))
+    for nr in indexes:
+        j = None
+        try:
+            j = json_store[nr]
+            if not DEBUG:
+                data_id = j['DataId'].lower()
+                (data_ok, log_str) = monroevalidator.check(j, VERBOSITY)
+                if not data_ok:
+                    raise ValidationError("Validation error : {}".format(
+                        log_str))
+                size = 0
+                inserted = 0
+                for entry_id, entry in expand_entries(data_id,
+                                                      j,
+                                                      prepared_statements):
+                    data = json.dumps(entry)
+                    parameters = [data]
+                    ttl = RETENTION.ttl(entry_id) if RETENTION else None
+                    if ttl:
+                        ttl = monroe_retention.remaining_ttl(
+                            ttl, entry['Timestamp'])
+                        if ttl <= 0:
+                            # Expired already
+                            continue
+                    if ttl is not None:
+                        parameters.append(ttl)
+                    session.execute(prepared_statements[entry_id], parameters)
+                    size += len(data)
+                    inserted += 1
+                # Not if all the inserts were skipped as expired
+                if rollups is not None and inserted > 0:
+                    rollups.add(j)
+                if catalog is not None and inserted > 0:
+                    catalog.add(data_id.replace('.', '_'), j, size)
+            processed_inserts.append(nr)
+
+        except Exception as error:
+            failed_inserts.append((nr, str(error)))
+            count_error(error, j, nr, filename)
+    return (processed_inserts, failed_inserts)
+
+
+def write_sidecar(path, nr_records, failed_inserts):
+    """
+    Write the sidecar of a partly failed file to path.
+
+    The sidecar is a JSON object {"records": number of records in the file,
+    "failed": [[index, error], ...]}, written under another name first.
+    """
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'records': nr_records,
+                   'failed': [[nr, error] for nr, error in failed_inserts]},
+                  f)
+    os.rename(path + '.tmp', path)
+
+
+def parse_sidecar(data):
+    """Return the indexes of the failed records listed in sidecar data."""
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return [nr for nr, error in json.loads(data)['failed']]
+
+
+def read_sidecar(filename):
+    """
+    Return the indexes of the failed records of filename, listed in its
+    sidecar (filename + SIDECAR_EXTENSION), or None if it has none.
+    """
+    path = filename + SIDECAR_EXTENSION
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return parse_sidecar(f.read())
+
+
+def lost_shard(filename, in_dir, leases):
+    """Return True if the shard of filename is no longer held (leases)."""
+    if leases is None or leases.owns(filename, in_dir):
+        return False
+    log_str = "Lost the shard of {}, leaving it to its owner".format(filename)
+    log_msg(log_str, syslog.LOG_WARNING, 1)
+    return True
+
+
 def handle_file(filename,
                 failed_dir,
                 processed_dir,
                 session,
-                prepared_statements):
+                prepared_statements,
+                rollups=None,
+                dedup=None,
+                catalog=None,
+                leases=None,
+                in_dir=None):
     """
     Parse and insert file in db.
 
     Parse the file and tries to insert it into the database.
     move finished files to failed_dir and sucsseful to processed_dir.
+    Inserted entries are added to rollups (a RollupAggregator) and catalog
+    (a CatalogAggregator) if given, entries not inserted at all (expired,
+    see RETENTION) are not.
+    With dedup (a DedupIndex), the content of the file is hashed as it is
+    read; a file already imported is moved to processed_dir (with its
+    sidecar, if any) without being parsed, and a file imported without
+    failures is added to it.
+    If the file has a sidecar (see write_sidecar) only its failed records
+    are inserted. With SIDECARS, or for such a file, a partly failed file
+    is moved as-is to failed_dir with a new sidecar.
+    With leases (a ShardLeases), a file whose shard (in in_dir) is no longer
+    held is left to the instance holding it.
     """
+    if lost_shard(filename, in_dir, leases):
+        return {'inserts': 0, 'failed': 0}
     json_statements = []
     nr_jsons = 0
+    digest = None
+    sidecar_path = filename + SIDECAR_EXTENSION
+    indexes = None
     try:
-        # Sanity Check 1: Zero files size and existance check
-        if os.stat(filename).st_size == 0:
-            raise Exception("Zero file size")
-
-        json_store = []
-        # Read and parse file
-        fname, fextension = os.path.splitext(filename)
-        if fextension.endswith('.xz'):
-            # WORKAROUND to avoid CRASH in LZMAFile 
-	    with open(filename, 'rb') as f:
-		complete_file =  iter(lzma.LZMADecompressor().decompress(f.read()).splitlines())
-                json_store.extend(parse_json(complete_file, filename))
-        elif fextension.endswith('.json'):
-            with open(filename, 'r') as f:
-                json_store.extend(parse_json(f, filename))
+        # Read the file once, hash and parse its content
+        data = read_data(filename)
+        if dedup is not None:
+            digest = monroe_dedup.data_digest(data)
+        if digest is not None and digest in dedup:
+            json_store = None
         else:
-            raise Exception("Unknown fileformat {}".format(fextension))
-
-        nr_jsons = len(json_store)
-        dest_path = filename + ".wip"
-        if not DEBUG:
-            os.rename(filename, dest_path)
+            json_store = parse_data(data, filename)
+            indexes = read_sidecar(filename)
+            data = None
+
+            nr_jsons = len(json_store)
+            if lost_shard(filename, in_dir, leases):
+                return {'inserts': 0, 'failed': 0}
+            dest_path = filename + ".wip"
+            if not DEBUG:
+                os.rename(filename, dest_path)
 
-        filename = dest_path
+            filename = dest_path
     # Fail: We could not parse the file
     except Exception as error:
+        if not os.path.exists(filename):
+            # Moved meanwhile (e.g. by the instance that took over its shard)
+            log_str = "{} is gone ({}), skipping".format(filename, error)
+            log_msg(log_str, syslog.LOG_WARNING, 1)
+            return {'inserts': 0, 'failed': 0}
         dest_path = construct_filepath(filename, failed_dir, "_parse-error")
         log_str = "{} in file, moving {} to {}".format(error,
                                                        filename,
                                                        dest_path)
         log_msg(log_str, syslog.LOG_ERR, 1)
         if not DEBUG:
-            os.rename(filename, dest_path)
+            try:
+                os.rename(filename, dest_path)
+            except OSError as error:
+                if error.errno != errno.ENOENT:
+                    raise
+                log_str = "{} is gone, not moved".format(filename)
+                log_msg(log_str, syslog.LOG_WARNING, 1)
 
         return {'inserts': -1, 'failed': 0}
 
+    # Duplicate: the same content was already imported
+    if json_store is None:
+        dest_path = construct_filepath(filename, processed_dir)
+        log_str = ("Skipping file {} (already imported), "
+                   "moving to {}").format(filename, dest_path)
+        log_msg(log_str, syslog.LOG_INFO, 1)
+        if not DEBUG:
+            os.rename(filename, dest_path)
+            if os.path.exists(sidecar_path):
+                os.rename(sidecar_path, dest_path + SIDECAR_EXTENSION)
+        return {'inserts': 0, 'failed': 0, 'duplicates': 1}
+
     # Try to insert queries into db
     # This code assuems there is no breakage during the import
     # (ie the importer is not stopped while trying to do inserts)
     # If so happens there will be a .wip file left in the indir
     # and we are left in incosisten state that needs manual handling
-    failed_inserts = []
-    processed_inserts = []
-    for nr, j in enumerate(json_store):
-        try:
-            if not DEBUG:
-                data_id = j['DataId'].lower()
-                (data_ok, log_str) = monroevalidator.check(j, VERBOSITY)
-                if not data_ok:
-                    raise Exception("Validation error : {}".format(log_str))
-                session.execute(prepared_statements[data_id],
-                                [json.dumps(j)])
-            processed_inserts.append(nr)
-
-        except Exception as error:
-            failed_inserts.append((nr, str(error)))
+    (processed_inserts, failed_inserts) = insert_entries(json_store,
+                                                         session,
+                                                         prepared_statements,
+                                                         rollups,
+                                                         indexes,
+                                                         filename,
+                                                         catalog)
+    nr_records = nr_jsons if indexes is None else len(indexes)
 
     # If all is ok move file as-is to processed (low-cost)
     if len(failed_inserts) == 0:
+        if digest is not None and not DEBUG:
+            dedup.add(digest)
         dest_path = construct_filepath(filename,
                                        processed_dir,
                                        "",
                                        "")
         log_str = ("Succeded {} insert(s) (all) from file {} "
-                   "moving to {}").format(nr_jsons,
+                   "moving to {}").format(nr_records,
                                           filename,
                                           dest_path)
         log_msg(log_str, syslog.LOG_INFO, 1)
         if not DEBUG:
             os.rename(filename, dest_path)
+            if indexes is not None:
+                os.unlink(sidecar_path)
 
     # IF all is bad move file as-is to failed (low-cost)
-    elif len(failed_inserts) == nr_jsons:
+    elif indexes is None and len(failed_inserts) == nr_jsons:
         dest_path = construct_filepath(filename,
                                        failed_dir,
                                        "",
                                        "")
 
         log_str = ("Failed {} (all) insert(s) in file {} "
-                   "moving to {}; ").format(nr_jsons,
+                   "moving to {}").format(nr_jsons,
                                             filename,
                                             dest_path)
-        for nr, error in failed_inserts:
-            log_str += "{} Failed with {}, ".format(nr, error)
 
         log_msg(log_str, syslog.LOG_ERR, 1)
         if not DEBUG:
             os.rename(filename, dest_path)
 
+    # If some fail move file as-is to failed with the indexes of the failed
+    # records in its sidecar (low-cost)
+    elif SIDECARS or indexes is not None:
+        dest_path = construct_filepath(filename,
+                                       failed_dir,
+                                       "",
+                                       "")
+        log_str = ("Failed {} ({}) inserts in file {} "
+                   "moving to {} with sidecar").format(len(failed_inserts),
+                                                        nr_records,
+                                                        filename,
+                                                        dest_path)
+        log_msg(log_str, syslog.LOG_ERR, 1)
+        if not DEBUG:
+            write_sidecar(dest_path + SIDECAR_EXTENSION,
+                          nr_jsons,
+                          failed_inserts)
+            os.rename(filename, dest_path)
+            if indexes is not None:
+                os.unlink(sidecar_path)
+
     # If some fail and some succed write the ones that failed to failed dir
     # and rest to processed dir (high-cost)
     else:
@@ -225,12 +520,10 @@ def handle_file(filename,
                                                  "_processed-part",
                                                  ".json")
         log_str_error = ("Failed {} ({}) inserts in file {} "
-                         "saving in {};").format(len(failed_inserts),
+                         "saving in {}").format(len(failed_inserts),
                                                  nr_jsons,
                                                  filename,
                                                  dest_path_failed)
-        for nr, error in failed_inserts:
-            log_str_error += "{} Failed with {}, ".format(nr, error)
 
         log_str_processed = ("Succeded with {} ({}) insert(s) in file {} "
                              "saving in {}").format(len(processed_inserts),
@@ -255,14 +548,177 @@ def handle_file(filename,
     return {'inserts': len(processed_inserts), 'failed': len(failed_inserts)}
 
 
+def handle_archive(filename,
+                   failed_dir,
+                   processed_dir,
+                   session,
+                   prepared_statements,
+                   rollups=None,
+                   dedup=None,
+                   catalog=None,
+                   leases=None,
+                   in_dir=None):
+    """
+    Parse and insert the members of an archive (e.g. a .txz backup) in db.
+
+    The members are streamed from the archive and handled as files, the
+    members already recorded in its progress file are skipped (see
+    monroe_archive). Members that can not be parsed and the entries that
+    fail are written to failed_dir, the archive is moved to processed_dir
+    once all its members are handled (or to failed_dir if it can not be
+    read). Only the failed records of a member with a sidecar in the archive
+    (e.g. a backup of failed_dir) are inserted, as for files, and the member
+    is written back with a new sidecar if some fail again.
+    With dedup (a DedupIndex), members are deduplicated as files.
+    An archive whose shard is no longer held (leases) is skipped.
+    """
+    if lost_shard(filename, in_dir, leases):
+        return {'inserts': 0, 'failed': 0}
+    progress = monroe_archive.Progress(filename)
+    archive_name = os.path.basename(filename)
+    for archive_extension in monroe_archive.ARCHIVE_EXTENSIONS:
+        if archive_name.endswith(archive_extension):
+            archive_name = archive_name[:-len(archive_extension)]
+            break
+    nr_members = 0
+    nr_inserts = 0
+    nr_failed = 0
+    nr_duplicates = 0
+    try:
+        for name, data, sidecar in monroe_archive.iter_members_with_sidecars(
+                filename, SIDECAR_EXTENSION):
+            if progress.done(name):
+                continue
+            nr_members += 1
+            # Output files are named <archive>_<member path>
+            member_path = "{}_{}".format(archive_name,
+                                         name.strip('./').replace('/', '_'))
+            digest = None
+            if dedup is not None:
+                digest = monroe_dedup.data_digest(data)
+                if digest in dedup:
+                    log_str = "Skipping member {} of {} (already imported)".format(
+                        name, filename)
+                    log_msg(log_str, syslog.LOG_INFO, 2)
+                    nr_duplicates += 1
+                    if not DEBUG:
+                        progress.record(name, 0, 0)
+                    continue
+            try:
+                json_store = parse_data(data, name)
+                indexes = None
+                if sidecar is not None:
+                    indexes = parse_sidecar(sidecar)
+            except Exception as error:
+                dest_path = construct_filepath(member_path,
+                                               failed_dir,
+                                               "_parse-error")
+                log_str = "{} in member {} of {}, saving in {}".format(
+                    error, name, filename, dest_path)
+                log_msg(log_str, syslog.LOG_ERR, 1)
+                if not DEBUG:
+                    with open(dest_path, 'wb') as f:
+                        f.write(data)
+                    progress.record(name, -1, 0)
+                continue
+
+            (processed_inserts,
+             failed_inserts) = insert_entries(json_store,
+                                              session,
+                                              prepared_statements,
+                                              rollups,
+                                              indexes,
+                                              filename="{}:{}".format(filename,
+                                                                      name),
+                                              catalog=catalog)
+            nr_inserts += len(processed_inserts)
+            nr_failed += len(failed_inserts)
+            if len(failed_inserts) == 0 and digest is not None and not DEBUG:
+                dedup.add(digest)
+            if len(failed_inserts) > 0 and (SIDECARS or indexes is not None):
+                dest_path = construct_filepath(member_path, failed_dir)
+                log_str = ("Failed {} ({}) inserts in member {} of {} "
+                           "saving in {} with sidecar").format(
+                               len(failed_inserts),
+                               len(json_store),
+                               name,
+                               filename,
+                               dest_path)
+                log_msg(log_str, syslog.LOG_ERR, 1)
+                if not DEBUG:
+                    write_sidecar(dest_path + SIDECAR_EXTENSION,
+                                  len(json_store),
+                                  failed_inserts)
+                    with open(dest_path, 'wb') as f:
+                        f.write(data)
+            elif len(failed_inserts) > 0:
+                dest_path = construct_filepath(member_path,
+                                               failed_dir,
+                                               "_failed-part",
+                                               ".json")
+                log_str = ("Failed {} ({}) inserts in member {} of {} "
+                           "saving in {}").format(len(failed_inserts),
+                                                   len(json_store),
+                                                   name,
+                                                   filename,
+                                                   dest_path)
+                log_msg(log_str, syslog.LOG_ERR, 1)
+                if not DEBUG:
+                    with open(dest_path, 'w') as f:
+                        for nr, error in failed_inserts:
+                            f.write(json.dumps(json_store[nr]))
+                            f.write(os.linesep)
+            if not DEBUG:
+                progress.record(name, len(processed_inserts),
+                                len(failed_inserts))
+    # Fail: We could not read the archive (the progress is kept with it)
+    except Exception as error:
+        dest_path = os.path.join(failed_dir, "{}_parse-error{}".format(
+            archive_name, archive_extension))
+        log_str = ("{} in archive after {} member(s), moving {} "
+                   "to {}").format(error, nr_members, filename, dest_path)
+        log_msg(log_str, syslog.LOG_ERR, 1)
+        if not DEBUG:
+            progress.save()
+            os.rename(filename, dest_path)
+            os.rename(progress.path, dest_path + '.progress')
+        return {'inserts': -1, 'failed': nr_failed,
+                'duplicates': nr_duplicates}
+
+    dest_path = os.path.join(processed_dir, os.path.basename(filename))
+    log_str = ("Succeded {} insert(s), failed {} from {} member(s) "
+               "({} already imported) of archive {} "
+               "moving to {}").format(nr_inserts,
+                                      nr_failed,
+                                      nr_members,
+                                      nr_duplicates,
+                                      filename,
+                                      dest_path)
+    log_msg(log_str, syslog.LOG_INFO, 1)
+    if not DEBUG:
+        os.rename(filename, dest_path)
+        progress.remove()
+    return {'inserts': nr_inserts, 'failed': nr_failed,
+            'duplicates': nr_duplicates}
+
+
 def schedule_workers(in_dir,
                      failed_dir,
                      processed_dir,
                      concurrency,
                      session,
                      prepared_statements,
-                     recursive):
-    """Traverse the directory tree and kick off workers to handle the files."""
+                     recursive,
+                     rollups=None,
+                     dedup=None,
+                     leases=None,
+                     catalog=None):
+    """
+    Traverse the directory tree and kick off workers to handle the files.
+
+    With leases (a ShardLeases), only the files of the shards held for the
+    scan are handled.
+    """
     file_count = 0
     pool = ThreadPool(processes=concurrency)
     async_results = []
@@ -284,40 +740,101 @@ def schedule_workers(in_dir,
         if e.errno != errno.EEXIST:
             raise e
 
-    # Scan in_dir and look for all files ending in .json excluding
-    # processsed_dir and failed_dir to avoid insert "loops"
-    for root, dirs, files in os.walk(in_dir, topdown=True):
-        if not recursive and len(dirs) > 0:
-            dirs[:] = dirs[0]
-        for extension in ('*.json', '*.xz'):
-            for filename in fnmatch.filter(files, extension):
-                path = os.path.join(root, filename)
-                file_count += 1
-		log_msg("Start : {}".format(path), syslog.LOG_INFO, 1)
-                result = pool.apply_async(handle_file,
-                                          (path,
-                                           dest_dir_failed,
-                                           dest_dir_processed,
-                                           session,
-                                           prepared_statements,))
-                async_results.append(result)
+    if leases is not None:
+        shards = leases.claim()
+        log_str = "Handling shard(s) {} of {}".format(
+            ", ".join(str(shard) for shard in sorted(shards)), leases.shards)
+        log_msg(log_str, syslog.LOG_INFO, 1)
+
+    # Scan in_dir and look for all files ending in .json, .xz or an archive
+    # extension excluding processsed_dir and failed_dir to avoid insert "loops"
+    for path in find_files(in_dir, recursive):
+        if leases is not None and not leases.owns(path, in_dir):
+            continue
+        file_count += 1
+        log_msg("Start : {}".format(path), syslog.LOG_INFO, 1)
+        if monroe_archive.is_archive(path):
+            handler = handle_archive
+        else:
+            handler = handle_file
+        result = pool.apply_async(handler,
+                                  (path,
+                                   dest_dir_failed,
+                                   dest_dir_processed,
+                                   session,
+                                   prepared_statements,
+                                   rollups,
+                                   dedup,
+                                   catalog,
+                                   leases,
+                                   in_dir,))
+        async_results.append(result)
 
     pool.close()
     pool.join()
+    if leases is not None:
+        leases.release_takeovers()
+    log_errors()
 
-    results = None
-    try:
-        results = [async_result.get() for async_result in async_results]
-        # Parse errors generate inserts = -1, failed = 0
-    except Exception as error:
-        log_str = "Error in reading return values {}".format(error)
-        log_msg(log_str, syslog.LOG_ERR, 0)
+    # Drop the expired hashes once a day
+    if dedup is not None and not DEBUG:
+        try:
+            nr_expired = dedup.compact_if_due()
+            if nr_expired > 0:
+                log_str = "Expired {} hash(es) from {}".format(nr_expired,
+                                                              dedup.path)
+                log_msg(log_str, syslog.LOG_INFO, 1)
+        except Exception as error:
+            log_str = "Error in compacting {} {}".format(dedup.path, error)
+            log_msg(log_str, syslog.LOG_ERR, 0)
 
-    if results is None:
+    # Write the rollups of this scan, a failure here does not fail any file
+    if rollups is not None and not DEBUG and len(rollups) > 0:
+        try:
+            nr_rollups = rollups.flush(session)
+            log_str = "Wrote {} rollup row(s)".format(nr_rollups)
+            log_msg(log_str, syslog.LOG_INFO, 1)
+        except Exception as error:
+            log_str = "Error in writing rollups {}".format(error)
+            log_msg(log_str, syslog.LOG_ERR, 0)
+    # Merge the partial rollup rows of the finished hours
+    if rollups is not None and not DEBUG:
+        try:
+            nr_compacted = rollups.compact_if_due(session)
+            if nr_compacted > 0:
+                log_str = "Compacted {} rollup hour(s)".format(nr_compacted)
+                log_msg(log_str, syslog.LOG_INFO, 1)
+        except Exception as error:
+            log_str = "Error in compacting rollups {}".format(error)
+            log_msg(log_str, syslog.LOG_ERR, 0)
+
+    # Write the catalog counts of this scan, a failure here does not fail
+    # any file (the counts are lost)
+    if catalog is not None and not DEBUG and len(catalog) > 0:
+        try:
+            nr_catalog = catalog.flush(session)
+            log_str = "Wrote {} catalog entries".format(nr_catalog)
+            log_msg(log_str, syslog.LOG_INFO, 1)
+        except Exception as error:
+            log_str = "Error in writing catalog {}".format(error)
+            log_msg(log_str, syslog.LOG_ERR, 0)
+
+    # Parse errors generate inserts = -1, failed = 0; a worker that raised
+    # does not discard the results of the others
+    results = []
+    for async_result in async_results:
+        try:
+            results.append(async_result.get())
+        except Exception as error:
+            log_str = "Error in reading return values {}".format(error)
+            log_msg(log_str, syslog.LOG_ERR, 0)
+
+    if len(results) == 0:
         insert_count = 0
         failed_count = 0
         failed_parse_files_count = 0
         failed_insert_files_count = 0
+        duplicate_count = 0
     else:
         try:
             insert_count = sum([e['inserts'] for e in results if e['inserts'] > 0])
@@ -326,6 +843,7 @@ def schedule_workers(in_dir,
             failed_insert_files_count = len([e for e in results
                                             if (e['inserts'] >= 0 and
                                                 e['inserts'] < e['failed'])])
+            duplicate_count = sum([e.get('duplicates', 0) for e in results])
         except Exception as error:
             log_str = "Error in reading return values {}:".format(error)
             log_str += ",".join(results)
@@ -335,6 +853,7 @@ def schedule_workers(in_dir,
             failed_count = 0
             failed_parse_files_count = 0
             failed_insert_files_count = 0
+            duplicate_count = 0
 
     # Remove empty dirs
     try:
@@ -354,7 +873,8 @@ def schedule_workers(in_dir,
             insert_count,
             failed_count,
             failed_parse_files_count,
-            failed_insert_files_count)
+            failed_insert_files_count,
+            duplicate_count)
 
 
 def parse_files(session,
@@ -365,7 +885,11 @@ def parse_files(session,
                 processed_dir,
                 concurrency,
                 prepared_statements,
-                recursive):
+                recursive,
+                rollups=None,
+                dedup=None,
+                leases=None,
+                catalog=None):
     """Scan in_dir for files."""
     while True:
         start_time = time.time()
@@ -375,13 +899,18 @@ def parse_files(session,
          inserts,
          failed_inserts,
          parse_error_files,
-         insert_error_files) = schedule_workers(in_dir,
+         insert_error_files,
+         duplicate_files) = schedule_workers(in_dir,
                                                 failed_dir,
                                                 processed_dir,
                                                 concurrency,
                                                 session,
                                                 prepared_statements,
-                                                recursive)
+                                                recursive,
+                                                rollups,
+                                                dedup,
+                                                leases,
+                                                catalog)
 
         # Calculate time we should wait to satisfy the interval requirement
         elapsed = time.time() - start_time
@@ -398,6 +927,9 @@ def parse_files(session,
                                    parse_error_files,
                                    insert_error_files)
         log_str += " failed"
+        if duplicate_files > 0:
+            log_str += ("; skipped {} files/members already "
+                        "imported").format(duplicate_files)
         log_msg(log_str, syslog.LOG_INFO, 0)
 
         # If we have a "timer" set return if it is due
@@ -417,6 +949,110 @@ def parse_files(session,
             break
 
 
+def register_bucketed_variants(table_names):
+    """Set BUCKETED_VARIANTS to the bucketed variants in table_names."""
+    global BUCKETED_VARIANTS
+    if not BUCKETED:
+        return
+    variants = {}
+    for table_name in table_names:
+        split = monroe_buckets.split_table_name(table_name)
+        if split is not None:
+            (base_name, bucket_seconds) = split
+            base_id = base_name.replace('_', '.')
+            variants.setdefault(base_id, []).append(
+                (table_name.replace('_', '.'), bucket_seconds))
+    # Replaced at once, the workers may be reading it
+    BUCKETED_VARIANTS = variants
+
+
+def bulk_add(writer, table_names, json_store, filename):
+    """
+    Validate and add the JSON objects in json_store to writer.
+
+    Returns (added objects, failed objects).
+    """
+    entry_count = 0
+    failed_count = 0
+    for nr, j in enumerate(json_store):
+        try:
+            data_id = j['DataId'].lower()
+            (data_ok, log_str) = monroevalidator.check(j, VERBOSITY)
+            if not data_ok:
+                raise ValidationError("Validation error : {}".format(log_str))
+            for entry_id, entry in expand_entries(data_id, j, table_names):
+                writer.add(table_names[entry_id], entry)
+            entry_count += 1
+        except Exception as error:
+            failed_count += 1
+            count_error(error, j, nr, filename)
+    return (entry_count, failed_count)
+
+
+def bulk_export(in_dir, out_dir, schema_file, recursive, run_rows):
+    """
+    Write the entries of the files in in_dir for offline bulk loading.
+
+    The files (and archive members) are parsed, validated and expanded
+    (derived tables, bucketed variants) as for inserts, but not moved. The
+    tables are read from schema_file, see monroe_bulk for the output in
+    out_dir. Returns (files, entries, failed entries).
+    """
+    import monroe_bulk
+    tables = monroe_bulk.load_schema(schema_file)
+    register_bucketed_variants(tables.keys())
+    table_names = dict((name.replace('_', '.'), name) for name in tables)
+    writer = monroe_bulk.BulkWriter(out_dir, tables, run_rows)
+    file_count = 0
+    entry_count = 0
+    failed_count = 0
+    for path in find_files(in_dir, recursive):
+        if monroe_archive.is_archive(path):
+            members = monroe_archive.iter_members(path)
+        else:
+            members = [(path, None)]
+        try:
+            for name, data in members:
+                file_count += 1
+                try:
+                    if data is None:
+                        json_store = read_file(path)
+                    else:
+                        json_store = parse_data(data, name)
+                except Exception as error:
+                    log_str = "{} in file {}, skipping".format(error, name)
+                    log_msg(log_str, syslog.LOG_ERR, 1)
+                    continue
+                (added, failed) = bulk_add(writer,
+                                           table_names,
+                                           json_store,
+                                           name)
+                entry_count += added
+                failed_count += failed
+        except Exception as error:
+            log_str = "{} in archive {}, skipping the rest".format(error,
+                                                                   path)
+            log_msg(log_str, syslog.LOG_ERR, 1)
+
+    for table_name, count in sorted(writer.close().items()):
+        log_str = "Wrote {} row(s) of {}".format(count, table_name)
+        log_msg(log_str, syslog.LOG_INFO, 0)
+    log_errors()
+    return (file_count, entry_count, failed_count)
+
+
+def connect(hosts, keyspace, db_user, db_password):
+    """Connect to the keyspace, return (cluster, session)."""
+    from cassandra.cluster import Cluster
+    from cassandra.query import dict_factory
+    from cassandra.auth import PlainTextAuthProvider
+    auth = PlainTextAuthProvider(username=db_user, password=db_password)
+    cluster = Cluster(hosts, auth_provider=auth, protocol_version=4)
+    session = cluster.connect(keyspace)
+    session.row_factory = dict_factory
+    return (cluster, session)
+
+
 def create_arg_parser():
     """Create a argument parser and return it."""
     max_concurrency = cpu_count()
@@ -424,7 +1060,8 @@ def create_arg_parser():
         prog=CMD_NAME,
         formatter_class=argparse.RawDescriptionHelpFormatter,
         description=textwrap.dedent('''
-            Parses .json or (.xz) files in in_dir and inserts them into the
+            Parses .json or (.xz) files and (.txz, .tar.*) archives of them
+            in in_dir and inserts them into the
             Cassandra Cluster specified in -H/--hosts.
             All directories not existing will be created.'''))
     parser.add_argument('-u', '--user',
@@ -436,8 +1073,7 @@ def create_arg_parser():
                         default=["127.0.0.1"],
                         help="Hosts in the cluster (default 127.0.0.1)")
     parser.add_argument('-k', '--keyspace',
-                        required=True,
-                        help="Keyspace to use")
+                        help="Keyspace to use (required unless --bulk-dir)")
     parser.add_argument('-i', '--interval',
                         metavar='N',
                         type=int,
@@ -461,6 +1097,12 @@ def create_arg_parser():
                         type=int,
                         choices=range(0, 3),
                         help="Verbosity level 0-2(default 1)")
+    parser.add_argument('--log-rate',
+                        metavar='N',
+                        type=int,
+                        default=100,
+                        help=("Log messages per second, the rest are "
+                              "counted as suppressed (default 100)"))
     parser.add_argument('-I', '--indir',
                         metavar='DIR',
                         default="/experiments/monroe",
@@ -479,6 +1121,83 @@ def create_arg_parser():
     parser.add_argument('-r', '--recursive',
                         action="store_true",
                         help="recurse into subdirectries")
+    parser.add_argument('--rollups',
+                        action="store_true",
+                        help=("Maintain the hourly rollup table "
+                              "monroe_rollup_hourly"))
+    parser.add_argument('--compact-rollups',
+                        action="store_true",
+                        help=("With --rollups, also compact the rollup "
+                              "partitions written before this run (reads "
+                              "the partition keys of the table at start)"))
+    parser.add_argument('--catalog',
+                        action="store_true",
+                        help=("Maintain the data availability catalog "
+                              "monroe_catalog/monroe_catalog_span"))
+    parser.add_argument('--bucketed',
+                        choices=['dual', 'only'],
+                        help=("Insert into the _by_day/_by_week variants of "
+                              "the tables, in addition to (dual) or instead "
+                              "of (only) the tables"))
+    parser.add_argument('--ttl-policy',
+                        metavar='FILE',
+                        help=("Insert with the TTL of the DataIds in FILE, "
+                              "JSON {DataId or pattern: seconds}, counted "
+                              "from the Timestamp (see monroe_retention.py)"))
+    parser.add_argument('--sidecars',
+                        action="store_true",
+                        help=("Move partly failed files as-is to the failed "
+                              "dir with a .failed sidecar listing the failed "
+                              "records, instead of rewriting them"))
+    parser.add_argument('--dedup-index',
+                        metavar='FILE',
+                        help=("Skip the files (and archive members) whose "
+                              "content was already imported, as recorded "
+                              "in FILE"))
+    parser.add_argument('--dedup-retention',
+                        metavar='DAYS',
+                        type=int,
+                        default=30,
+                        help=("Days a content hash is kept in "
+                              "--dedup-index (default 30)"))
+    parser.add_argument('--shard',
+                        metavar='K',
+                        type=int,
+                        default=0,
+                        help=("Shard handled by this instance, 0 to "
+                              "--shards - 1 (default 0)"))
+    parser.add_argument('--shards',
+                        metavar='N',
+                        type=int,
+                        default=1,
+                        help=("Number of importer instances sharing --indir "
+                              "(default 1, requires --lease-dir if > 1)"))
+    parser.add_argument('--lease-dir',
+                        metavar='DIR',
+                        help=("Shard leases, shared by all instances "
+                              "(e.g. /experiments/leases)"))
+    parser.add_argument('--lease-timeout',
+                        metavar='N',
+                        type=int,
+                        default=300,
+                        help=("Seconds after which the shards of a dead "
+                              "instance are taken over (default 300)"))
+    parser.add_argument('--bulk-dir',
+                        metavar='DIR',
+                        help=("Do not insert, write the entries sorted per "
+                              "table and partition to DIR for offline bulk "
+                              "loading (files are not moved)"))
+    parser.add_argument('--bulk-run-rows',
+                        metavar='N',
+                        type=int,
+                        default=500000,
+                        help=("Rows sorted in memory by --bulk-dir "
+                              "(default 500000)"))
+    parser.add_argument('--schema',
+                        metavar='FILE',
+                        default=SCHEMA_FILE,
+                        help=("Table definitions for --bulk-dir (default "
+                              "db_schema.cql)"))
     parser.add_argument('--debug',
                         action="store_true",
                         help="Do not execute queries or move files")
@@ -498,11 +1217,15 @@ def parse_special_args(args, parser):
     db_password = None
     failed_dir = None
     processed_dir = None
-    if not args.authenv and not (args.user and args.password):
+    # The offline bulk output (--bulk-dir) needs no database
+    if not args.bulk_dir and not args.keyspace:
+        parser.error('-k/--keyspace is required')
+    if (not args.bulk_dir and
+            not args.authenv and not (args.user and args.password)):
         parser.error('either --authenv or -u/--user USER and -p/--password '
                      'PASSWORD needs to be defined')
 
-    if args.authenv:
+    if args.authenv and not args.bulk_dir:
         if 'MONROE_DB_USER' not in os.environ:
             parser.error("missing user env MONROE_DB_USER")
         if 'MONROE_DB_PASSWD' not in os.environ:
@@ -510,6 +1233,11 @@ def parse_special_args(args, parser):
         db_user = os.environ['MONROE_DB_USER']
         db_password = os.environ['MONROE_DB_PASSWD']
 
+    if args.shards > 1 and not args.lease_dir:
+        parser.error('--shards requires --lease-dir')
+    if not 0 <= args.shard < args.shards:
+        parser.error('--shard must be between 0 and --shards - 1')
+
     # Specified user and password takes precedence over environment variables
     if args.user:
         db_user = args.user
@@ -537,8 +1265,16 @@ if __name__ == '__main__':
      failed_dir,
      processed_dir,
      shutoff_time) = parse_special_args( args, parser)
-    DEBUG = args.debug
-    VERBOSITY = args.verbosity
+    DEBUG = monroe_log.DEBUG = args.debug
+    VERBOSITY = monroe_log.VERBOSITY = args.verbosity
+    BUCKETED = args.bucketed
+    if args.ttl_policy:
+        try:
+            RETENTION = monroe_retention.load_policy(args.ttl_policy)
+        except (IOError, ValueError) as error:
+            parser.error("--ttl-policy: {}".format(error))
+    SIDECARS = args.sidecars
+    monroe_log.LOGGER.rate = args.log_rate
 
     if (failed_dir.startswith(os.path.realpath(args.indir)+'/') or
             processed_dir.startswith(os.path.realpath(args.indir)+'/')):
@@ -548,21 +1284,63 @@ if __name__ == '__main__':
         log_msg(log_str, syslog.LOG_ERR, 0)
         raise SystemExit(1)
 
+    if args.bulk_dir:
+        (files, entries, failed) = bulk_export(args.indir,
+                                               args.bulk_dir,
+                                               args.schema,
+                                               args.recursive,
+                                               args.bulk_run_rows)
+        log_str = ("Wrote {} entries from {} files to {}, "
+                   "{} entries failed").format(entries,
+                                               files,
+                                               args.bulk_dir,
+                                               failed)
+        log_msg(log_str, syslog.LOG_INFO, 0)
+        raise SystemExit(0)
+
     # Assuming default port: 9042, clusters and sessions are longlived and
     # should be reused
     session = None
     cluster = None
     prepared_statements = {}
+    rollups = monroe_rollup.RollupAggregator() if args.rollups else None
+    catalog = monroe_catalog.CatalogAggregator() if args.catalog else None
+    dedup = None
+    if args.dedup_index:
+        dedup = monroe_dedup.DedupIndex(args.dedup_index,
+                                        args.dedup_retention)
+        log_str = "Loaded {} hash(es) from {}".format(len(dedup),
+                                                     args.dedup_index)
+        log_msg(log_str, syslog.LOG_INFO, 1)
+    leases = None
+    if args.shards > 1:
+        leases = monroe_shard.ShardLeases(
+            args.lease_dir,
+            args.shard,
+            args.shards,
+            args.lease_timeout,
+            lambda log_str, is_error: log_msg(
+                log_str, syslog.LOG_ERR if is_error else syslog.LOG_INFO, 0))
+        leases.start()
+
     if not DEBUG:
-        auth = PlainTextAuthProvider(username=db_user, password=db_password)
-        cluster = Cluster(args.hosts, auth_provider=auth, protocol_version=4)
-        session = cluster.connect(args.keyspace)
-        session.row_factory = dict_factory
-        table_names = list(cluster.metadata.keyspaces[args.keyspace].tables.keys())
-        for table_name in table_names:
-            query = 'INSERT INTO {} JSON ?'.format(table_name)
-            data_id = table_name.replace('_', '.')
-            prepared_statements[data_id] = session.prepare(query)
+        (cluster, session) = connect(args.hosts,
+                                     args.keyspace,
+                                     db_user,
+                                     db_password)
+        # Statements are prepared on first use, the tables (and bucketed
+        # variants) follow the schema changes
+        prepared_statements = monroe_statements.StatementRegistry(
+            session,
+            args.keyspace,
+            on_tables=register_bucketed_variants,
+            ttl_policy=RETENTION)
+        if rollups is not None:
+            rollups.prepare(session)
+            if args.compact_rollups:
+                rollups.track(monroe_rollup.all_partitions(session))
+        if catalog is not None:
+            catalog.prepare(session)
     else:
         date_shutoff = (datetime.
                         fromtimestamp(shutoff_time).
@@ -595,7 +1373,16 @@ if __name__ == '__main__':
                 processed_dir,
                 args.concurrency,
                 prepared_statements,
-                args.recursive)
-
+                args.recursive,
+                rollups,
+                dedup,
+                leases,
+                catalog)
+
+    if leases is not None:
+        leases.close()
+    if dedup is not None:
+        dedup.close()
     if not DEBUG:
         cluster.shutdown()
+    monroe_log.LOGGER.close()
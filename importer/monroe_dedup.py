@@ -0,0 +1,101 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Index of the content hashes of the files already imported.
+
+Nodes may upload the same file twice (retries, resynced directories). With
+--dedup-index the importer hashes the content of every file (and archive
+member) as it is read, before parsing it; a file whose SHA-256 is in the index was already fully imported
+and is moved to the processed dir without being parsed or inserted. Only
+files imported without any failed entry are added.
+
+The index is a text file of "<sha256> <epoch>" lines, appended to (and
+flushed) as files are imported. Hashes older than the retention window are
+dropped when the index is loaded and by compact(), which rewrites the file.
+"""
+from threading import Lock
+import hashlib
+import os
+import time
+
+
+def data_digest(data):
+    """Return the SHA-256 (hex) of data (a file or archive member)."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class DedupIndex(object):
+    """
+    Content hashes imported during the last retention_days, kept in path.
+
+    Thread safe, the importer workers share one index.
+    """
+
+    def __init__(self, path, retention_days=30):
+        self.path = path
+        self.retention = retention_days * 24 * 3600
+        self._lock = Lock()
+        self._digests = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        digest, added = line.split()
+                        self._digests[digest] = float(added)
+                    except ValueError:
+                        # Last line cut by a crash
+                        continue
+        self._f = None
+        self._compacted = 0
+        self.compact()
+
+    def __len__(self):
+        return len(self._digests)
+
+    def __contains__(self, digest):
+        with self._lock:
+            added = self._digests.get(digest)
+        return added is not None and added > time.time() - self.retention
+
+    def add(self, digest):
+        """Add digest (of a file fully imported) to the index."""
+        now = time.time()
+        with self._lock:
+            self._digests[digest] = now
+            self._f.write("{} {:.0f}\n".format(digest, now))
+            self._f.flush()
+
+    def compact(self):
+        """Drop the expired hashes and rewrite the file, return how many."""
+        with self._lock:
+            expiry = time.time() - self.retention
+            expired = [digest for digest, added in self._digests.items()
+                       if added <= expiry]
+            for digest in expired:
+                del self._digests[digest]
+            if self._f is not None:
+                self._f.close()
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                for digest, added in self._digests.items():
+                    f.write("{} {:.0f}\n".format(digest, added))
+            os.rename(tmp_path, self.path)
+            self._f = open(self.path, 'a')
+            self._compacted = time.time()
+        return len(expired)
+
+    def compact_if_due(self, interval=24 * 3600):
+        """Compact if the last compaction is older than interval seconds."""
+        if time.time() - self._compacted < interval:
+            return 0
+        return self.compact()
+
+    def close(self):
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Geohash index of the GPS positions maintained by monroe_dbimporter.
+
+If the keyspace has the table monroe_meta_device_gps_geo (see db_schema.cql)
+the importer also inserts every GPRMC position into it, partitioned by the
+geohash cell (PRECISION characters) and day of the position, so positions in
+an area can be found without reading the GPS data of every node.
+Readers cover their bounding box with cells (see examples/GeoQuery.py).
+"""
+from numbers import Number
+
+import monroe_buckets
+import monroe_nmea
+
+GEO_DATA_ID = 'monroe.meta.device.gps.geo'
+PRECISION = 5  # ~4.9 x 4.9 km cells
+BUCKET_SECONDS = monroe_buckets.DAY
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_KEYS = ('NodeId', 'Timestamp', 'SequenceNumber', 'Latitude', 'Longitude',
+         'Altitude', 'Speed', 'SatelliteCount')
+
+
+def encode(latitude, longitude, precision=PRECISION):
+    """Return the geohash of (latitude, longitude) with precision chars."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    nr_bits = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            (value, interval) = (longitude, lon_range)
+        else:
+            (value, interval) = (latitude, lat_range)
+        middle = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        nr_bits += 1
+        if nr_bits == 5:
+            chars.append(_BASE32[bits])
+            bits = 0
+            nr_bits = 0
+    return ''.join(chars)
+
+
+def _is_number(value):
+    return isinstance(value, Number) and not isinstance(value, bool)
+
+
+def geo_entry(entry):
+    """
+    Return the entry for monroe_meta_device_gps_geo or None.
+
+    entry is a GPS entry (a parsed JSON object), None is returned if it is not
+    a GPRMC position or has no valid coordinates.
+    """
+    if monroe_nmea.rmc_entry(entry) is None:
+        return None
+    latitude = entry.get('Latitude')
+    longitude = entry.get('Longitude')
+    timestamp = entry.get('Timestamp')
+    if not (_is_number(latitude) and _is_number(longitude) and
+            _is_number(timestamp)):
+        return None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    geo = dict((key, entry[key]) for key in _KEYS if key in entry)
+    geo['Geohash'] = encode(latitude, longitude)
+    geo['Bucket'] = monroe_buckets.bucket_start(timestamp, BUCKET_SECONDS)
+    return geo
@@ -0,0 +1,165 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Logging of monroe_dbimporter off the worker threads.
+
+LogWriter queues the messages and writes them to syslog (and stdout) from a
+background thread, at most rate messages per second on average (bursts of
+up to burst messages). Messages over the rate, or that do not fit in the
+queue, are dropped and counted in a "suppressed" message.
+
+ErrorAggregator counts the failed records per error class and DataId, with
+a few sample messages, so a scan logs one line per kind of error instead of
+one per record.
+
+log_msg is the log function of the importer and its modules (e.g.
+monroevalidator), configured by DEBUG and VERBOSITY.
+"""
+from threading import Lock, Thread
+import atexit
+import syslog
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+DEBUG = False
+VERBOSITY = 1
+
+
+class LogWriter(object):
+    """Queue of log messages written by a background thread."""
+
+    def __init__(self, rate=100, burst=1000, queue_size=10000):
+        self.rate = rate
+        self.burst = burst
+        self._queue = queue.Queue(queue_size)
+        self._lock = Lock()
+        self._thread = None
+        self._tokens = burst
+        self._refilled = time.time()
+        self._suppressed = 0
+        self._dropped = 0
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+                # Write what is queued when the importer exits
+                atexit.register(self.close)
+
+    def log(self, syslog_level, log_str, to_syslog=True, to_stdout=False):
+        """Queue a message, never blocks."""
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait((syslog_level, log_str, to_syslog,
+                                    to_stdout))
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+
+    def _allow(self):
+        now = time.time()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def _write(self, syslog_level, log_str, to_syslog, to_stdout):
+        if to_syslog:
+            syslog.syslog(syslog_level, log_str)
+        if to_stdout:
+            print (log_str)
+
+    def _write_suppressed(self):
+        with self._lock:
+            suppressed = self._suppressed + self._dropped
+            self._suppressed = 0
+            self._dropped = 0
+        if suppressed > 0:
+            self._write(syslog.LOG_WARNING,
+                        "Suppressed {} log message(s)".format(suppressed),
+                        True, True)
+
+    def _run(self):
+        while True:
+            message = self._queue.get()
+            if message is None:
+                self._write_suppressed()
+                self._queue.task_done()
+                break
+            if self._allow():
+                self._write_suppressed()
+                self._write(*message)
+            else:
+                with self._lock:
+                    self._suppressed += 1
+            self._queue.task_done()
+
+    def close(self):
+        """Write the queued messages and stop the thread."""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+
+class ErrorAggregator(object):
+    """Counts of failed records per (error class, DataId), thread safe."""
+
+    def __init__(self, samples=3):
+        self.samples = samples
+        self._lock = Lock()
+        self._errors = {}
+
+    def add(self, error_class, data_id, sample):
+        with self._lock:
+            error = self._errors.get((error_class, data_id))
+            if error is None:
+                error = self._errors[(error_class, data_id)] = [0, []]
+            error[0] += 1
+            if len(error[1]) < self.samples:
+                error[1].append(sample)
+
+    def __len__(self):
+        return len(self._errors)
+
+    def flush(self):
+        """Return one line per (error class, DataId) and reset the counts."""
+        with self._lock:
+            errors = self._errors
+            self._errors = {}
+        lines = []
+        for (error_class, data_id), (count, samples) in sorted(
+                errors.items(), key=lambda item: -item[1][0]):
+            lines.append("{} record(s) failed with {} for DataId {}, "
+                         "e.g. {}".format(count,
+                                          error_class,
+                                          data_id,
+                                          "; ".join(samples)))
+        return lines
+
+
+LOGGER = LogWriter()
+
+
+def log_msg(log_str, syslog_level, verbosity_level):
+    """Handles syslog and console messages (queued on LOGGER)."""
+    LOGGER.log(syslog_level,
+               log_str,
+               not DEBUG,
+               VERBOSITY > verbosity_level)
@@ -0,0 +1,42 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+GPRMC-only copy of the GPS table maintained by monroe_dbimporter.
+
+Readers of monroe_meta_device_gps usually only want the GPRMC positions and
+had to fetch the (large) Nmea text of every row to select them client side.
+If the keyspace has the table monroe_meta_device_gps_rmc (see db_schema.cql)
+the importer also inserts every GPS entry whose NMEA contains a GPRMC
+sentence into it, without the Nmea column, so readers can select the
+positions server side.
+"""
+
+GPS_DATA_ID = 'monroe.meta.device.gps'
+RMC_DATA_ID = 'monroe.meta.device.gps.rmc'
+RMC_SENTENCE = 'GPRMC'
+
+
+def sentence_types(nmea):
+    """Return the sentence types (e.g. GPRMC) of the sentences in nmea."""
+    types = []
+    for sentence in nmea.split('$')[1:]:
+        types.append(sentence.split(',', 1)[0].strip())
+    return types
+
+
+def rmc_entry(entry):
+    """
+    Return the entry for monroe_meta_device_gps_rmc or None.
+
+    entry is a GPS entry (a parsed JSON object), None is returned if its
+    Nmea has no GPRMC sentence.
+    """
+    nmea = entry.get('Nmea')
+    if not nmea or RMC_SENTENCE not in sentence_types(nmea):
+        return None
+    return dict((key, value) for key, value in entry.items()
+                if key != 'Nmea')
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Per-DataId retention (TTL) of the entries inserted by monroe_dbimporter.
+
+The policy is a JSON object mapping DataIds (lowercase, e.g.
+monroe.meta.node.sensor) or fnmatch patterns (monroe.exp.tstat.*) to a TTL
+in seconds:
+  {"monroe.meta.node.sensor": 7776000, "monroe.exp.tstat.*": 15552000}
+The bucketed variants of a table (see monroe_buckets) follow the policy of
+the table unless listed themselves. A TTL of 0 keeps the entries forever,
+even if the table has a default_time_to_live (see db_schema_retention.cql);
+the entries of DataIds not in the policy get the default of their table.
+
+The inserts of the DataIds in the policy use "USING TTL ?" with the TTL
+counted from the Timestamp of the entry rather than from the import, so
+late or backfilled entries expire with the rest of their time window (see
+remaining_ttl).
+"""
+from fnmatch import fnmatchcase
+import json
+import time
+
+import monroe_buckets
+
+# Largest TTL accepted by Cassandra (20 years)
+MAX_TTL = 20 * 365 * 24 * 60 * 60
+
+
+class RetentionPolicy(object):
+    """TTL per DataId, see the module docstring."""
+
+    def __init__(self, ttls):
+        self._ttls = {}
+        self._patterns = []
+        for key, ttl in ttls.items():
+            if (not isinstance(ttl, int) or isinstance(ttl, bool) or
+                    not 0 <= ttl <= MAX_TTL):
+                raise ValueError("TTL of {} must be 0 to {} seconds, "
+                                 "not {!r}".format(key, MAX_TTL, ttl))
+            if any(char in key for char in '*?['):
+                self._patterns.append((key.lower(), ttl))
+            else:
+                self._ttls[key.lower()] = ttl
+        # The most specific (longest) pattern first
+        self._patterns.sort(key=lambda pattern: -len(pattern[0]))
+        self._cache = {}
+
+    def _lookup(self, data_id):
+        if data_id in self._ttls:
+            return self._ttls[data_id]
+        for pattern, ttl in self._patterns:
+            if fnmatchcase(data_id, pattern):
+                return ttl
+        return None
+
+    def ttl(self, data_id):
+        """Return the TTL (seconds) of data_id, None if not in the policy."""
+        try:
+            return self._cache[data_id]
+        except KeyError:
+            pass
+        ttl = self._lookup(data_id)
+        if ttl is None:
+            split = monroe_buckets.split_table_name(data_id.replace('.', '_'))
+            if split is not None:
+                ttl = self._lookup(split[0].replace('_', '.'))
+        self._cache[data_id] = ttl
+        return ttl
+
+    def __len__(self):
+        return len(self._ttls) + len(self._patterns)
+
+
+def load_policy(path):
+    """Return the RetentionPolicy in the JSON file path."""
+    with open(path, 'r') as f:
+        ttls = json.load(f)
+    if not isinstance(ttls, dict):
+        raise ValueError("{} is not a JSON object".format(path))
+    return RetentionPolicy(ttls)
+
+
+def remaining_ttl(ttl, timestamp, now=None):
+    """
+    Return the TTL of an entry of Timestamp timestamp, counted from it.
+
+    At most ttl (entries from the future), 0 or less if already expired.
+    """
+    if now is None:
+        now = time.time()
+    return int(min(ttl, ttl - (now - float(timestamp))))
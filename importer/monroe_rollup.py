@@ -0,0 +1,415 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Hourly rollups maintained by monroe_dbimporter alongside the raw inserts.
+
+For each (NodeId, Iccid, hour, metric) the importer aggregates the values of
+the imported entries (count, sum, min, max and a mergeable log-bucketed
+histogram for percentiles) and writes them to monroe_rollup_hourly (see
+db_schema.cql) once per scan. The partitions hold one week of hours
+(Bucket, see monroe_buckets). Every scan writes its own partial row
+(BatchId), so no read-before-write is needed; readers merge the partial rows
+of an hour with merge_rows() or read_rollups().
+
+The partial rows of the finished hours (ended FINISHED_AFTER seconds ago)
+of the partitions written by the importer are merged into one row per hour
+and metric by compact_partition(), see RollupAggregator.compact_if_due().
+
+Limitation: a partial row is not tied to the file its values come from, so
+entries inserted twice are counted twice. Failed records re-imported from
+the failed dir or a sidecar are not affected, as only the inserted entries
+are counted. But re-importing a processed file, or a file uploaded twice
+without --dedup-index, adds its values to the rollups again.
+
+Which fields are rolled up is defined in ROLLUPS, keyed by DataId.
+"""
+from math import ceil, log
+from numbers import Number
+from threading import Lock
+import struct
+import time
+import uuid
+
+import monroe_buckets
+
+# DataId -> list of (metric name, entry key)
+ROLLUPS = {
+    'MONROE.EXP.PING': [('ping.rtt', 'Rtt')],
+    'MONROE.META.DEVICE.MODEM': [('modem.rsrp', 'Rsrp'),
+                                 ('modem.rsrq', 'Rsrq'),
+                                 ('modem.rssi', 'Rssi')],
+    'MONROE.EXP.HTTP.DOWNLOAD': [('http_download.speed', 'Speed')],
+}
+
+BUCKET_SECONDS = 3600
+# Hours of a partition (the Bucket of its partition key)
+PARTITION_SECONDS = monroe_buckets.WEEK
+# Hours ended this long ago are finished: their partial rows are compacted
+FINISHED_AFTER = 24 * 3600
+
+INSERT_QUERY = ("INSERT INTO monroe_rollup_hourly "
+                "(NodeId, Iccid, Bucket, Hour, Metric, BatchId, Operator, "
+                "ValueCount, ValueSum, ValueMin, ValueMax, Sketch) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+
+SELECT_QUERY = ("SELECT Hour, Metric, BatchId, Operator, "
+                "ValueCount, ValueSum, ValueMin, ValueMax, Sketch "
+                "FROM monroe_rollup_hourly "
+                "WHERE NodeId = ? AND Iccid = ? AND Bucket = ? "
+                "AND Hour >= ? AND Hour < ?")
+
+DELETE_QUERY = ("DELETE FROM monroe_rollup_hourly "
+                "WHERE NodeId = ? AND Iccid = ? AND Bucket = ? "
+                "AND Hour = ? AND Metric = ? AND BatchId = ?")
+
+PARTITIONS_QUERY = ("SELECT DISTINCT NodeId, Iccid, Bucket "
+                    "FROM monroe_rollup_hourly")
+
+
+class Sketch(object):
+    """
+    Mergeable histogram with logarithmic buckets.
+
+    Quantiles are returned with a relative error of at most alpha. Negative
+    values (e.g. RSRP/RSSI in dBm) are kept in their own buckets.
+    """
+
+    _HEADER = struct.Struct('<BdIII')
+    _BUCKET = struct.Struct('<iI')
+    _VERSION = 1
+
+    def __init__(self, alpha=0.01):
+        self.alpha = alpha
+        self._gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = log(self._gamma)
+        self.zeros = 0
+        self.positive = {}
+        self.negative = {}
+
+    def _index(self, value):
+        return int(ceil(log(value) / self._log_gamma))
+
+    def _value(self, index):
+        return 2 * self._gamma ** index / (self._gamma + 1)
+
+    def add(self, value):
+        if value > 0:
+            index = self._index(value)
+            self.positive[index] = self.positive.get(index, 0) + 1
+        elif value < 0:
+            index = self._index(-value)
+            self.negative[index] = self.negative.get(index, 0) + 1
+        else:
+            self.zeros += 1
+
+    def merge(self, other):
+        """Add the counts of other (built with the same alpha) to self."""
+        self.zeros += other.zeros
+        for index, count in other.positive.items():
+            self.positive[index] = self.positive.get(index, 0) + count
+        for index, count in other.negative.items():
+            self.negative[index] = self.negative.get(index, 0) + count
+
+    def count(self):
+        return (self.zeros +
+                sum(self.positive.values()) +
+                sum(self.negative.values()))
+
+    def quantile(self, q):
+        """Return the approximate q-quantile (0 <= q <= 1) or None if empty."""
+        total = self.count()
+        if total == 0:
+            return None
+        rank = q * (total - 1)
+        seen = 0
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return -self._value(index)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return self._value(index)
+        return self._value(max(self.positive))
+
+    def to_bytes(self):
+        parts = [self._HEADER.pack(self._VERSION,
+                                   self.alpha,
+                                   self.zeros,
+                                   len(self.positive),
+                                   len(self.negative))]
+        for buckets in (self.positive, self.negative):
+            for index in sorted(buckets):
+                parts.append(self._BUCKET.pack(index, buckets[index]))
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        (version,
+         alpha,
+         zeros,
+         nr_positive,
+         nr_negative) = cls._HEADER.unpack_from(data, 0)
+        if version != cls._VERSION:
+            raise ValueError("Unknown sketch version {}".format(version))
+        sketch = cls(alpha)
+        sketch.zeros = zeros
+        offset = cls._HEADER.size
+        for buckets, nr in ((sketch.positive, nr_positive),
+                            (sketch.negative, nr_negative)):
+            for _ in range(nr):
+                index, count = cls._BUCKET.unpack_from(data, offset)
+                buckets[index] = count
+                offset += cls._BUCKET.size
+        return sketch
+
+
+class Aggregate(object):
+    """count, sum, min, max and sketch of one metric in one bucket."""
+
+    def __init__(self):
+        self.operator = None
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.sketch = Sketch()
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.sketch.add(value)
+
+    def merge(self, other):
+        self.count += other.count
+        self.sum += other.sum
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+        self.sketch.merge(other.sketch)
+        if other.operator is not None:
+            self.operator = other.operator
+
+    def quantile(self, q):
+        return self.sketch.quantile(q)
+
+
+def _is_number(value):
+    return isinstance(value, Number) and not isinstance(value, bool)
+
+
+class RollupAggregator(object):
+    """
+    Collects hourly aggregates of the imported entries.
+
+    add() is called by the worker threads for every inserted entry, flush()
+    writes and resets the aggregates once per scan. The partitions written
+    are compacted by compact_if_due() once their hours are finished.
+    """
+
+    def __init__(self, rollups=None):
+        self.rollups = ROLLUPS if rollups is None else rollups
+        self._aggregates = {}
+        self._lock = Lock()
+        self._statements = None
+        # (NodeId, Iccid, Bucket) -> last hour written
+        self._written = {}
+        self._compacted = time.time()
+
+    def prepare(self, session):
+        """Prepare the statements, must be called before flush()."""
+        self._statements = prepare_statements(session)
+
+    def add(self, entry):
+        """Add the rolled up values of entry (a parsed JSON object)."""
+        metrics = self.rollups.get(entry.get('DataId'))
+        if metrics is None:
+            return
+        timestamp = entry.get('Timestamp')
+        if not _is_number(timestamp):
+            return
+        hour = int(timestamp // BUCKET_SECONDS) * BUCKET_SECONDS
+        node_id = str(entry.get('NodeId'))
+        iccid = str(entry.get('Iccid', entry.get('ICCID')))
+        with self._lock:
+            for metric, key in metrics:
+                value = entry.get(key)
+                if not _is_number(value):
+                    continue
+                bucket = (node_id, iccid, hour, metric)
+                aggregate = self._aggregates.get(bucket)
+                if aggregate is None:
+                    aggregate = self._aggregates[bucket] = Aggregate()
+                aggregate.add(value)
+                if entry.get('Operator') is not None:
+                    aggregate.operator = entry.get('Operator')
+
+    def __len__(self):
+        return len(self._aggregates)
+
+    def flush(self, session):
+        """
+        Write one partial row per bucket and reset the aggregates.
+
+        Returns the number of rows written.
+        """
+        with self._lock:
+            aggregates = self._aggregates
+            self._aggregates = {}
+        batch_id = uuid.uuid1()
+        futures = []
+        for (node_id, iccid, hour, metric), aggregate in aggregates.items():
+            bucket = monroe_buckets.bucket_start(hour, PARTITION_SECONDS)
+            futures.append(session.execute_async(
+                self._statements['insert'],
+                _row_values(node_id, iccid, bucket, hour, metric, batch_id,
+                            aggregate)))
+            partition = (node_id, iccid, bucket)
+            self._written[partition] = max(hour,
+                                           self._written.get(partition, hour))
+        for future in futures:
+            future.result()
+        return len(futures)
+
+    def track(self, partitions):
+        """Compact partitions ((NodeId, Iccid, Bucket)) too, e.g. old ones."""
+        for partition in partitions:
+            last_hour = partition[2] + PARTITION_SECONDS - BUCKET_SECONDS
+            self._written[partition] = max(
+                last_hour, self._written.get(partition, last_hour))
+
+    def compact(self, session, now=None):
+        """
+        Compact the finished hours of the partitions written.
+
+        Partitions are forgotten once all their hours written are finished
+        (and compacted). Returns the number of (hour, metric) rewritten.
+        """
+        if now is None:
+            now = time.time()
+        before = int((now - FINISHED_AFTER) // BUCKET_SECONDS) * BUCKET_SECONDS
+        nr_compacted = 0
+        for partition, last_hour in sorted(self._written.items()):
+            nr_compacted += compact_partition(session,
+                                              self._statements,
+                                              partition,
+                                              before)
+            if last_hour < before:
+                del self._written[partition]
+        self._compacted = time.time()
+        return nr_compacted
+
+    def compact_if_due(self, session, interval=3600):
+        """Compact if the last compaction is older than interval seconds."""
+        if time.time() - self._compacted < interval:
+            return 0
+        return self.compact(session)
+
+
+def prepare_statements(session):
+    """Return the prepared statements of flush() and compact_partition()."""
+    return {'insert': session.prepare(INSERT_QUERY),
+            'select': session.prepare(SELECT_QUERY),
+            'delete': session.prepare(DELETE_QUERY)}
+
+
+def _row_values(node_id, iccid, bucket, hour, metric, batch_id, aggregate):
+    return (node_id,
+            iccid,
+            bucket,
+            hour,
+            metric,
+            batch_id,
+            aggregate.operator,
+            aggregate.count,
+            aggregate.sum,
+            aggregate.min,
+            aggregate.max,
+            aggregate.sketch.to_bytes())
+
+
+def compact_partition(session, statements, partition, before):
+    """
+    Merge the partial rows of the hours before before of partition.
+
+    partition is (NodeId, Iccid, Bucket), statements as returned by
+    prepare_statements(). The partial rows of an (hour, metric) are replaced
+    by their merge in one (single partition, so atomic) logged batch; rows
+    written meanwhile are not deleted and are merged by the next compaction.
+    Returns the number of (hour, metric) rewritten.
+    """
+    from cassandra.query import BatchStatement
+    (node_id, iccid, bucket) = partition
+    partials = {}
+    for row in session.execute(statements['select'],
+                               (node_id, iccid, bucket, bucket, before)):
+        partials.setdefault((row['hour'], row['metric']), []).append(row)
+    nr_compacted = 0
+    for (hour, metric), rows in sorted(partials.items()):
+        if len(rows) < 2:
+            continue
+        aggregate = merge_rows(rows)[(hour, metric)]
+        batch = BatchStatement()
+        batch.add(statements['insert'],
+                  _row_values(node_id, iccid, bucket, hour, metric,
+                              uuid.uuid1(), aggregate))
+        for row in rows:
+            batch.add(statements['delete'],
+                      (node_id, iccid, bucket, hour, metric, row['batchid']))
+        session.execute(batch)
+        nr_compacted += 1
+    return nr_compacted
+
+
+def all_partitions(session):
+    """Return the (NodeId, Iccid, Bucket) of all rollup partitions."""
+    return [(row['nodeid'], row['iccid'], row['bucket'])
+            for row in session.execute(PARTITIONS_QUERY)]
+
+
+def merge_rows(rows):
+    """
+    Merge partial rollup rows into {(hour, metric): Aggregate}.
+
+    rows are dicts as returned by the driver with dict_factory.
+    """
+    merged = {}
+    for row in rows:
+        partial = Aggregate()
+        partial.operator = row['operator']
+        partial.count = row['valuecount']
+        partial.sum = row['valuesum']
+        partial.min = row['valuemin']
+        partial.max = row['valuemax']
+        partial.sketch = Sketch.from_bytes(row['sketch'])
+        key = (row['hour'], row['metric'])
+        if key in merged:
+            merged[key].merge(partial)
+        else:
+            merged[key] = partial
+    return merged
+
+
+def read_rollups(session, node_id, iccid, start_hour, end_hour):
+    """Return {(hour, metric): Aggregate} for hours in [start_hour, end_hour)."""
+    statement = session.prepare(SELECT_QUERY)
+    rows = []
+    for bucket in monroe_buckets.bucket_range(start_hour, end_hour,
+                                              PARTITION_SECONDS):
+        rows.extend(session.execute(statement,
+                                    (str(node_id),
+                                     str(iccid),
+                                     bucket,
+                                     start_hour,
+                                     end_hour)))
+    return merge_rows(rows)
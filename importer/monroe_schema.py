@@ -0,0 +1,181 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Table definitions read from a CQL schema file (db_schema.cql).
+
+load_schema() returns the columns, partition key, clustering key and
+clustering order (WITH CLUSTERING ORDER BY) of every CREATE TABLE. Used by
+the bulk output of monroe_dbimporter (monroe_bulk) and by the example query
+client (examples/MonroeDB.py). Names are lowercase, as Cassandra stores
+them.
+"""
+from collections import namedtuple
+from decimal import Decimal
+import functools
+import re
+
+Table = namedtuple('Table', ['name',
+                             'columns',
+                             'partition_key',
+                             'clustering_key',
+                             'clustering_order',
+                             'statement'])
+
+_COMMENTS = re.compile(r'/\*.*?\*/|//[^\n]*', re.DOTALL)
+_CREATE_TABLE = re.compile(r'CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?'
+                           r'(?:\w+\.)?(\w+)\s*\(',
+                           re.IGNORECASE)
+_PRIMARY_KEY = re.compile(r'PRIMARY\s+KEY\s*\((.*)\)\s*$',
+                          re.DOTALL | re.IGNORECASE)
+_CLUSTERING_ORDER = re.compile(r'CLUSTERING\s+ORDER\s+BY\s*\(([^)]*)\)',
+                               re.IGNORECASE)
+
+
+def _split_columns(body):
+    """Split a CREATE TABLE body on the commas outside parentheses/<>."""
+    parts = []
+    depth = 0
+    start = 0
+    for i, char in enumerate(body):
+        if char in '(<':
+            depth += 1
+        elif char in ')>':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            parts.append(body[start:i].strip())
+            start = i + 1
+    parts.append(body[start:].strip())
+    return [part for part in parts if part]
+
+
+def _names(text):
+    return [name.strip().lower() for name in text.split(',') if name.strip()]
+
+
+def _closing_parenthesis(cql, start):
+    """Return the index of the ) matching the ( before cql[start]."""
+    depth = 1
+    for i in range(start, len(cql)):
+        if cql[i] == '(':
+            depth += 1
+        elif cql[i] == ')':
+            depth -= 1
+            if depth == 0:
+                return i
+    raise ValueError("Unbalanced parentheses in CREATE TABLE")
+
+
+def _parse_table(name, body, options):
+    columns = {}
+    partition_key = []
+    clustering_key = []
+    for part in _split_columns(body):
+        primary_key = _PRIMARY_KEY.match(part)
+        if primary_key is not None:
+            key = primary_key.group(1).strip()
+            if key.startswith('('):
+                end = key.index(')')
+                partition_key = _names(key[1:end])
+                clustering_key = _names(key[end + 1:])
+            else:
+                names = _names(key)
+                partition_key = names[:1]
+                clustering_key = names[1:]
+        else:
+            column, cql_type = part.split(None, 1)
+            columns[column.lower()] = cql_type.strip().lower()
+    clustering_order = dict((column, 'asc') for column in clustering_key)
+    order = _CLUSTERING_ORDER.search(options)
+    if order is not None:
+        for component in _names(order.group(1)):
+            words = component.split()
+            if words[0] not in clustering_order:
+                raise ValueError("{} in the clustering order of {} is not a "
+                                 "clustering column".format(words[0], name))
+            clustering_order[words[0]] = words[1] if len(words) > 1 else 'asc'
+    statement = 'CREATE TABLE {} ({}){};'.format(name,
+                                                body.strip(),
+                                                options.rstrip())
+    return Table(name,
+                 columns,
+                 partition_key,
+                 clustering_key,
+                 clustering_order,
+                 statement)
+
+
+def load_schema(path):
+    """Return {table name: Table} of the tables created in the CQL file."""
+    with open(path, 'r') as f:
+        cql = _COMMENTS.sub('', f.read())
+    tables = {}
+    position = 0
+    while True:
+        match = _CREATE_TABLE.search(cql, position)
+        if match is None:
+            break
+        # The body ends at the matching parenthesis, the table options
+        # (e.g. WITH CLUSTERING ORDER BY (...)) at the ;
+        end = _closing_parenthesis(cql, match.end())
+        options_end = cql.find(';', end)
+        if options_end < 0:
+            options_end = len(cql)
+        name = match.group(1).lower()
+        tables[name] = _parse_table(name,
+                                    cql[match.end():end],
+                                    cql[end + 1:options_end])
+        position = options_end
+    return tables
+
+
+@functools.total_ordering
+class Descending(object):
+    """A value sorting in reverse order (DESC clustering columns)."""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __hash__(self):
+        return hash(self.value)
+
+    def __repr__(self):
+        return 'Descending({!r})'.format(self.value)
+
+
+def _sort_value(value):
+    # Decimal columns (e.g. Timestamp) may be floats or strings in the JSON
+    if isinstance(value, float):
+        return Decimal(repr(value))
+    return value
+
+
+def clustering_values(table, row):
+    """
+    Return the clustering key of row as sortable values, in storage order.
+
+    The values of DESC clustering columns are wrapped in Descending.
+    """
+    values = []
+    for column in table.clustering_key:
+        if row.get(column) is None:
+            raise ValueError("Missing clustering key {}".format(column))
+        value = _sort_value(row[column])
+        if table.clustering_order.get(column) == 'desc':
+            value = Descending(value)
+        values.append(value)
+    return values
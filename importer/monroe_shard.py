@@ -0,0 +1,245 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Several monroe_dbimporter instances cooperating on one --indir.
+
+Each file belongs to one of N shards, by the CRC-32 of its directory
+relative to --indir (ie all files of a node directory are in the same
+shard), or of its name for the files at the top of --indir. Instance K
+(--shard K --shards N) handles shard K and only touches the files of the
+shards it holds a lease on, so no two instances rename, insert or move the
+same file.
+
+Leases are files in a directory shared by all instances (--lease-dir, on the
+same filesystem as --indir for hosts sharing it):
+  shard-<k>.lease  JSON {owner, shard, acquired}, its mtime is renewed by a
+                   heartbeat thread every lease_timeout / 3 seconds
+A lease is created with O_EXCL, so only one instance can hold it. A lease
+not renewed for lease_timeout seconds belongs to a dead instance and is
+taken over: it is renamed away (only one instance can rename it) and
+created again; if it was renewed meanwhile it is put back.
+
+An instance holds the lease of its own shard as long as it runs (and
+releases it when it exits). Before each scan it also takes over the shards
+whose lease is stale, and releases them after the scan. Missing leases are
+only taken over once the instance has run for grace seconds (lease_timeout
+by default), so the instances of a staggered start get their own shard
+first. A released shard is not taken over again for lease_timeout seconds,
+so its returning owner gets it back with its next heartbeat.
+
+The importer checks owns() again when a worker starts on a file, as the
+heartbeat may lose a lease during a long scan.
+"""
+from threading import Event, Lock, Thread
+import errno
+import json
+import os
+import socket
+import time
+import uuid
+import zlib
+
+
+def shard_of(path, in_dir, shards):
+    """Return the shard of the file path in in_dir."""
+    key = os.path.relpath(os.path.dirname(path), in_dir)
+    if key == os.curdir:
+        key = os.path.basename(path)
+    if not isinstance(key, bytes):
+        key = key.encode('utf-8')
+    return (zlib.crc32(key) & 0xffffffff) % shards
+
+
+class ShardLeases(object):
+    """
+    Shard leases of one importer instance, see the module docstring.
+
+    log is called with (message, is_error) on lease changes.
+    """
+
+    def __init__(self,
+                 lease_dir,
+                 shard,
+                 shards,
+                 lease_timeout=300,
+                 log=None,
+                 grace=None):
+        self.lease_dir = lease_dir
+        self.shard = shard
+        self.shards = shards
+        self.lease_timeout = lease_timeout
+        self.grace = lease_timeout if grace is None else grace
+        self._started = time.time()
+        self.owner = "{}:{}:{}".format(socket.gethostname(),
+                                       os.getpid(),
+                                       uuid.uuid4().hex[:8])
+        self._log = log or (lambda message, is_error: None)
+        self._lock = Lock()
+        self._held = set()
+        self._takeovers = set()
+        # shard -> time it was released after a takeover
+        self._released = {}
+        self._stop = Event()
+        self._heartbeat = None
+        if not os.path.isdir(lease_dir):
+            try:
+                os.makedirs(lease_dir)
+            except OSError as error:
+                # Created by another instance
+                if error.errno != errno.EEXIST:
+                    raise
+
+    def _path(self, shard):
+        return os.path.join(self.lease_dir, "shard-{}.lease".format(shard))
+
+    def _read(self, path):
+        """Return (mtime, content) of a lease, None if it does not exist."""
+        try:
+            mtime = os.stat(path).st_mtime
+            with open(path, 'r') as f:
+                return (mtime, f.read())
+        except (IOError, OSError):
+            return None
+
+    def _create(self, shard):
+        try:
+            fd = os.open(self._path(shard),
+                         os.O_CREAT | os.O_EXCL | os.O_WRONLY,
+                         0o644)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+            return False
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'owner': self.owner,
+                       'shard': shard,
+                       'acquired': time.time()}, f)
+        return True
+
+    def _is_mine(self, content):
+        try:
+            return json.loads(content)['owner'] == self.owner
+        except (ValueError, KeyError, TypeError):
+            return False
+
+    def _acquire(self, shard):
+        """Create or take over the lease of shard, return True if held."""
+        if self._create(shard):
+            return True
+        path = self._path(shard)
+        lease = self._read(path)
+        if lease is None:
+            # Released meanwhile, try again next time
+            return False
+        (mtime, content) = lease
+        if self._is_mine(content):
+            return True
+        if time.time() - mtime < self.lease_timeout:
+            return False
+        stale_path = "{}.{}.stale".format(path, self.owner)
+        try:
+            os.rename(path, stale_path)
+        except OSError:
+            # Taken over by another instance
+            return False
+        if self._read(stale_path) != lease:
+            # Renewed or taken over after it was read: put it back
+            try:
+                os.link(stale_path, path)
+            except OSError:
+                pass
+            os.unlink(stale_path)
+            return False
+        os.unlink(stale_path)
+        self._log("Took over stale lease of shard {} ({})".format(shard,
+                                                                 content),
+                  False)
+        return self._create(shard)
+
+    def _release(self, shard):
+        path = self._path(shard)
+        lease = self._read(path)
+        if lease is not None and self._is_mine(lease[1]):
+            os.unlink(path)
+
+    def _renew(self):
+        """Renew the held leases, drop the lost ones, reacquire own shard."""
+        with self._lock:
+            for shard in sorted(self._held):
+                lease = self._read(self._path(shard))
+                if lease is not None and self._is_mine(lease[1]):
+                    os.utime(self._path(shard), None)
+                    continue
+                self._held.discard(shard)
+                self._takeovers.discard(shard)
+                self._log("Lost lease of shard {}".format(shard), True)
+            if self.shard not in self._held and self._acquire(self.shard):
+                self._held.add(self.shard)
+                self._log("Acquired lease of shard {}".format(self.shard),
+                          False)
+
+    def _run(self):
+        while not self._stop.wait(self.lease_timeout / 3.0):
+            try:
+                self._renew()
+            except Exception as error:
+                self._log("Error in renewing leases {}".format(error), True)
+
+    def start(self):
+        """Acquire the own shard (if free) and start the heartbeat thread."""
+        self._renew()
+        self._heartbeat = Thread(target=self._run)
+        self._heartbeat.daemon = True
+        self._heartbeat.start()
+
+    def claim(self):
+        """Take over the free shards before a scan, return the shards held."""
+        with self._lock:
+            in_grace = time.time() - self._started < self.grace
+            for shard in range(self.shards):
+                if shard in self._held:
+                    continue
+                released = self._released.get(shard, 0)
+                if time.time() - released < self.lease_timeout:
+                    continue
+                if in_grace and self._read(self._path(shard)) is None:
+                    # Its instance may not have started yet
+                    continue
+                if self._acquire(shard):
+                    self._held.add(shard)
+                    if shard != self.shard:
+                        self._takeovers.add(shard)
+            if self._takeovers:
+                self._log("Handling shard(s) {} of other instances".format(
+                    ", ".join(str(shard) for shard in sorted(self._takeovers))),
+                    False)
+            return set(self._held)
+
+    def owns(self, path, in_dir):
+        """Return True if the file path in in_dir is in a held shard."""
+        with self._lock:
+            return shard_of(path, in_dir, self.shards) in self._held
+
+    def release_takeovers(self):
+        """Release the shards taken over by claim(), after a scan."""
+        with self._lock:
+            for shard in self._takeovers:
+                self._release(shard)
+                self._held.discard(shard)
+                self._released[shard] = time.time()
+            self._takeovers = set()
+
+    def close(self):
+        """Stop the heartbeat and release all leases."""
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+        with self._lock:
+            for shard in self._held:
+                self._release(shard)
+            self._held = set()
+            self._takeovers = set()
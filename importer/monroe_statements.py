@@ -0,0 +1,116 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Prepared INSERT statements of monroe_dbimporter, prepared on first use.
+
+The registry maps a DataId (e.g. monroe.exp.ping) to the prepared
+"INSERT INTO <table> JSON ?" of its table (monroe_exp_ping). Statements are
+prepared when a DataId is first inserted, not for every table at startup.
+The statements of the DataIds in the retention policy (ttl_policy, see
+monroe_retention) are "INSERT INTO <table> JSON ? USING TTL ?".
+
+The tables are read from the cluster metadata, which the driver keeps up to
+date from the schema change events of the cluster. The registry compares
+its tables with the metadata every refresh_interval seconds: statements of
+dropped tables are forgotten, new tables become available (and on_tables is
+called with the new table names) without restarting the importer. The
+metadata is also checked when a DataId without table is first seen; it is
+then remembered as unknown until the next periodic refresh, so the entries
+of unknown DataIds cost a set lookup.
+"""
+from threading import Lock
+import time
+
+
+class StatementRegistry(object):
+    """
+    Mapping of DataId to prepared statement, see the module docstring.
+
+    Supports "data_id in registry" (the table exists) and registry[data_id]
+    (raises KeyError for unknown DataIds), like the dict it replaces.
+    """
+
+    def __init__(self,
+                 session,
+                 keyspace,
+                 refresh_interval=60,
+                 on_tables=None,
+                 ttl_policy=None):
+        self.session = session
+        self.keyspace = keyspace
+        self.refresh_interval = refresh_interval
+        self.ttl_policy = ttl_policy
+        self._on_tables = on_tables
+        self._lock = Lock()
+        self._statements = {}
+        self._unknown = set()
+        self._tables = {}
+        self._refreshed = 0
+        self.refresh()
+
+    def table_names(self):
+        """Return the names of the tables of the keyspace in the metadata."""
+        keyspace = self.session.cluster.metadata.keyspaces.get(self.keyspace)
+        if keyspace is None:
+            return []
+        return list(keyspace.tables.keys())
+
+    def refresh(self, expire_unknown=True):
+        """Compare the tables with the metadata, return True if changed."""
+        table_names = self.table_names()
+        tables = dict((name.replace('_', '.'), name) for name in table_names)
+        with self._lock:
+            if expire_unknown:
+                self._refreshed = time.time()
+                self._unknown = set()
+            if tables == self._tables:
+                return False
+            self._unknown = set()
+            for data_id in list(self._statements):
+                if self._tables.get(data_id) != tables.get(data_id):
+                    del self._statements[data_id]
+            self._tables = tables
+        if self._on_tables is not None:
+            self._on_tables(table_names)
+        return True
+
+    def _refresh_if_due(self):
+        if time.time() - self._refreshed >= self.refresh_interval:
+            self.refresh()
+
+    def __contains__(self, data_id):
+        self._refresh_if_due()
+        return data_id in self._tables
+
+    def __getitem__(self, data_id):
+        self._refresh_if_due()
+        statement = self._statements.get(data_id)
+        if statement is not None:
+            return statement
+        with self._lock:
+            if data_id in self._unknown:
+                raise KeyError(data_id)
+        table_name = self._tables.get(data_id)
+        if table_name is None:
+            # A new table?
+            self.refresh(expire_unknown=False)
+            with self._lock:
+                table_name = self._tables.get(data_id)
+                if table_name is None:
+                    self._unknown.add(data_id)
+                    raise KeyError(data_id)
+        query = 'INSERT INTO {} JSON ?'.format(table_name)
+        if (self.ttl_policy is not None and
+                self.ttl_policy.ttl(data_id) is not None):
+            query += ' USING TTL ?'
+        statement = self.session.prepare(query)
+        with self._lock:
+            # Two threads may prepare the same statement, keep the first
+            return self._statements.setdefault(data_id, statement)
+
+    def __len__(self):
+        return len(self._statements)
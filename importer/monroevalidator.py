@@ -25,7 +25,7 @@ and that the table exist).
 """
 from datetime import datetime, timedelta
 import syslog
-from monroe_dbimporter import log_msg
+from monroe_log import log_msg
 
 # User defined checks should not be called directly
 # Return value: True or "Error message"
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""The importer modules are imported as top-level modules, as the importer does."""
+import os
+import sys
+
+import pytest
+
+IMPORTER_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                            os.pardir)
+SCHEMA_FILE = os.path.join(IMPORTER_DIR, os.pardir, 'db_schema.cql')
+
+sys.path.insert(0, IMPORTER_DIR)
+
+
+@pytest.fixture(scope='session')
+def schema_file():
+    """Path of db_schema.cql."""
+    return SCHEMA_FILE
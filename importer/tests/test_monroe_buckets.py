@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+from datetime import datetime
+
+import monroe_buckets
+from monroe_buckets import DAY, WEEK
+
+
+def utc(timestamp):
+    return datetime.utcfromtimestamp(timestamp)
+
+
+def test_day_buckets():
+    timestamp = 1473940800.25 + 3600 * 5  # 2016-09-15 05:00:00.25 UTC
+    start = monroe_buckets.bucket_start(timestamp, DAY)
+    assert start == 1473897600
+    assert utc(start).hour == 0 and utc(start).day == 15
+    assert monroe_buckets.bucket_start(start, DAY) == start
+    assert monroe_buckets.bucket_start(start - 0.001, DAY) == start - DAY
+
+
+def test_week_buckets_start_on_monday():
+    for timestamp in (0, 3 * DAY, 4 * DAY, 1473940800.5, 1500000000):
+        start = monroe_buckets.bucket_start(timestamp, WEEK)
+        assert utc(start).weekday() == 0
+        assert (utc(start).hour, utc(start).minute) == (0, 0)
+        assert start <= timestamp < start + WEEK
+
+
+def test_bucket_range():
+    start = 1473897600
+    assert monroe_buckets.bucket_range(start, start + DAY, DAY) == [start]
+    assert monroe_buckets.bucket_range(start + 10, start + DAY + 1, DAY) == [
+        start, start + DAY]
+    assert monroe_buckets.bucket_range(start, start, DAY) == []
+    weeks = monroe_buckets.bucket_range(start, start + 14 * DAY, WEEK)
+    assert len(weeks) == 3
+    assert [utc(week).weekday() for week in weeks] == [0, 0, 0]
+
+
+def test_split_table_name():
+    assert monroe_buckets.split_table_name('monroe_exp_ping_by_day') == (
+        'monroe_exp_ping', DAY)
+    assert monroe_buckets.split_table_name(
+        'monroe_exp_http_download_by_week') == ('monroe_exp_http_download',
+                                                WEEK)
+    assert monroe_buckets.split_table_name('monroe_exp_ping') is None
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+import time
+
+import monroe_dedup
+
+
+def test_data_digest():
+    assert monroe_dedup.data_digest(b'') == (
+        'e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855')
+    assert (monroe_dedup.data_digest(b'a') !=
+            monroe_dedup.data_digest(b'b'))
+
+
+def test_index_persists(tmpdir):
+    path = str(tmpdir.join('index'))
+    index = monroe_dedup.DedupIndex(path)
+    digest = monroe_dedup.data_digest(b'{"DataId": "x"}\n')
+    assert digest not in index
+    index.add(digest)
+    assert digest in index
+    index.close()
+    reloaded = monroe_dedup.DedupIndex(path)
+    assert digest in reloaded
+    assert len(reloaded) == 1
+    reloaded.close()
+
+
+def test_expired_hashes_dropped(tmpdir):
+    path = str(tmpdir.join('index'))
+    old = time.time() - 2 * 24 * 3600
+    with open(path, 'w') as f:
+        f.write("{} {:.0f}\n".format('a' * 64, old))
+        f.write("{} {:.0f}\n".format('b' * 64, time.time()))
+        # Cut by a crash
+        f.write('c' * 10)
+    index = monroe_dedup.DedupIndex(path, retention_days=1)
+    assert 'a' * 64 not in index
+    assert 'b' * 64 in index
+    assert len(index) == 1
+    index.close()
+    with open(path, 'r') as f:
+        assert [line.split()[0] for line in f] == ['b' * 64]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+import monroe_geo
+
+RMC = "$GPRMC,123519,A,5939.000,N,01756.000,E,0.0,0.0,150916,,*00"
+
+
+def test_encode():
+    # Reference values of the geohash algorithm
+    assert monroe_geo.encode(57.64911, 10.40744, 11) == 'u4pruydqqvj'
+    assert monroe_geo.encode(42.6, -5.6) == 'ezs42'
+    assert monroe_geo.encode(0, 0, 1) == 's'
+    assert monroe_geo.encode(-90, -180, 3) == '000'
+    # Nearby points share the cell prefix
+    assert (monroe_geo.encode(59.6500, 17.9300)[:4] ==
+            monroe_geo.encode(59.6501, 17.9301)[:4])
+
+
+def test_geo_entry():
+    entry = {'DataId': 'MONROE.META.DEVICE.GPS', 'NodeId': '54',
+             'Timestamp': 1473940800.5, 'SequenceNumber': 1,
+             'Latitude': 59.65, 'Longitude': 17.9333, 'Nmea': RMC,
+             'Guid': 'x'}
+    geo = monroe_geo.geo_entry(entry)
+    assert geo['Geohash'] == monroe_geo.encode(59.65, 17.9333)
+    assert geo['Bucket'] == 1473897600
+    assert 'Nmea' not in geo and 'Guid' not in geo
+    assert geo['NodeId'] == '54'
+    assert monroe_geo.geo_entry(dict(entry, Latitude=91)) is None
+    assert monroe_geo.geo_entry(dict(entry, Longitude='17')) is None
+    assert monroe_geo.geo_entry(dict(entry, Nmea='$GPGGA,1')) is None
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+import monroe_nmea
+
+RMC = ("$GPRMC,123519,A,4807.038,N,01131.000,E,022.4,084.4,230394,003.1,W*6A")
+GGA = ("$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47")
+
+
+def test_sentence_types():
+    assert monroe_nmea.sentence_types(GGA + "\r\n" + RMC) == ['GPGGA',
+                                                            'GPRMC']
+    assert monroe_nmea.sentence_types('') == []
+
+
+def test_rmc_entry():
+    entry = {'DataId': 'MONROE.META.DEVICE.GPS', 'Timestamp': 1.5,
+             'Latitude': 48.1173, 'Longitude': 11.5166, 'Nmea': RMC}
+    rmc = monroe_nmea.rmc_entry(entry)
+    assert 'Nmea' not in rmc
+    assert rmc['Latitude'] == 48.1173
+    assert entry['Nmea'] == RMC
+    assert monroe_nmea.rmc_entry(dict(entry, Nmea=GGA)) is None
+    assert monroe_nmea.rmc_entry(dict(entry, Nmea='')) is None
+    del entry['Nmea']
+    assert monroe_nmea.rmc_entry(entry) is None
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+import sys
+import types
+
+import pytest
+
+import monroe_buckets
+import monroe_rollup
+from monroe_rollup import Sketch
+
+
+def test_sketch_quantiles_within_alpha():
+    sketch = Sketch(alpha=0.01)
+    values = [float(value) for value in range(1, 1001)]
+    for value in values:
+        sketch.add(value)
+    assert sketch.count() == 1000
+    for q in (0.0, 0.1, 0.5, 0.9, 0.99, 1.0):
+        expected = values[int(q * (len(values) - 1))]
+        assert sketch.quantile(q) == pytest.approx(expected, rel=0.01)
+
+
+def test_sketch_negative_and_zero():
+    sketch = Sketch()
+    for value in (-120, -100, -80, 0, 0):
+        sketch.add(value)
+    assert sketch.quantile(0) == pytest.approx(-120, rel=0.01)
+    assert sketch.quantile(0.5) == pytest.approx(-80, rel=0.01)
+    assert sketch.quantile(1) == 0.0
+    assert Sketch().quantile(0.5) is None
+
+
+def test_sketch_merge_and_bytes():
+    first = Sketch()
+    second = Sketch()
+    for value in range(1, 51):
+        first.add(value)
+        second.add(-value)
+    first.merge(second)
+    copy = Sketch.from_bytes(first.to_bytes())
+    assert copy.count() == 100
+    assert copy.positive == first.positive
+    assert copy.negative == first.negative
+    assert copy.quantile(0.75) == first.quantile(0.75)
+    with pytest.raises(ValueError):
+        Sketch.from_bytes(b'\x02' + first.to_bytes()[1:])
+
+
+def test_aggregator_and_merge_rows():
+    aggregator = monroe_rollup.RollupAggregator()
+    for timestamp, rtt in ((3600.5, 10.0), (3700, 30.0), (7300, 5.0)):
+        aggregator.add({'DataId': 'MONROE.EXP.PING', 'Timestamp': timestamp,
+                        'NodeId': 1, 'Iccid': '89', 'Operator': 'op',
+                        'Rtt': rtt})
+    # Not rolled up: no value, unknown DataId, no Timestamp
+    aggregator.add({'DataId': 'MONROE.EXP.PING', 'Timestamp': 3600,
+                    'NodeId': 1, 'Iccid': '89'})
+    aggregator.add({'DataId': 'MONROE.EXP.HTTP', 'Timestamp': 3600,
+                    'NodeId': 1, 'Iccid': '89', 'Rtt': 1.0})
+    aggregator.add({'DataId': 'MONROE.EXP.PING', 'NodeId': 1, 'Rtt': 1.0})
+    assert len(aggregator) == 2
+    aggregate = aggregator._aggregates[('1', '89', 3600, 'ping.rtt')]
+    assert (aggregate.count, aggregate.sum, aggregate.min, aggregate.max) == (
+        2, 40.0, 10.0, 30.0)
+
+    # Two partial rows of an hour are merged
+    rows = [{'hour': 3600, 'metric': 'ping.rtt', 'operator': 'op',
+             'valuecount': aggregate.count, 'valuesum': aggregate.sum,
+             'valuemin': aggregate.min, 'valuemax': aggregate.max,
+             'sketch': aggregate.sketch.to_bytes()}] * 2
+    merged = monroe_rollup.merge_rows(rows)[(3600, 'ping.rtt')]
+    assert (merged.count, merged.sum, merged.min, merged.max) == (
+        4, 80.0, 10.0, 30.0)
+    assert merged.operator == 'op'
+
+
+class BatchStatement(object):
+    def __init__(self):
+        self.statements = []
+
+    def add(self, statement, parameters):
+        self.statements.append((statement, parameters))
+
+
+class Future(object):
+    def result(self):
+        return None
+
+
+class Session(object):
+    """monroe_rollup_hourly as a list of dicts (dict_factory rows)."""
+
+    COLUMNS = ('nodeid', 'iccid', 'bucket', 'hour', 'metric', 'batchid',
+               'operator', 'valuecount', 'valuesum', 'valuemin', 'valuemax',
+               'sketch')
+
+    def __init__(self):
+        self.rows = []
+        self.batches = 0
+
+    def prepare(self, query):
+        return query.split()[0]
+
+    def execute_async(self, statement, parameters):
+        self.execute(statement, parameters)
+        return Future()
+
+    def execute(self, statement, parameters=None):
+        if isinstance(statement, BatchStatement):
+            self.batches += 1
+            for statement, parameters in statement.statements:
+                self.execute(statement, parameters)
+        elif statement == 'INSERT':
+            self.rows.append(dict(zip(self.COLUMNS, parameters)))
+        elif statement == 'DELETE':
+            key = dict(zip(self.COLUMNS, parameters))
+            self.rows = [row for row in self.rows
+                         if any(row[column] != value
+                                for column, value in key.items())]
+        elif statement == 'SELECT':
+            (node_id, iccid, bucket, start, end) = parameters
+            return [row for row in self.rows
+                    if (row['nodeid'], row['iccid'], row['bucket']) ==
+                    (node_id, iccid, bucket) and start <= row['hour'] < end]
+        else:
+            raise ValueError(statement)
+
+
+def _ping(aggregator, timestamp, rtt):
+    aggregator.add({'DataId': 'MONROE.EXP.PING', 'Timestamp': timestamp,
+                    'NodeId': 1, 'Iccid': '89', 'Rtt': rtt})
+
+
+def test_compact_finished_hours(monkeypatch):
+    cassandra = types.ModuleType('cassandra')
+    query = types.ModuleType('cassandra.query')
+    query.BatchStatement = BatchStatement
+    monkeypatch.setitem(sys.modules, 'cassandra', cassandra)
+    monkeypatch.setitem(sys.modules, 'cassandra.query', query)
+
+    session = Session()
+    aggregator = monroe_rollup.RollupAggregator()
+    aggregator.prepare(session)
+    week = monroe_buckets.bucket_start(10 * monroe_buckets.WEEK,
+                                       monroe_buckets.WEEK)
+    # Three scans with values of the same hours
+    for rtt in (10.0, 20.0, 30.0):
+        _ping(aggregator, week + 3600, rtt)
+        _ping(aggregator, week + 5 * 24 * 3600, rtt)
+        assert aggregator.flush(session) == 2
+    assert len(session.rows) == 6
+    assert all(row['bucket'] == week for row in session.rows)
+
+    # Only the first hour is finished 2 days later
+    now = week + 2 * 24 * 3600
+    assert aggregator.compact(session, now) == 1
+    assert session.batches == 1
+    assert len(session.rows) == 4
+    merged = monroe_rollup.read_rollups(session, 1, '89', week, week + 7200)
+    aggregate = merged[(week + 3600, 'ping.rtt')]
+    assert (aggregate.count, aggregate.sum, aggregate.min, aggregate.max) == (
+        3, 60.0, 10.0, 30.0)
+    # Compacted hours are left as they are
+    assert aggregator.compact(session, now) == 0
+
+    # The partition is forgotten once its hours written are all finished
+    assert aggregator.compact(session, week + 7 * 24 * 3600) == 1
+    assert len(session.rows) == 2
+    assert aggregator._written == {}
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+import os
+import tempfile
+
+import pytest
+
+import monroe_schema
+
+
+@pytest.fixture(scope='module')
+def tables(schema_file):
+    return monroe_schema.load_schema(schema_file)
+
+
+def test_every_table_has_keys(tables):
+    assert len(tables) > 20
+    for table in tables.values():
+        assert table.partition_key, table.name
+        for column in table.partition_key + table.clustering_key:
+            assert column in table.columns, (table.name, column)
+        assert 'primary' not in table.columns, table.name
+
+
+@pytest.mark.parametrize('name', ['monroe_exp_nettest', 'monroe_exp_udp_ping'])
+def test_clustering_order(tables, name):
+    table = tables[name]
+    assert table.partition_key == ['nodeid']
+    assert table.clustering_key == ['timestamp', 'iccid', 'sequencenumber']
+    assert table.clustering_order == {'timestamp': 'desc',
+                                      'iccid': 'asc',
+                                      'sequencenumber': 'desc'}
+    assert table.columns['rtt' if name.endswith('ping') else 'nodeid']
+    assert table.statement.endswith(
+        'WITH CLUSTERING ORDER BY '
+        '(Timestamp DESC, ICCID ASC, SequenceNumber DESC);')
+
+
+def test_composite_partition_key(tables):
+    table = tables['monroe_exp_ping_by_day']
+    assert table.partition_key == ['nodeid', 'iccid', 'bucket']
+    assert table.clustering_key == ['timestamp', 'sequencenumber']
+    assert table.columns['bucket'] == 'bigint'
+
+
+def test_clustering_values_desc():
+    fd, path = tempfile.mkstemp(suffix='.cql')
+    with os.fdopen(fd, 'w') as f:
+        f.write("CREATE TABLE t (k text, a int, b text, v map<text, int>,\n"
+                "    PRIMARY KEY ((k), a, b)\n"
+                ") WITH CLUSTERING ORDER BY (a DESC, b ASC);\n")
+    try:
+        table = monroe_schema.load_schema(path)['t']
+    finally:
+        os.unlink(path)
+    assert table.columns == {'k': 'text', 'a': 'int', 'b': 'text',
+                             'v': 'map<text, int>'}
+    rows = [{'k': 'x', 'a': a, 'b': b} for a, b in
+            [(1, 'p'), (3, 'q'), (2, 'p'), (3, 'p'), (1.5, 'r')]]
+    rows.sort(key=lambda row: monroe_schema.clustering_values(table, row))
+    assert [(row['a'], row['b']) for row in rows] == [
+        (3, 'p'), (3, 'q'), (2, 'p'), (1.5, 'r'), (1, 'p')]
+    with pytest.raises(ValueError):
+        monroe_schema.clustering_values(table, {'k': 'x', 'a': 1})
+
+
+def test_bulk_sort_key(schema_file):
+    pytest.importorskip('cassandra')
+    import monroe_bulk
+    table = monroe_bulk.load_schema(schema_file)['monroe_exp_udp_ping']
+    row = {'nodeid': '54', 'timestamp': 2.5, 'iccid': 'a',
+           'sequencenumber': 1}
+    later = dict(row, timestamp=3.5)
+    # Same partition, the later row first (Timestamp DESC)
+    assert monroe_bulk.sort_key(table, later) < monroe_bulk.sort_key(table,
+                                                                     row)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+import os
+import time
+
+import pytest
+
+import monroe_shard
+
+
+@pytest.fixture
+def lease_dir(tmpdir):
+    return str(tmpdir.join('leases'))
+
+
+def leases(lease_dir, shard, grace=None):
+    instance = monroe_shard.ShardLeases(lease_dir, shard, 2, 300, grace=grace)
+    instance.start()
+    return instance
+
+
+def test_shard_of():
+    in_dir = '/in'
+    shard = monroe_shard.shard_of('/in/node1/a.json', in_dir, 7)
+    assert 0 <= shard < 7
+    # All files of a directory are in the same shard
+    for name in ['b.json', 'c.xz']:
+        assert monroe_shard.shard_of('/in/node1/' + name, in_dir, 7) == shard
+    names = ['/in/{}.json'.format(i) for i in range(50)]
+    assert len(set(monroe_shard.shard_of(name, in_dir, 7)
+                   for name in names)) > 1
+
+
+def test_missing_lease_not_taken_during_grace(lease_dir):
+    first = leases(lease_dir, 0)
+    try:
+        assert first.claim() == set([0])
+        # The instance of shard 1 starts later and gets its own shard
+        second = leases(lease_dir, 1)
+        assert second.claim() == set([1])
+        second.close()
+    finally:
+        first.close()
+
+
+def test_missing_lease_taken_after_grace(lease_dir):
+    first = leases(lease_dir, 0, grace=0)
+    try:
+        assert first.claim() == set([0, 1])
+        first.release_takeovers()
+        assert not os.path.exists(os.path.join(lease_dir, 'shard-1.lease'))
+        # Not taken over again right away
+        assert first.claim() == set([0])
+    finally:
+        first.close()
+
+
+def test_stale_lease_taken_over(lease_dir):
+    first = leases(lease_dir, 0)
+    second = leases(lease_dir, 1)
+    try:
+        assert first.claim() == set([0])
+        # The second instance stops renewing its lease
+        stale = time.time() - 600
+        os.utime(os.path.join(lease_dir, 'shard-1.lease'), (stale, stale))
+        assert first.claim() == set([0, 1])
+        path = [path for path in ['/in/{}/a.json'.format(i) for i in range(20)]
+                if monroe_shard.shard_of(path, '/in', 2) == 1][0]
+        assert first.owns(path, '/in')
+        # Its heartbeat finds the lease lost and does not take it back
+        second._renew()
+        assert not second.owns(path, '/in')
+        first.release_takeovers()
+        assert first.claim() == set([0])
+    finally:
+        second.close()
+        first.close()
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+import io
+import json
+import os
+import shutil
+import tarfile
+
+import pytest
+
+import monroe_archive
+import monroe_dbimporter
+import monroevalidator
+
+
+class Session(object):
+    """Fails the inserts of the entries of the NodeIds in failing."""
+
+    def __init__(self, failing):
+        self.failing = failing
+        self.inserted = []
+
+    def execute(self, statement, parameters):
+        entry = json.loads(parameters[0])
+        if entry['NodeId'] in self.failing:
+            raise Exception("Timeout")
+        self.inserted.append(entry['NodeId'])
+
+
+class Statements(object):
+    def __contains__(self, data_id):
+        return True
+
+    def __getitem__(self, data_id):
+        return 'INSERT INTO {} JSON ?'.format(data_id.replace('.', '_'))
+
+
+@pytest.fixture
+def dirs(tmpdir, monkeypatch):
+    monkeypatch.setattr(monroe_dbimporter, 'SIDECARS', True)
+    monkeypatch.setattr(monroevalidator, 'check',
+                        lambda entry, verbosity: (True, ''))
+    paths = {}
+    for name in ('in', 'failed', 'processed'):
+        paths[name] = str(tmpdir.mkdir(name))
+    return paths
+
+
+def test_sidecar_roundtrip(tmpdir):
+    path = str(tmpdir.join('a.json'))
+    assert monroe_dbimporter.read_sidecar(path) is None
+    monroe_dbimporter.write_sidecar(path + '.failed', 5,
+                                    [(1, 'Timeout'), (4, 'Timeout')])
+    assert monroe_dbimporter.read_sidecar(path) == [1, 4]
+    with open(path + '.failed', 'r') as f:
+        assert json.load(f)['records'] == 5
+
+
+def test_partly_failed_file_replayed(dirs):
+    path = os.path.join(dirs['in'], 'a.json')
+    with open(path, 'w') as f:
+        for node_id in ('1', '2', '3'):
+            f.write(json.dumps({'DataId': 'MONROE.EXP.PING',
+                                'NodeId': node_id,
+                                'Timestamp': 1}))
+            f.write('\n')
+    session = Session(['2'])
+    result = monroe_dbimporter.handle_file(path, dirs['failed'],
+                                           dirs['processed'], session,
+                                           Statements())
+    assert result == {'inserts': 2, 'failed': 1}
+    assert session.inserted == ['1', '3']
+    # Moved as-is with the sidecar of the failed record
+    failed_path = os.path.join(dirs['failed'], 'a.json')
+    assert sorted(os.listdir(dirs['failed'])) == ['a.json', 'a.json.failed']
+    assert monroe_dbimporter.read_sidecar(failed_path) == [1]
+
+    # Moved back: only the failed record is inserted again
+    for name in ('a.json', 'a.json.failed'):
+        shutil.move(os.path.join(dirs['failed'], name), dirs['in'])
+    session = Session([])
+    result = monroe_dbimporter.handle_file(path, dirs['failed'],
+                                           dirs['processed'], session,
+                                           Statements())
+    assert result == {'inserts': 1, 'failed': 0}
+    assert session.inserted == ['2']
+    assert os.listdir(dirs['in']) == []
+    assert os.listdir(dirs['processed']) == ['a.json']
+
+
+def _add_member(tar, name, text):
+    data = text.encode('utf-8')
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def test_archive_sidecars(tmpdir):
+    path = str(tmpdir.join('failed-2017-03-01.tar'))
+    with tarfile.open(path, 'w') as tar:
+        _add_member(tar, 'b.json.failed', '{}')
+        _add_member(tar, 'a.json', 'A')
+        _add_member(tar, 'a.json.failed', '{}')
+        _add_member(tar, 'b.json', 'B')
+        _add_member(tar, 'c.json', 'C')
+    members = list(monroe_archive.iter_members_with_sidecars(path, '.failed'))
+    # Sidecars stored before or right after their member
+    assert members == [('a.json', b'A', b'{}'),
+                       ('b.json', b'B', b'{}'),
+                       ('c.json', b'C', None)]
+    assert [name for name, data in monroe_archive.iter_members(path)] == [
+        'a.json', 'b.json', 'c.json']
+
+
+def test_archived_failed_file_replayed(dirs):
+    # A backup of the failed dir with a partly failed file and its sidecar
+    records = '\n'.join(json.dumps({'DataId': 'MONROE.EXP.PING',
+                                    'NodeId': node_id,
+                                    'Timestamp': 1})
+                        for node_id in ('1', '2', '3'))
+    sidecar = json.dumps({'records': 3, 'failed': [[1, 'Timeout'],
+                                                   [2, 'Timeout']]})
+    path = os.path.join(dirs['in'], 'failed-2017-03-01.tar')
+    with tarfile.open(path, 'w') as tar:
+        _add_member(tar, '2017-03-01/a.json', records)
+        _add_member(tar, '2017-03-01/a.json.failed', sidecar)
+    session = Session(['3'])
+    result = monroe_dbimporter.handle_archive(path, dirs['failed'],
+                                              dirs['processed'], session,
+                                              Statements())
+    assert result == {'inserts': 1, 'failed': 1, 'duplicates': 0}
+    # Only the failed records are inserted again
+    assert session.inserted == ['2']
+    # The member is written back with the sidecar of the record failing again
+    failed_path = os.path.join(dirs['failed'],
+                               'failed-2017-03-01_2017-03-01_a.json')
+    assert sorted(os.listdir(dirs['failed'])) == [
+        'failed-2017-03-01_2017-03-01_a.json',
+        'failed-2017-03-01_2017-03-01_a.json.failed']
+    assert monroe_dbimporter.read_sidecar(failed_path) == [2]
+    assert os.listdir(dirs['processed']) == ['failed-2017-03-01.tar']